@@ -0,0 +1,80 @@
+import io
+import asyncio
+import tempfile
+import logging
+import config
+import http_sessions
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+class Attachment:
+    # A downloaded file kept in memory. Past ATTACHMENT_SPOOL_MAX_MEMORY bytes it spills
+    # to an anonymous temp file, so large uploads don't pile up in RAM and never
+    # collide by name on disk.
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.buffer = io.BytesIO()
+        self.size = 0
+
+    def write(self, chunk):
+        if self.size + len(chunk) > config.ATTACHMENT_SPOOL_MAX_MEMORY and isinstance(self.buffer, io.BytesIO):
+            spilled = tempfile.TemporaryFile()
+            spilled.write(self.buffer.getbuffer())
+            self.buffer.close()
+            self.buffer = spilled
+        self.buffer.write(chunk)
+        self.size += len(chunk)
+
+    def rewind(self):
+        # Returns the buffer (a BytesIO, or the temp file once spilled) positioned at the
+        # start, ready for an upload. Both are real file objects, which slack_sdk and
+        # discord.File need; SpooledTemporaryFile only counts as one from Python 3.11.
+        self.buffer.seek(0)
+        return self.buffer
+
+    def close(self):
+        self.buffer.close()
+
+async def download_attachment(session, url, filename, headers=None):
+    # Function to stream a file from url straight into an Attachment buffer
+    attachment = Attachment(filename)
+    try:
+        async with session.get(url, headers=headers) as response:
+            if response.status != 200:
+                log.info('Failed to download file: %s, Status: %s', url, response.status)
+                attachment.close()
+                return None
+
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                attachment.write(chunk)
+    except Exception as e:
+        log.info('Error downloading file from %s: %s', url, e)
+        attachment.close()
+        return None
+
+    log.info('Downloaded file: %s (%s bytes)', filename, attachment.size)
+    attachment.rewind()
+    return attachment
+
+async def download_attachments(files):
+    # Function to download (url, filename, headers) items concurrently over pooled sessions,
+    # at most ATTACHMENT_DOWNLOAD_CONCURRENCY at a time. Keeps the input order.
+    semaphore = asyncio.Semaphore(config.ATTACHMENT_DOWNLOAD_CONCURRENCY)
+
+    async def download(url, filename, headers):
+        async with semaphore:
+            return await download_attachment(http_sessions.get_session(url), url, filename, headers=headers)
+
+    results = await asyncio.gather(*(download(url, filename, headers) for url, filename, headers in files))
+    return [attachment for attachment in results if attachment]
+
+def close_attachments(attachments):
+    """Release attachment buffers after they have been uploaded."""
+    for attachment in attachments or []:
+        try:
+            attachment.close()
+        except Exception as e:
+            log.info('Error closing attachment %s: %s', attachment.filename, e)
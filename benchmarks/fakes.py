@@ -0,0 +1,390 @@
+import re
+import hmac
+import json
+import time
+import socket
+import asyncio
+import hashlib
+import itertools
+import threading
+from urllib.parse import parse_qsl
+from aiohttp import web
+import aiohttp
+import discord
+from pymongo.errors import DuplicateKeyError
+
+# Every benchmark message carries a marker like "bench-12-3" so its arrival can be matched
+MARKER_PATTERN = re.compile(r'bench-\d+-\d+')
+
+BOT_USER_ID = 'UBENCHBOT'
+BOT_ID = 'BBENCHBOT'
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def sign(signing_secret, body, timestamp=None):
+    # Slack request signing: v0=HMAC-SHA256(secret, "v0:<timestamp>:<body>")
+    timestamp = str(int(timestamp or time.time()))
+    digest = hmac.new(signing_secret.encode(), b'v0:' + timestamp.encode() + b':' + body, hashlib.sha256).hexdigest()
+    return {
+        'Content-Type': 'application/json',
+        'X-Slack-Request-Timestamp': timestamp,
+        'X-Slack-Signature': f'v0={digest}',
+    }
+
+class Recorder:
+    # Resolves a future when a message with a given marker reaches a fake platform
+
+    def __init__(self):
+        self._waiting = {}
+        self._lock = threading.Lock()
+
+    def expect(self, marker):
+        future = asyncio.get_running_loop().create_future()
+        with self._lock:
+            self._waiting[marker] = future
+        return future
+
+    def hit(self, text):
+        for marker in MARKER_PATTERN.findall(text or ''):
+            with self._lock:
+                future = self._waiting.pop(marker, None)
+            if future is not None:
+                arrived = time.perf_counter()
+                future.get_loop().call_soon_threadsafe(_set_result, future, arrived)
+
+def _set_result(future, value):
+    if not future.done():
+        future.set_result(value)
+
+#------------------------------------------
+# Slack Web API stand-in
+#------------------------------------------
+
+class FakeSlack:
+    # Local Slack Web API on its own thread and loop, covering the methods the bridge
+    # uses: auth.test, users.info, conversations.info/list, chat.postMessage,
+    # chat.postEphemeral, files.getUploadURLExternal/completeUploadExternal (files.upload v2)
+    # and files.info. Also serves file downloads for url_private links. Like real Slack,
+    # every post by the bot is echoed back to the bridge as a signed message event.
+
+    def __init__(self, signing_secret, channels, recorder, latency=0.0, file_size=64 * 1024):
+        self.signing_secret = signing_secret
+        self.channels = channels  # {channel_id: name}
+        self.recorder = recorder
+        self.latency = latency
+        self.file_bytes = b'\0' * file_size
+        self.port = free_port()
+        self.bridge_url = None  # /slack/events of the bridge, set once it is listening
+        self.calls = {}
+        self._ts = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._event_ids = itertools.count(1)
+        self._shares = {}  # file_id -> (channel, ts)
+        self.uploads = {}  # file_id -> uploaded body
+        self._loop = None
+        self._session = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.port}/'
+
+    @property
+    def api_url(self):
+        return self.url + 'api/'
+
+    def start(self):
+        ready = threading.Event()
+        threading.Thread(target=self._run, args=(ready,), daemon=True).start()
+        ready.wait()
+
+    def _run(self, ready):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route('*', '/api/{method}', self.handle_api)
+        app.router.add_post('/upload/{file_id}', self.handle_upload)
+        app.router.add_get('/files/{name}', self.handle_file)
+        runner = web.AppRunner(app, access_log=None)
+        self._loop.run_until_complete(runner.setup())
+        self._loop.run_until_complete(web.TCPSite(runner, '127.0.0.1', self.port).start())
+        ready.set()
+        self._loop.run_forever()
+
+    def next_ts(self):
+        return f'{int(time.time())}.{next(self._ts):06d}'
+
+    async def params(self, request):
+        # slack_sdk sends query strings, form bodies or JSON depending on the method
+        params = dict(request.query)
+        body = await request.read()
+        if body and request.content_type == 'application/json':
+            params.update(json.loads(body))
+        elif body:
+            params.update(parse_qsl(body.decode('utf-8')))
+        return params
+
+    async def handle_api(self, request):
+        method = request.match_info['method']
+        params = await self.params(request)
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        handler = getattr(self, 'api_' + method.replace('.', '_'), None)
+        if handler is None:
+            return web.json_response({'ok': False, 'error': 'unknown_method'})
+        return web.json_response(await handler(params))
+
+    async def api_auth_test(self, params):
+        return {'ok': True, 'user_id': BOT_USER_ID, 'bot_id': BOT_ID, 'team_id': 'TBENCH'}
+
+    async def api_users_info(self, params):
+        user_id = params.get('user')
+        return {'ok': True, 'user': {'id': user_id, 'real_name': f'Bench {user_id}', 'profile': {'display_name': f'bench-{user_id}'}}}
+
+    async def api_conversations_info(self, params):
+        channel_id = params.get('channel')
+        return {'ok': True, 'channel': {'id': channel_id, 'name': self.channels.get(channel_id, channel_id)}}
+
+    async def api_conversations_list(self, params):
+        return {'ok': True, 'channels': [{'id': channel_id, 'name': name} for channel_id, name in self.channels.items()], 'response_metadata': {'next_cursor': ''}}
+
+    async def api_chat_postMessage(self, params):
+        ts = self.next_ts()
+        self.recorder.hit(params.get('text'))
+        self.echo({'type': 'message', 'text': params.get('text'), 'channel': params.get('channel'), 'ts': ts, 'thread_ts': params.get('thread_ts')})
+        return {'ok': True, 'channel': params.get('channel'), 'ts': ts}
+
+    async def api_chat_postEphemeral(self, params):
+        return {'ok': True, 'message_ts': self.next_ts()}
+
+    async def api_files_getUploadURLExternal(self, params):
+        file_id = f'FBENCH{next(self._file_ids)}'
+        return {'ok': True, 'file_id': file_id, 'upload_url': f'{self.url}upload/{file_id}'}
+
+    async def api_files_completeUploadExternal(self, params):
+        files = params.get('files')
+        files = json.loads(files) if isinstance(files, str) else files
+        channel = params.get('channel_id') or params.get('channels')
+        ts = self.next_ts()
+        for file in files:
+            self._shares[file['id']] = (channel, ts)
+        self.recorder.hit(params.get('initial_comment'))
+        self.echo({
+            'type': 'message', 'subtype': 'file_share', 'text': params.get('initial_comment'),
+            'channel': channel, 'ts': ts, 'thread_ts': params.get('thread_ts'),
+            'files': [{'id': file['id']} for file in files],
+        })
+        return {'ok': True, 'files': [{'id': file['id'], 'title': file.get('title')} for file in files]}
+
+    async def api_files_info(self, params):
+        file_id = params.get('file')
+        shares = {}
+        if file_id in self._shares:
+            channel, ts = self._shares[file_id]
+            shares = {'public': {channel: [{'ts': ts}]}}
+        return {'ok': True, 'file': {'id': file_id, 'shares': shares}}
+
+    async def handle_upload(self, request):
+        body = await request.read()
+        self.uploads[request.match_info['file_id']] = body
+        return web.Response(text=f'OK - {len(body)}')
+
+    async def handle_file(self, request):
+        return web.Response(body=self.file_bytes, content_type='application/octet-stream')
+
+    def echo(self, event):
+        # Real Slack delivers the bot's own posts back as events; the bridge uses them
+        # for file share resolution and last-speaker tracking
+        if self.bridge_url is None:
+            return
+        event = {key: value for key, value in event.items() if value is not None}
+        event.update({'user': BOT_USER_ID, 'bot_id': BOT_ID})
+        payload = {'type': 'event_callback', 'event_id': f'EvECHO{next(self._event_ids)}', 'event': event}
+        asyncio.ensure_future(self.post_event(payload))
+
+    async def post_event(self, payload):
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        body = json.dumps(payload).encode()
+        try:
+            async with self._session.post(self.bridge_url, data=body, headers=sign(self.signing_secret, body)) as response:
+                await response.read()
+        except aiohttp.ClientError:
+            pass
+
+#------------------------------------------
+# Discord REST and gateway stand-ins
+#------------------------------------------
+
+class FakeMember:
+    def __init__(self, user_id, name):
+        self.id = user_id
+        self.name = name
+        self.display_name = name
+        self.bot = False
+
+class FakeAttachment:
+    def __init__(self, url, filename):
+        self.url = url
+        self.filename = filename
+
+class FakeMessage:
+    # The parts of discord.Message that discord_bot reads
+
+    def __init__(self, fake, message_id, channel, author, content, attachments=None):
+        self.fake = fake
+        self.id = message_id
+        self.channel = channel
+        self.author = author
+        self.content = content
+        self.attachments = attachments or []
+        self.mentions = []
+        self.stickers = []
+        self.type = discord.MessageType.default
+        self.thread = None
+
+    async def create_thread(self, name, **kwargs):
+        await self.fake.pause()
+        # Like Discord, a thread started from a message shares its id
+        self.thread = FakeThread(self.fake, self.channel, self.id, name)
+        return self.thread
+
+class FakeTextChannel(discord.TextChannel):
+    # Passes discord_bot's isinstance checks; sends are recorded instead of hitting Discord
+
+    def __init__(self, fake, channel_id, name):
+        self.fake = fake
+        self.id = channel_id
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+    async def send(self, content=None, files=None, **kwargs):
+        return await self.fake.deliver(self, content, files)
+
+    async def fetch_message(self, message_id):
+        await self.fake.pause()
+        return self.fake.messages[int(message_id)]
+
+class FakeThread(discord.Thread):
+
+    def __init__(self, fake, parent, thread_id, name):
+        self.fake = fake
+        self.fake_parent = parent
+        self.id = thread_id
+        self.name = name
+
+    @property
+    def parent(self):
+        return self.fake_parent
+
+    async def send(self, content=None, files=None, **kwargs):
+        return await self.fake.deliver(self, content, files)
+
+class FakeDiscord:
+    # Channels, threads and messages kept in memory. Patched in as discord_client.get_channel
+    # for Slack -> Discord relays; Discord -> Slack relays call discord_bot.on_message with
+    # messages built by new_message/new_thread_message, as the gateway would.
+
+    def __init__(self, recorder, latency=0.0):
+        self.recorder = recorder
+        self.latency = latency
+        self.channels = {}
+        self.messages = {}
+        self.sent = 0
+        self.bot = FakeMember(1, 'bridge-bot')
+        self._ids = itertools.count(10 ** 17)
+
+    def add_channel(self, channel_id, name):
+        self.channels[channel_id] = FakeTextChannel(self, channel_id, name)
+        return self.channels[channel_id]
+
+    def get_channel(self, channel_id):
+        return self.channels.get(int(channel_id))
+
+    async def pause(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def deliver(self, channel, content, files):
+        await self.pause()
+        for file in files or []:
+            file.fp.read()
+        message = FakeMessage(self, next(self._ids), channel, self.bot, content)
+        self.messages[message.id] = message
+        self.sent += 1
+        self.recorder.hit(content)
+        return message
+
+    def new_message(self, channel, author, content, attachments=None):
+        message = FakeMessage(self, next(self._ids), channel, author, content, attachments)
+        self.messages[message.id] = message
+        return message
+
+    def new_thread_message(self, parent_message, author, content, attachments=None):
+        if parent_message.thread is None:
+            parent_message.thread = FakeThread(self, parent_message.channel, parent_message.id, 'bench thread')
+        return self.new_message(parent_message.thread, author, content, attachments)
+
+#------------------------------------------
+# In-memory MongoDB collection
+#------------------------------------------
+
+class FakeCollection:
+    # Enough of pymongo's Collection for db.py: create_index, insert_one, find_one.
+    # Unique indexes raise DuplicateKeyError like the real ones.
+
+    def __init__(self):
+        self.docs = []
+        self.indexes = {}  # fields tuple -> {values tuple: doc}
+        self.unique = set()
+        self._lock = threading.Lock()
+
+    def create_index(self, keys, unique=False, name=None, **kwargs):
+        fields = tuple(key for key, _ in keys) if isinstance(keys, list) else (keys,)
+        with self._lock:
+            self.indexes[fields] = {self._values(fields, doc): doc for doc in self.docs if self._values(fields, doc)}
+            if unique:
+                self.unique.add(fields)
+        return name or '_'.join(f'{field}_1' for field in fields)
+
+    def insert_one(self, doc):
+        with self._lock:
+            for fields in self.unique:
+                values = self._values(fields, doc)
+                if values and values in self.indexes[fields]:
+                    raise DuplicateKeyError(f'E11000 duplicate key error: {fields}')
+            doc = dict(doc)
+            self.docs.append(doc)
+            for fields, index in self.indexes.items():
+                values = self._values(fields, doc)
+                if values:
+                    index.setdefault(values, doc)
+
+    def find_one(self, filter, projection=None):
+        with self._lock:
+            fields = tuple(filter)
+            if fields in self.indexes:
+                doc = self.indexes[fields].get(self._values(fields, filter))
+                return self._project(doc, projection) if doc else None
+            for doc in self.docs:
+                if all(doc.get(key) == value for key, value in filter.items()):
+                    return self._project(doc, projection)
+        return None
+
+    def _values(self, fields, doc):
+        # Index key of doc, or None if it lacks one of the fields
+        if all(field in doc for field in fields):
+            return tuple(doc[field] for field in fields)
+        return None
+
+    def _project(self, doc, projection):
+        if not projection:
+            return dict(doc)
+        included = [key for key, value in projection.items() if value and key != '_id']
+        return {key: doc[key] for key in included if key in doc}
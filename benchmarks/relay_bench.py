@@ -0,0 +1,315 @@
+# Offline end-to-end relay benchmark.
+#
+# Runs the real bridge (main.app on uvicorn, the Slack and Discord relay code, the
+# journal, caches and outbound schedulers) against local stand-ins: a fake Slack Web
+# API server, fake Discord channels and threads, and an in-memory Mongo collection.
+# Nothing talks to Slack, Discord or MongoDB.
+#
+#     python -m benchmarks.relay_bench --messages 200 --concurrency 20 --json baseline.json
+#
+# For each scenario it reports messages per second and p50/p99/max latency:
+# - slack_text, slack_thread, slack_attachment: a signed event is posted to
+#   /slack/events; the clock stops when the message reaches the fake Discord channel.
+# - discord_text, discord_thread, discord_attachment: a message is passed to
+#   discord_bot.on_message as the gateway would; the clock stops when the relay has
+#   finished (posted to fake Slack and mapped in the db).
+# - slack_burst, discord_burst (not run by default): one author posts BURST_SIZE messages
+#   back to back; one sample per burst, the clock stops when its last message is through.
+#   Run with --coalesce-window to see the effect of merging bursts.
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from benchmarks.fakes import FakeSlack, FakeDiscord, FakeCollection, FakeMember, FakeAttachment, Recorder, free_port, sign
+
+SIGNING_SECRET = 'bench-signing-secret'
+SCENARIOS = ('slack_text', 'slack_thread', 'slack_attachment', 'discord_text', 'discord_thread', 'discord_attachment')
+EXTRA_SCENARIOS = ('slack_burst', 'discord_burst')
+BURST_SIZE = 5
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Offline end-to-end relay benchmark')
+    parser.add_argument('--messages', type=int, default=200, help='messages per scenario')
+    parser.add_argument('--concurrency', type=int, default=20, help='messages in flight at once')
+    parser.add_argument('--channels', type=int, default=10, help='mapped channel pairs to spread messages over')
+    parser.add_argument('--slack-latency', type=float, default=20, help='fake Slack API latency, ms')
+    parser.add_argument('--discord-latency', type=float, default=30, help='fake Discord API latency, ms')
+    parser.add_argument('--file-size', type=int, default=64 * 1024, help='attachment size, bytes')
+    parser.add_argument('--coalesce-window', type=int, default=0, help='COALESCE_WINDOW_MS for the bridge; 0 disables merging')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds before a message counts as lost')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma separated subset of: ' + ', '.join(SCENARIOS + EXTRA_SCENARIOS))
+    parser.add_argument('--json', dest='json_path', help='also write the results to this file')
+    return parser.parse_args(argv)
+
+def percentile(values, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, int(round(fraction * len(values) + 0.5)) - 1))
+    return values[index]
+
+def summarize(name, latencies, lost, elapsed):
+    latencies = sorted(latencies)
+    to_ms = lambda value: round(value * 1000, 2) if value is not None else None
+    return {
+        'scenario': name,
+        'messages': len(latencies) + lost,
+        'relayed': len(latencies),
+        'lost': lost,
+        'seconds': round(elapsed, 3),
+        'messages_per_second': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'p50_ms': to_ms(percentile(latencies, 0.50)),
+        'p99_ms': to_ms(percentile(latencies, 0.99)),
+        'max_ms': to_ms(latencies[-1] if latencies else None),
+    }
+
+def print_report(results):
+    columns = ('scenario', 'relayed', 'lost', 'messages_per_second', 'p50_ms', 'p99_ms', 'max_ms')
+    print(f'{columns[0]:<20}' + ''.join(f'{column:>21}' for column in columns[1:]))
+    for result in results:
+        print(f'{result[columns[0]]:<20}' + ''.join(f'{str(result[column]):>21}' for column in columns[1:]))
+
+class Bench:
+
+    def __init__(self, args, workdir):
+        self.args = args
+        self.workdir = workdir
+        self.recorder = Recorder()
+        self.run_id = int(time.time()) % 100000
+        self.counter = 0
+        # Slack CBENCH000n <-> Discord 90000000000000000n, both named bench-n
+        self.channel_pairs = [(f'CBENCH{i:04d}', 900000000000000000 + i, f'bench-{i}') for i in range(args.channels)]
+
+    def marker(self):
+        self.counter += 1
+        return f'bench-{self.run_id}-{self.counter}'
+
+    def setup(self):
+        # Everything the bridge reads from the working directory or env points at the stand-ins
+        os.chdir(self.workdir)
+        with open('channels.json', 'w', encoding='utf-8') as f:
+            json.dump({'channels_mapping': [
+                {'slack_channel_id': slack_id, 'discord_channel_id': str(discord_id), 'name': name}
+                for slack_id, discord_id, name in self.channel_pairs
+            ]}, f)
+
+        self.slack = FakeSlack(
+            SIGNING_SECRET,
+            {slack_id: name for slack_id, _, name in self.channel_pairs},
+            self.recorder,
+            latency=self.args.slack_latency / 1000,
+            file_size=self.args.file_size,
+        )
+        self.slack.start()
+        self.port = free_port()
+
+        os.environ.update({
+            'SLACK_TOKEN': 'xoxb-bench',
+            'SIGNING_SECRET': SIGNING_SECRET,
+            'SLACK_API_BASE_URL': self.slack.api_url,
+            'MONGO_DB': 'mongodb://127.0.0.1:1/?serverSelectionTimeoutMS=1',
+            'DB_COLLECTION': 'bench_messages',
+            'SLACK_CHANNEL_DISCORD': self.channel_pairs[0][0],
+            'JOURNAL_PATH': os.path.join(self.workdir, 'journal.sqlite3'),
+            'BRIDGE_MODE': 'combined',
+            'INGRESS_HOST': '127.0.0.1',
+            'INGRESS_PORT': str(self.port),
+            'LOG_TO_CONSOLE': os.environ.get('LOG_TO_CONSOLE', '0'),
+            'LOG_LEVEL': os.environ.get('LOG_LEVEL', 'WARNING'),
+            'COALESCE_WINDOW_MS': str(self.args.coalesce_window),
+        })
+
+        import main
+        import db
+        import discord_bot
+
+        self.main = main
+        self.discord_bot = discord_bot
+        db.messages_collection = FakeCollection()
+        db.aliases_collection = FakeCollection()
+        db.ensure_indexes()
+
+        self.discord = FakeDiscord(self.recorder, latency=self.args.discord_latency / 1000)
+        for _, discord_id, name in self.channel_pairs:
+            self.discord.add_channel(discord_id, name)
+        discord_bot.discord_client.get_channel = self.discord.get_channel
+
+        main.warm_channel_cache()
+        self.slack.bridge_url = f'http://127.0.0.1:{self.port}/slack/events'
+        self.start_server()
+
+    def start_server(self):
+        import uvicorn
+        self.server = uvicorn.Server(uvicorn.Config(self.main.app, host='127.0.0.1', port=self.port, log_level='warning'))
+        threading.Thread(target=self.server.run, daemon=True).start()
+        while not self.server.started:
+            time.sleep(0.05)
+
+    #------------------------------------------
+    # Slack -> Discord
+    #------------------------------------------
+
+    async def post_slack_event(self, session, event):
+        payload = {'type': 'event_callback', 'event_id': f'EvBENCH{self.counter}-{time.monotonic_ns()}', 'event': event}
+        body = json.dumps(payload).encode()
+        async with session.post(self.slack.bridge_url, data=body, headers=sign(SIGNING_SECRET, body)) as response:
+            await response.read()
+            if response.status != 200:
+                raise RuntimeError(f'/slack/events returned {response.status}')
+
+    def slack_event(self, index, marker, **extra):
+        slack_id = self.channel_pairs[index % len(self.channel_pairs)][0]
+        event = {
+            'type': 'message',
+            'user': f'UBENCH{index % 50}',
+            'text': f'{marker} hello from slack',
+            'channel': slack_id,
+            'ts': self.slack.next_ts(),
+            'client_msg_id': marker,
+        }
+        event.update(extra)
+        return event
+
+    async def relay_from_slack(self, session, event, marker):
+        arrived = self.recorder.expect(marker)
+        start = time.perf_counter()
+        await self.post_slack_event(session, event)
+        return await asyncio.wait_for(arrived, self.args.timeout) - start
+
+    async def slack_text(self, session, index):
+        marker = self.marker()
+        return await self.relay_from_slack(session, self.slack_event(index, marker), marker)
+
+    async def slack_thread(self, session, index):
+        # The parent is relayed first, outside the measured time
+        parent_marker = self.marker()
+        parent = self.slack_event(index, parent_marker)
+        await self.relay_from_slack(session, parent, parent_marker)
+
+        marker = self.marker()
+        return await self.relay_from_slack(session, self.slack_event(index, marker, thread_ts=parent['ts']), marker)
+
+    async def slack_attachment(self, session, index):
+        marker = self.marker()
+        event = self.slack_event(index, marker, subtype='file_share', files=[{
+            'id': f'FIN{self.counter}',
+            'url_private': f'{self.slack.url}files/bench-{self.counter}.bin',
+            'mimetype': 'application/octet-stream',
+            'name': f'bench-{self.counter}.bin',
+        }])
+        return await self.relay_from_slack(session, event, marker)
+
+    async def slack_burst(self, session, index):
+        markers = [self.marker() for _ in range(BURST_SIZE)]
+        arrived = [self.recorder.expect(marker) for marker in markers]
+        start = time.perf_counter()
+        for marker in markers:
+            await self.post_slack_event(session, self.slack_event(index, marker))
+        await asyncio.wait_for(asyncio.gather(*arrived), self.args.timeout)
+        return time.perf_counter() - start
+
+    #------------------------------------------
+    # Discord -> Slack
+    #------------------------------------------
+
+    def discord_channel(self, index):
+        return self.discord.channels[self.channel_pairs[index % len(self.channel_pairs)][1]]
+
+    def discord_author(self, index):
+        return FakeMember(500 + index % 50, f'discord-user-{index % 50}')
+
+    async def relay_from_discord(self, message):
+        start = time.perf_counter()
+        result = await self.discord_bot.on_message(message)
+        if not result or json.loads(result).get('status') != 'ok':
+            raise RuntimeError(f'relay failed: {result}')
+        return time.perf_counter() - start
+
+    async def discord_text(self, session, index):
+        message = self.discord.new_message(self.discord_channel(index), self.discord_author(index), f'{self.marker()} hello from discord')
+        return await self.relay_from_discord(message)
+
+    async def discord_thread(self, session, index):
+        parent = self.discord.new_message(self.discord_channel(index), self.discord_author(index), f'{self.marker()} thread parent')
+        await self.relay_from_discord(parent)
+
+        message = self.discord.new_thread_message(parent, self.discord_author(index), f'{self.marker()} reply from discord')
+        return await self.relay_from_discord(message)
+
+    async def discord_attachment(self, session, index):
+        attachment = FakeAttachment(f'{self.slack.url}files/discord-{self.counter}.bin', f'discord-{self.counter}.bin')
+        message = self.discord.new_message(self.discord_channel(index), self.discord_author(index), f'{self.marker()} file from discord', [attachment])
+        return await self.relay_from_discord(message)
+
+    async def discord_burst(self, session, index):
+        # Like the gateway, each message is handled in its own task, in arrival order
+        messages = [
+            self.discord.new_message(self.discord_channel(index), self.discord_author(index), f'{self.marker()} burst from discord')
+            for _ in range(BURST_SIZE)
+        ]
+        start = time.perf_counter()
+        await asyncio.gather(*(self.relay_from_discord(message) for message in messages))
+        return time.perf_counter() - start
+
+    #------------------------------------------
+
+    async def run_scenario(self, session, name):
+        scenario = getattr(self, name)
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        latencies = []
+        lost = 0
+
+        async def one(index):
+            nonlocal lost
+            async with semaphore:
+                try:
+                    latencies.append(await asyncio.wait_for(scenario(session, index), self.args.timeout))
+                except Exception as e:
+                    lost += 1
+                    print(f'{name} #{index} lost: {e!r}', file=sys.stderr)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(index) for index in range(self.args.messages)))
+        return summarize(name, latencies, lost, time.perf_counter() - start)
+
+    async def run(self):
+        import aiohttp
+        # This loop plays the part of the discord.py loop
+        self.discord_bot.discord_client.loop = asyncio.get_running_loop()
+
+        results = []
+        async with aiohttp.ClientSession() as session:
+            for name in self.args.scenarios.split(','):
+                if name not in SCENARIOS + EXTRA_SCENARIOS:
+                    raise SystemExit(f'Unknown scenario: {name}')
+                results.append(await self.run_scenario(session, name))
+        return results
+
+def main(argv=None):
+    args = parse_args(argv)
+    # The bridge runs in a scratch directory, so resolve the output path first
+    json_path = os.path.abspath(args.json_path) if args.json_path else None
+    with tempfile.TemporaryDirectory(prefix='relay-bench-') as workdir:
+        bench = Bench(args, workdir)
+        bench.setup()
+        try:
+            results = asyncio.run(bench.run())
+        finally:
+            bench.server.should_exit = True
+
+    print_report(results)
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,319 @@
+# Replays captured Slack traffic against a running bridge, for load testing.
+#
+#     python -m benchmarks.replay captured.jsonl --target http://127.0.0.1:5000 --speed 10
+#     python -m benchmarks.replay logs/app.log --speed 0 --concurrency 50 --json replay.json
+#
+# Captures are read from either:
+# - JSONL, one request per line: a raw Slack payload (events API envelope or
+#   interactive payload), or {"time": <epoch seconds>, "path": "/slack/events",
+#   "body": <payload or raw body string>}.
+# - The app log with LOG_LEVEL=DEBUG (text or json LOG_FORMAT), from the
+#   "Incoming request: POST <url> - Body: <body>" lines main.py writes.
+#
+# Every request is re-signed with --signing-secret (the bridge under test must run with
+# the same SIGNING_SECRET) and sent at its original pacing divided by --speed; --speed 0
+# sends as fast as --concurrency allows. event_id and client_msg_id get a per-run suffix
+# so the bridge's duplicate checks don't drop a second replay; --keep-ids turns that off.
+#
+# Server-side numbers come from /metrics, scraped before the replay and again once the
+# journal and outbound queues have drained. Ingress workers and the gateway each keep
+# their own registry, so pass every process's endpoint with --metrics-url to see all of it.
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import argparse
+from datetime import datetime
+from collections import namedtuple, Counter
+from urllib.parse import urlsplit, urlencode
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+import aiohttp
+from benchmarks.fakes import sign
+from benchmarks.relay_bench import percentile
+
+Capture = namedtuple('Capture', ['time', 'path', 'body'])
+
+LOG_REQUEST_PATTERN = re.compile(r'Incoming request: POST (?P<url>\S+) - Body: (?P<body>.*)$')
+LOG_TIME_PATTERN = re.compile(r'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3})')
+LOG_TIME_FORMAT = '%Y-%m-%d %H:%M:%S,%f'
+SAMPLE_PATTERN = re.compile(r'^(?P<name>[a-zA-Z_:][\w:]*)(?:\{(?P<labels>.*)\})?\s+(?P<value>\S+)$')
+LABEL_PATTERN = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+# Histograms and counters reported as before/after deltas
+HISTOGRAMS = ('bridge_ingress_seconds', 'bridge_stage_seconds', 'bridge_relay_seconds', 'bridge_db_seconds')
+COUNTERS = ('bridge_ingress_requests_total', 'bridge_messages_total', 'bridge_duplicates_total', 'bridge_api_errors_total')
+# Gauges that must all be zero before the second scrape
+BACKLOG_GAUGES = ('bridge_journal_pending', 'bridge_outbound_queue_depth', 'bridge_outbound_in_flight')
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Replay captured Slack traffic against the bridge')
+    parser.add_argument('captures', nargs='+', help='JSONL capture files or app logs')
+    parser.add_argument('--target', default='http://127.0.0.1:5000', help='bridge base URL')
+    parser.add_argument('--signing-secret', default=os.environ.get('SIGNING_SECRET', ''), help='defaults to $SIGNING_SECRET')
+    parser.add_argument('--speed', type=float, default=1.0, help='pacing multiplier; 0 sends as fast as possible')
+    parser.add_argument('--concurrency', type=int, default=50, help='requests in flight at once')
+    parser.add_argument('--keep-ids', action='store_true', help='send event_id and client_msg_id unchanged')
+    parser.add_argument('--metrics-url', action='append', help='/metrics endpoint to scrape, repeatable (default: <target>/metrics)')
+    parser.add_argument('--drain-timeout', type=float, default=60, help='seconds to wait for the bridge to drain after sending')
+    parser.add_argument('--json', dest='json_path', help='also write the results to this file')
+    args = parser.parse_args(argv)
+    if not args.signing_secret:
+        parser.error('--signing-secret or $SIGNING_SECRET is required')
+    args.metrics_url = args.metrics_url or [args.target.rstrip('/') + '/metrics']
+    return args
+
+#------------------------------------------
+# Loading captures
+#------------------------------------------
+
+def payload_time(payload):
+    # Best guess at when Slack sent a raw payload
+    if 'event_time' in payload:
+        return float(payload['event_time'])
+    action_ts = payload.get('action_ts') or next((action.get('action_ts') for action in payload.get('actions') or []), None)
+    return float(action_ts) if action_ts else None
+
+def payload_path(payload):
+    return '/slack/events' if payload.get('type') in ('event_callback', 'url_verification') else '/slack/button'
+
+def log_time(text):
+    try:
+        return datetime.strptime(text, LOG_TIME_FORMAT).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+def from_log_message(message, timestamp):
+    match = LOG_REQUEST_PATTERN.search(message)
+    if match is None:
+        return None
+    return Capture(timestamp, urlsplit(match['url']).path, match['body'])
+
+def parse_line(line):
+    try:
+        record = json.loads(line)
+    except ValueError:
+        # Text log line
+        time_match = LOG_TIME_PATTERN.match(line)
+        return from_log_message(line, log_time(time_match[1]) if time_match else None)
+
+    if not isinstance(record, dict):
+        return None
+    if 'path' in record and 'body' in record:
+        return Capture(record.get('time'), record['path'], record['body'])
+    if 'message' in record and 'level' in record:
+        # LOG_FORMAT=json log line
+        return from_log_message(record['message'], log_time(record.get('time')))
+    if 'type' in record:
+        return Capture(payload_time(record), payload_path(record), record)
+    return None
+
+def load_captures(paths):
+    captures = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                capture = parse_line(line) if line else None
+                if capture is not None and capture.path in ('/slack/events', '/slack/button'):
+                    captures.append(capture)
+    # Stable sort keeps file order for captures without a time
+    last = 0.0
+    timed = []
+    for capture in captures:
+        last = capture.time if capture.time is not None else last
+        timed.append(capture._replace(time=last))
+    return sorted(timed, key=lambda capture: capture.time)
+
+def encode(capture, suffix):
+    # Returns (body bytes, content type) as Slack would send them
+    body = capture.body
+    if capture.path == '/slack/button':
+        if isinstance(body, dict):
+            body = urlencode({'payload': json.dumps(body)})
+        return body.encode(), 'application/x-www-form-urlencoded'
+
+    if isinstance(body, str):
+        body = json.loads(body)
+    if suffix:
+        body = dict(body)
+        if body.get('event_id'):
+            body['event_id'] = f"{body['event_id']}-{suffix}"
+        event = body.get('event')
+        if isinstance(event, dict) and event.get('client_msg_id'):
+            body['event'] = dict(event, client_msg_id=f"{event['client_msg_id']}-{suffix}")
+    return json.dumps(body).encode(), 'application/json'
+
+#------------------------------------------
+# Metrics
+#------------------------------------------
+
+def parse_metrics(text):
+    # {(name, ((label, value), ...)): value}
+    samples = {}
+    for line in text.splitlines():
+        match = SAMPLE_PATTERN.match(line)
+        if match is None or line.startswith('#'):
+            continue
+        labels = tuple(LABEL_PATTERN.findall(match['labels'] or ''))
+        samples[(match['name'], labels)] = float(match['value'])
+    return samples
+
+async def scrape(session, urls):
+    # Sums the samples of every endpoint, so several processes read as one bridge
+    total = Counter()
+    for url in urls:
+        async with session.get(url) as response:
+            response.raise_for_status()
+            for key, value in parse_metrics(await response.text()).items():
+                total[key] += value
+    return total
+
+async def wait_for_drain(session, urls, timeout):
+    deadline = time.monotonic() + timeout
+    while True:
+        samples = await scrape(session, urls)
+        backlog = sum(value for (name, _), value in samples.items() if name in BACKLOG_GAUGES)
+        if backlog == 0 or time.monotonic() >= deadline:
+            return samples, backlog
+        await asyncio.sleep(0.5)
+
+def histogram_deltas(before, after):
+    # Per histogram and label set: count, mean, and p50/p99 as bucket upper bounds
+    series = {}
+    for (name, labels), value in after.items():
+        delta = value - before.get((name, labels), 0)
+        for base in HISTOGRAMS:
+            if not name.startswith(base):
+                continue
+            kind = name[len(base) + 1:]
+            key = (base, tuple(pair for pair in labels if pair[0] != 'le'))
+            entry = series.setdefault(key, {'buckets': []})
+            if kind == 'bucket':
+                bound = dict(labels)['le']
+                entry['buckets'].append((float('inf') if bound == '+Inf' else float(bound), delta))
+            elif kind in ('sum', 'count'):
+                entry[kind] = delta
+
+    rows = []
+    for (base, labels), entry in sorted(series.items()):
+        count = entry.get('count', 0)
+        if not count:
+            continue
+        buckets = sorted(entry['buckets'])
+        quantile = lambda q: next((bound for bound, cumulative in buckets if cumulative >= q * count), None)
+        to_ms = lambda value: round(value * 1000, 2) if value not in (None, float('inf')) else value
+        rows.append({
+            'metric': base,
+            'labels': dict(labels),
+            'count': int(count),
+            'mean_ms': round(entry.get('sum', 0) / count * 1000, 2),
+            'p50_le_ms': to_ms(quantile(0.50)),
+            'p99_le_ms': to_ms(quantile(0.99)),
+        })
+    return rows
+
+def counter_deltas(before, after):
+    rows = []
+    for (name, labels), value in sorted(after.items()):
+        delta = value - before.get((name, labels), 0)
+        if name in COUNTERS and delta:
+            rows.append({'metric': name, 'labels': dict(labels), 'delta': int(delta)})
+    return rows
+
+#------------------------------------------
+# Replay
+#------------------------------------------
+
+async def replay(args, captures):
+    suffix = None if args.keep_ids else f'replay{int(time.time())}'
+    requests = [(capture.path, *encode(capture, suffix and f'{suffix}-{index}')) for index, capture in enumerate(captures)]
+    origin = captures[0].time
+    offsets = [(capture.time - origin) / args.speed if args.speed else 0 for capture in captures]
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    statuses = Counter()
+    latencies = []
+    max_lag = 0.0
+
+    async with aiohttp.ClientSession() as session:
+        before = await scrape(session, args.metrics_url)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+
+        async def send(path, body, content_type, offset):
+            nonlocal max_lag
+            await asyncio.sleep(max(0, start + offset - loop.time()))
+            async with semaphore:
+                # How far behind the original pacing this request went out
+                max_lag = max(max_lag, loop.time() - start - offset)
+                headers = sign(args.signing_secret, body)
+                headers['Content-Type'] = content_type
+                sent = time.perf_counter()
+                try:
+                    async with session.post(args.target.rstrip('/') + path, data=body, headers=headers) as response:
+                        await response.read()
+                        statuses[str(response.status)] += 1
+                except aiohttp.ClientError as e:
+                    statuses[type(e).__name__] += 1
+                latencies.append(time.perf_counter() - sent)
+
+        await asyncio.gather(*(send(path, body, content_type, offset) for (path, body, content_type), offset in zip(requests, offsets)))
+        send_seconds = loop.time() - start
+        after, backlog = await wait_for_drain(session, args.metrics_url, args.drain_timeout)
+        total_seconds = loop.time() - start
+
+    latencies.sort()
+    counters = counter_deltas(before, after)
+    relayed = sum(row['delta'] for row in counters if row['metric'] == 'bridge_messages_total' and row['labels'].get('result') == 'ok')
+    to_ms = lambda value: round(value * 1000, 2) if value is not None else None
+    return {
+        'requests': len(requests),
+        'statuses': dict(statuses),
+        'captured_seconds': round(captures[-1].time - origin, 3),
+        'send_seconds': round(send_seconds, 3),
+        'drain_seconds': round(total_seconds - send_seconds, 3),
+        'drained': backlog == 0,
+        'requests_per_second': round(len(requests) / send_seconds, 2) if send_seconds else None,
+        'relayed_per_second': round(relayed / total_seconds, 2) if total_seconds else None,
+        'ack_p50_ms': to_ms(percentile(latencies, 0.50)),
+        'ack_p99_ms': to_ms(percentile(latencies, 0.99)),
+        'max_lag_ms': to_ms(max_lag),
+        'stages': histogram_deltas(before, after),
+        'counters': counters,
+    }
+
+def print_report(result):
+    print(f"requests           {result['requests']}  statuses {result['statuses']}")
+    print(f"captured span      {result['captured_seconds']} s, sent in {result['send_seconds']} s, drained in {result['drain_seconds']} s (drained: {result['drained']})")
+    print(f"throughput         {result['requests_per_second']} req/s acked, {result['relayed_per_second']} msg/s relayed")
+    print(f"ack latency        p50 {result['ack_p50_ms']} ms, p99 {result['ack_p99_ms']} ms, max pacing lag {result['max_lag_ms']} ms")
+    print()
+    print(f"{'metric':<24}{'labels':<44}{'count':>8}{'mean_ms':>10}{'p50<=ms':>10}{'p99<=ms':>10}")
+    for row in result['stages']:
+        labels = ','.join(f'{key}={value}' for key, value in row['labels'].items())
+        print(f"{row['metric']:<24}{labels:<44}{row['count']:>8}{row['mean_ms']:>10}{str(row['p50_le_ms']):>10}{str(row['p99_le_ms']):>10}")
+    print()
+    for row in result['counters']:
+        labels = ','.join(f'{key}={value}' for key, value in row['labels'].items())
+        print(f"{row['metric']:<32}{labels:<44}{row['delta']:>8}")
+
+def main(argv=None):
+    args = parse_args(argv)
+    captures = load_captures(args.captures)
+    if not captures:
+        raise SystemExit('No Slack requests found in ' + ', '.join(args.captures))
+
+    result = asyncio.run(replay(args, captures))
+    print_report(result)
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump({'args': vars(args), 'result': result}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+# Micro-benchmarks for the text-shaping functions every relay goes through.
+#
+#     python -m benchmarks.text_bench --json text-baseline.json
+#     python -m benchmarks.text_bench --compare text-baseline.json --threshold 1.25
+#
+# Each case runs on a generated corpus (short, long, mention-heavy and Cyrillic
+# messages) and reports the median and best time per call over several repeats.
+# With --compare the run exits with status 1 if any case's median got slower than
+# the baseline by more than --threshold, so CI can flag regressions.
+#
+# slack_bot calls auth.test on import, so a local fake Slack (see fakes.py) answers it.
+# Logging is set up as in production, into a scratch file, at LOG_LEVEL (default INFO).
+# slack.format_mentions is a coroutine; it runs to completion on one event loop per call,
+# so its numbers include that loop round trip.
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from benchmarks.fakes import FakeSlack, FakeDiscord, FakeMember, Recorder
+
+SEED = 1234
+WORDS = 'the bridge relays every message between slack and discord with files threads and mentions'.split()
+CYRILLIC_WORDS = 'мост пересылает каждое сообщение между слаком и дискордом вместе с файлами ветками и упоминаниями'.split()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Text-processing micro-benchmarks')
+    parser.add_argument('--repeat', type=int, default=7, help='timed repeats per case')
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds each repeat should take at least')
+    parser.add_argument('--filter', default='', help='only run cases whose name contains this')
+    parser.add_argument('--json', dest='json_path', help='write the results to this file')
+    parser.add_argument('--compare', help='baseline JSON from an earlier run')
+    parser.add_argument('--threshold', type=float, default=1.25, help='allowed median slowdown vs the baseline')
+    return parser.parse_args(argv)
+
+#------------------------------------------
+# Corpora
+#------------------------------------------
+
+def sentence(rng, words, length):
+    return ' '.join(rng.choice(words) for _ in range(length)).capitalize() + '.'
+
+def paragraph(rng, words, chars):
+    parts = []
+    while sum(len(part) + 1 for part in parts) < chars:
+        parts.append(sentence(rng, words, rng.randint(5, 20)))
+    return ' '.join(parts)
+
+def build_corpus(user_ids):
+    rng = random.Random(SEED)
+    mentions = ' '.join(f'<@{rng.choice(user_ids)}> {rng.choice(WORDS)}' for _ in range(40))
+    announcement = '<!channel> ' + paragraph(rng, WORDS, 1500) + ' <#CBENCH0000|bench-0> <#CBENCH0000> ' + ' '.join(f'<@{user_id}>' for user_id in user_ids) + ' <!here>'
+    return {
+        'short': 'Hi all, the build is green again.',
+        'long': paragraph(rng, WORDS, 12000),
+        'mentions': mentions,
+        'announcement': announcement,
+        'cyrillic': paragraph(rng, CYRILLIC_WORDS, 6000),
+        'thread_name': '**💂_Bench User_**\n' + sentence(rng, WORDS, 12),
+    }
+
+#------------------------------------------
+# Timing
+#------------------------------------------
+
+def time_case(func, repeat, min_time):
+    # Calibrate the loop count so one repeat takes at least min_time, like timeit
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9)))
+
+    runs = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        runs.append((time.perf_counter() - start) / number)
+    return {
+        'loops': number,
+        'median_us': round(statistics.median(runs) * 1e6, 3),
+        'best_us': round(min(runs) * 1e6, 3),
+    }
+
+def compare(results, baseline_path, threshold):
+    # Returns the cases whose median got slower than threshold x the baseline
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {case['name']: case for case in json.load(f)['results']}
+    regressions = []
+    for case in results:
+        before = baseline.get(case['name'])
+        if before and before['median_us'] > 0:
+            case['vs_baseline'] = round(case['median_us'] / before['median_us'], 3)
+            if case['vs_baseline'] > threshold:
+                regressions.append(case)
+    return regressions
+
+#------------------------------------------
+# Cases
+#------------------------------------------
+
+def build_cases(slack_bot, discord_bot, corpus, user_ids):
+    from last_speaker import slack_last_speakers, discord_last_speakers
+
+    fake = FakeDiscord(Recorder())
+    channel = fake.add_channel(900000000000000000, 'bench-0')
+    author = FakeMember(500, 'discord-user')
+    mentioned = [FakeMember(600 + i, f'member-{i}') for i in range(20)]
+    discord_mentions = ' '.join(f'<@{member.id}> {WORDS[i % len(WORDS)]}' for i, member in enumerate(mentioned))
+
+    def discord_message(content, mentions=()):
+        message = fake.new_message(channel, author, content)
+        message.mentions = list(mentions)
+        return message
+
+    messages = {
+        'short': discord_message(corpus['short']),
+        'long': discord_message(corpus['long']),
+        'mentions': discord_message(discord_mentions, mentioned),
+        'cyrillic': discord_message(corpus['cyrillic']),
+    }
+    attachment_event = {'text': '', 'attachments': [{'text': corpus['short']}, {'text': corpus['long']}]}
+
+    # Same speaker on both sides, so check_last_message_user_id walks its longest path
+    slack_last_speakers.set('CBENCH0000', user_ids[0])
+    discord_last_speakers.set(str(channel.id), str(author.id))
+
+    run = asyncio.new_event_loop().run_until_complete
+    cases = []
+    for name in ('short', 'long', 'cyrillic'):
+        cases.append((f'slack.split_text_by_parts[{name}]', lambda text=corpus[name]: slack_bot.split_text_by_parts(text, 2000)))
+    for name in ('short', 'mentions', 'announcement', 'cyrillic'):
+        cases.append((f'slack.format_mentions[{name}]', lambda text=corpus[name]: run(slack_bot.format_mentions(text))))
+    cases += [
+        ('slack.clean_and_format_thread_name', lambda: slack_bot.clean_and_format_thread_name(corpus['thread_name'])),
+        ('slack.get_text[text]', lambda: slack_bot.get_text({'text': corpus['short']})),
+        ('slack.get_text[attachments]', lambda: slack_bot.get_text(attachment_event)),
+        ('slack.check_last_message_user_id', lambda: slack_bot.check_last_message_user_id(user_ids[0], 'CBENCH0000', channel.id)),
+    ]
+    for name, message in messages.items():
+        cases.append((f'discord.format_mentions[{name}]', lambda message=message: discord_bot.format_mentions(message)))
+        cases.append((f'discord.format_text[{name}]', lambda message=message: discord_bot.format_text(message, 'CBENCH0000')))
+    cases.append(('discord.check_last_message_user_id', lambda: discord_bot.check_last_message_user_id(messages['short'], 'CBENCH0000')))
+    return cases
+
+def main(argv=None):
+    args = parse_args(argv)
+    json_path = os.path.abspath(args.json_path) if args.json_path else None
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+
+    with tempfile.TemporaryDirectory(prefix='text-bench-') as workdir:
+        os.chdir(workdir)
+        with open('channels.json', 'w', encoding='utf-8') as f:
+            json.dump({'channels_mapping': [
+                {'slack_channel_id': 'CBENCH0000', 'discord_channel_id': '900000000000000000', 'name': 'bench-0'}
+            ]}, f)
+
+        slack = FakeSlack('bench-signing-secret', {'CBENCH0000': 'bench-0'}, Recorder())
+        slack.start()
+        os.environ.update({
+            'SLACK_TOKEN': 'xoxb-bench',
+            'SIGNING_SECRET': 'bench-signing-secret',
+            'SLACK_API_BASE_URL': slack.api_url,
+            'MONGO_DB': 'mongodb://127.0.0.1:1/?serverSelectionTimeoutMS=1',
+            'DB_COLLECTION': 'bench_messages',
+            'JOURNAL_PATH': os.path.join(workdir, 'journal.sqlite3'),
+            'LOG_TO_CONSOLE': '0',
+            'LOG_LEVEL': os.environ.get('LOG_LEVEL', 'INFO'),
+        })
+
+        from log_config import setup_logging
+        setup_logging(os.path.join(workdir, 'logs', 'bench.log'))
+        import slack_bot
+        import discord_bot
+
+        # Known users, so mention lookups hit the profile cache and never the network
+        user_ids = [f'UBENCH{i:03d}' for i in range(50)]
+        for user_id in user_ids:
+            slack_bot.user_profiles.put(user_id, {'id': user_id, 'real_name': f'Bench {user_id}', 'profile': {'display_name': ''}})
+
+        corpus = build_corpus(user_ids)
+        results = []
+        for name, func in build_cases(slack_bot, discord_bot, corpus, user_ids):
+            if args.filter and args.filter not in name:
+                continue
+            result = {'name': name}
+            result.update(time_case(func, args.repeat, args.min_time))
+            results.append(result)
+            print(f"{name:<45}{result['median_us']:>12} us{result['best_us']:>12} us (best)", flush=True)
+
+    regressions = compare(results, compare_path, args.threshold) if compare_path else []
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump({'python': sys.version.split()[0], 'args': vars(args), 'results': results}, f, indent=2, ensure_ascii=False)
+
+    for case in regressions:
+        print(f"REGRESSION {case['name']}: {case['vs_baseline']}x baseline median", file=sys.stderr)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+import time
+import asyncio
+import threading
+import concurrent.futures
+from collections import OrderedDict
+
+_MISSING = object()
+
+class TTLCache:
+    # Bounded LRU cache with per-entry expiry. Safe to share between the
+    # uvicorn thread and the Discord loop thread.
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses}
+
+    def __len__(self):
+        return len(self._data)
+
+class ExpiringSet:
+    # Set whose members expire ttl seconds after they were added. With a fixed ttl,
+    # insertion order is expiry order, so only entries at the head are ever
+    # checked: add() and `in` are O(1) amortised no matter how much traffic there is.
+    # max_entries caps memory; past it the oldest members are dropped early.
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # key -> expires_at
+        self._lock = threading.Lock()
+
+    def add(self, key):
+        # Returns True if key was not already a member
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            if key in self._data:
+                return False
+            self._data[key] = now + self.ttl
+            if len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+            return True
+
+    def __contains__(self, key):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            return key in self._data
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+    def _expire(self, now):
+        data = self._data
+        while data:
+            key, expires_at = next(iter(data.items()))
+            if expires_at > now:
+                break
+            data.popitem(last=False)
+
+class CachedLoader:
+    # TTLCache in front of an async Slack API lookup. Concurrent misses for the
+    # same key share one in-flight request, from a coroutine on either event loop.
+
+    def __init__(self, cache, fetch):
+        self.cache = cache
+        self.fetch = fetch
+        self._inflight = {}  # key -> concurrent.futures.Future
+        self._lock = threading.Lock()
+
+    async def get_async(self, key):
+        value = self.cache.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        future, owner = self._claim(key)
+        if not owner:
+            return await asyncio.wrap_future(future)
+
+        try:
+            value = await self.fetch(key)
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, value=value)
+        return value
+
+    def put(self, key, value):
+        self.cache.set(key, value)
+
+    def invalidate(self, key):
+        self.cache.invalidate(key)
+
+    def stats(self):
+        stats = self.cache.stats()
+        stats['inflight'] = len(self._inflight)
+        return stats
+
+    def _claim(self, key):
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future, False
+            future = concurrent.futures.Future()
+            self._inflight[key] = future
+            return future, True
+
+    def _finish(self, key, future, value=None, error=None):
+        if error is None:
+            self.cache.set(key, value)
+        with self._lock:
+            self._inflight.pop(key, None)
+        if error is None:
+            future.set_result(value)
+        else:
+            future.set_exception(error)
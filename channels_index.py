@@ -0,0 +1,87 @@
+import os
+import json
+import time
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+CHANNELS_FILE = 'channels.json'
+RELOAD_CHECK_INTERVAL = 2  # seconds between mtime checks of channels.json
+
+class ChannelsIndex:
+    # In-memory routing index built from channels.json.
+    # Lookups are plain dict reads; the file is re-read only when its mtime changes.
+
+    def __init__(self, file_path, check_interval=RELOAD_CHECK_INTERVAL):
+        self.file_path = os.path.abspath(file_path)
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._next_check = 0
+        # (slack_to_discord, discord_to_slack, by_name) swapped as one object on reload
+        self._maps = ({}, {}, {})
+
+    def slack_to_discord(self, slack_channel_id):
+        self._maybe_reload()
+        return self._maps[0].get(slack_channel_id)
+
+    def discord_to_slack(self, discord_channel_id):
+        self._maybe_reload()
+        return self._maps[1].get(discord_channel_id)
+
+    def channel_id_by_name(self, platform, channel_name):
+        # platform is the key used in channels.json: "slack_channel_id" or "discord_channel_id"
+        self._maybe_reload()
+        channel = self._maps[2].get(channel_name)
+        return channel.get(platform) if channel else None
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+
+        with self._lock:
+            if now < self._next_check:
+                return
+            self._next_check = now + self.check_interval
+
+            try:
+                mtime = os.stat(self.file_path).st_mtime_ns
+            except OSError as e:
+                if self._mtime is None:
+                    log.info('Error loading JSON from %s: %s', self.file_path, str(e))
+                    self._next_check = 0
+                    raise e
+                log.info('Error checking %s, keeping previous mapping: %s', self.file_path, str(e))
+                return
+
+            if mtime != self._mtime:
+                self._load(mtime)
+
+    def _load(self, mtime):
+        try:
+            with open(self.file_path, 'r', encoding='utf-8') as f:
+                channels_data = json.load(f)
+
+            mapping = channels_data['channels_mapping']
+            slack_to_discord = {item['slack_channel_id']: item['discord_channel_id'] for item in mapping}
+            discord_to_slack = {item['discord_channel_id']: item['slack_channel_id'] for item in mapping}
+            by_name = {}
+            for item in mapping:
+                if 'name' in item:
+                    by_name.setdefault(item['name'], item)
+        except Exception as e:
+            if self._mtime is None:
+                log.info('Error loading JSON from %s: %s', self.file_path, str(e))
+                self._next_check = 0
+                raise e
+            # Keep serving the previous mapping if the file is mid-edit or broken
+            log.info('Error reloading JSON from %s, keeping previous mapping: %s', self.file_path, str(e))
+            return
+
+        self._maps = (slack_to_discord, discord_to_slack, by_name)
+        self._mtime = mtime
+        log.info('Channels mapping loaded: %s channels', len(slack_to_discord))
+
+channels = ChannelsIndex(CHANNELS_FILE)
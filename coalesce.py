@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import metrics
+
+log = logging.getLogger(__name__)
+
+SEPARATOR = '\n'
+
+class Burst:
+    def __init__(self, author, text, source_id, send, future):
+        self.author = author
+        self.texts = [text]
+        self.length = len(text)
+        self.source_ids = [source_id]
+        self.send = send
+        self.future = future
+        self.timer = None
+
+class Coalescer:
+    # Merges consecutive plain-text posts by one author to one destination (channel or
+    # thread) that arrive within `window` seconds of the first into a single post.
+    # The first message of a burst starts it and a timer; later ones from the same
+    # author are appended until the timer fires, another author posts there, or the
+    # merged text would reach max_length. Then the burst is sent once, with the send
+    # callable of its first message, and every message in it gets the same result.
+    # A window of 0 disables it. Used from the Discord loop only.
+
+    def __init__(self, name, window, max_length):
+        self.name = name
+        self.window = window
+        self.max_length = max_length
+        self._bursts = {}  # destination -> Burst still collecting messages
+        self._sending = {}  # destination -> task sending its last closed burst
+
+    async def submit(self, destination, author, source_id, text, send, continuation=None):
+        # Returns (await send(merged text), source ids of every message in that post).
+        # `continuation` is the text to use when appended to a burst, e.g. without the
+        # author header the first message already has.
+        if not self.window or len(text) >= self.max_length:
+            await self.flush(destination)
+            return await send(text), [source_id]
+
+        piece = text if continuation is None else continuation
+        burst = self._bursts.get(destination)
+        if burst is not None and burst.author == author and burst.length + len(SEPARATOR) + len(piece) < self.max_length:
+            burst.texts.append(piece)
+            burst.length += len(SEPARATOR) + len(piece)
+            burst.source_ids.append(source_id)
+            metrics.coalesced_messages.inc(api=self.name)
+            log.debug('%s burst in %s: %s messages', self.name, destination, len(burst.source_ids))
+        else:
+            if burst is not None:
+                # Someone else spoke, or it's full: send the pending burst first to keep order
+                self._close(destination, burst)
+            loop = asyncio.get_running_loop()
+            burst = self._bursts[destination] = Burst(author, text, source_id, send, loop.create_future())
+            burst.timer = loop.call_later(self.window, self._close, destination, burst)
+
+        return await asyncio.shield(burst.future)
+
+    async def flush(self, destination):
+        # Sends the pending burst of destination now and waits for it, so a message that
+        # can't be merged (files, long text) is posted after it
+        burst = self._bursts.get(destination)
+        if burst is not None:
+            self._close(destination, burst)
+        future = self._sending.get(destination)
+        if future is not None:
+            await asyncio.wait([future])
+
+    def pending(self):
+        return sum(len(burst.source_ids) for burst in self._bursts.values())
+
+    def _close(self, destination, burst):
+        if self._bursts.get(destination) is not burst:
+            return
+        del self._bursts[destination]
+        burst.timer.cancel()
+        task = asyncio.ensure_future(self._send(burst))
+        self._sending[destination] = task
+        task.add_done_callback(lambda task: self._sent(destination, task))
+
+    def _sent(self, destination, task):
+        if self._sending.get(destination) is task:
+            del self._sending[destination]
+
+    async def _send(self, burst):
+        try:
+            result = await burst.send(SEPARATOR.join(burst.texts))
+        except Exception as e:
+            burst.future.set_exception(e)
+        else:
+            burst.future.set_result((result, list(burst.source_ids)))
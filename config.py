@@ -17,8 +17,81 @@ DISCORD_NEWBIES_WEBHOOK_URL = os.environ.get('DISCORD_NEWBIES_WEBHOOK_URL')
 DISCORD_WELCOME_TO_SLACK_WEBHOOK_URL = os.environ.get('DISCORD_WELCOME_TO_SLACK_WEBHOOK_URL')
 BOT_AVATAR_URL = os.environ.get('BOT_AVATAR_URL')
 
-SLACK_CHANNEL_LAST_USER = {}
-DISCORD_CHANNEL_LAST_USER = {}
+# Slack Web API endpoint; only changed to point the bot at a local stand-in (see benchmarks/)
+SLACK_API_BASE_URL = os.environ.get('SLACK_API_BASE_URL', 'https://slack.com/api/')
+
+# Slack user profile cache (users.info)
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 2000))
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 3600))  # seconds
+
+# Slack conversation metadata cache (conversations.info)
+CHANNEL_CACHE_SIZE = int(os.environ.get('CHANNEL_CACHE_SIZE', 1000))
+CHANNEL_CACHE_TTL = int(os.environ.get('CHANNEL_CACHE_TTL', 6 * 3600))  # seconds
+
+# Max seconds to wait for the message ts of a file uploaded to Slack
+FILE_SHARE_TIMEOUT = int(os.environ.get('FILE_SHARE_TIMEOUT', 30))
+
+# Max seconds a thread reply waits for its parent message to be mapped
+PARENT_MESSAGE_TIMEOUT = int(os.environ.get('PARENT_MESSAGE_TIMEOUT', 60))
+
+# Local cache of Slack <-> Discord message ID mappings in front of MongoDB
+MAPPING_CACHE_SIZE = int(os.environ.get('MAPPING_CACHE_SIZE', 10000))
+MAPPING_NEGATIVE_TTL = int(os.environ.get('MAPPING_NEGATIVE_TTL', 5))  # seconds
+
+# Attachments above this size (bytes) spill from memory to an anonymous temp file
+ATTACHMENT_SPOOL_MAX_MEMORY = int(os.environ.get('ATTACHMENT_SPOOL_MAX_MEMORY', 8 * 1024 * 1024))
+
+# Pooled HTTP sessions for file downloads and webhooks
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 10))  # connections per host
+HTTP_CONNECT_TIMEOUT = int(os.environ.get('HTTP_CONNECT_TIMEOUT', 10))  # seconds
+HTTP_READ_TIMEOUT = int(os.environ.get('HTTP_READ_TIMEOUT', 60))  # seconds
+ATTACHMENT_DOWNLOAD_CONCURRENCY = int(os.environ.get('ATTACHMENT_DOWNLOAD_CONCURRENCY', 4))
+
+# Discord webhook sender
+WEBHOOK_TIMEOUT = int(os.environ.get('WEBHOOK_TIMEOUT', 10))  # seconds per attempt
+WEBHOOK_MAX_RETRIES = int(os.environ.get('WEBHOOK_MAX_RETRIES', 3))
+
+# Outbound post scheduler: token bucket per destination channel or thread
+SLACK_POST_RATE = float(os.environ.get('SLACK_POST_RATE', 1.0))  # posts per second
+SLACK_POST_BURST = int(os.environ.get('SLACK_POST_BURST', 3))
+DISCORD_POST_RATE = float(os.environ.get('DISCORD_POST_RATE', 1.0))
+DISCORD_POST_BURST = int(os.environ.get('DISCORD_POST_BURST', 5))
+OUTBOUND_MAX_RETRIES = int(os.environ.get('OUTBOUND_MAX_RETRIES', 5))
+
+# Durable journal of accepted Slack events, replayed on startup
+JOURNAL_PATH = os.environ.get('JOURNAL_PATH', os.path.join('data', 'journal.sqlite3'))
+JOURNAL_MAX_ATTEMPTS = int(os.environ.get('JOURNAL_MAX_ATTEMPTS', 3))
+JOURNAL_RETRY_DELAY = float(os.environ.get('JOURNAL_RETRY_DELAY', 5))  # seconds before the first retry, doubled after each
+JOURNAL_MAX_AGE = float(os.environ.get('JOURNAL_MAX_AGE', 3600))  # seconds; older entries are dropped, not relayed
+
+# Cap for each event/file ID dedup set (roughly 200 bytes per entry)
+DEDUP_MAX_ENTRIES = int(os.environ.get('DEDUP_MAX_ENTRIES', 50000))
+
+# Deployment mode:
+#   combined - one process runs the Slack HTTP server and the Discord gateway (default)
+#   ingress  - stateless HTTP workers that verify Slack requests and journal them
+#   gateway  - the single Discord gateway process, consuming the journal
+BRIDGE_MODE = os.environ.get('BRIDGE_MODE', 'combined')
+INGRESS_HOST = os.environ.get('INGRESS_HOST', '0.0.0.0')
+INGRESS_PORT = int(os.environ.get('INGRESS_PORT', 5000))
+INGRESS_WORKERS = int(os.environ.get('INGRESS_WORKERS', os.cpu_count() or 1))
+JOURNAL_POLL_INTERVAL = float(os.environ.get('JOURNAL_POLL_INTERVAL', 0.05))  # seconds
+GATEWAY_CONCURRENCY = int(os.environ.get('GATEWAY_CONCURRENCY', 32))  # journal entries processed at once
+GATEWAY_METRICS_PORT = int(os.environ.get('GATEWAY_METRICS_PORT', 9100))  # /metrics of the gateway process
+
+# Logging: root level, per-module overrides ("slack_bot=DEBUG,discord=WARNING"),
+# 'text' or 'json' lines, and whether to echo log lines to stdout
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_LEVELS = os.environ.get('LOG_LEVELS', '')
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+LOG_TO_CONSOLE = os.environ.get('LOG_TO_CONSOLE', '1') not in ('0', 'false', 'False', '')
+
+# How long the last speaker of a channel is remembered for merging consecutive messages
+LAST_SPEAKER_TTL = int(os.environ.get('LAST_SPEAKER_TTL', 300))  # seconds
+
+# Opt-in merging of one author's rapid consecutive plain-text messages to the same
+# channel or thread into one post (see coalesce.py); 0 disables it, a few hundred ms is typical
+COALESCE_WINDOW_MS = int(os.environ.get('COALESCE_WINDOW_MS', 0))
 
 SLACK_BOT_ID = None
 DISCORD_BOT_ID = None
\ No newline at end of file
@@ -0,0 +1,45 @@
+import os
+import json
+import tempfile
+import pytest
+import config
+
+# journal opens its shared journal on import; keep that file out of the working tree
+config.JOURNAL_PATH = os.path.join(tempfile.mkdtemp(prefix='journal-test-'), 'journal.sqlite3')
+
+@pytest.fixture(scope='session')
+def fake_slack():
+    from benchmarks.fakes import FakeSlack, Recorder
+    slack = FakeSlack('test-signing-secret', {'C1': 'general', 'CDISCORD': 'discord'}, Recorder())
+    slack.start()
+    return slack
+
+@pytest.fixture(scope='session')
+def slack_bot(fake_slack, tmp_path_factory):
+    # slack_bot calls auth.test on import, so the local fake Slack answers it.
+    # C1 <-> 900 is the only mapped channel pair.
+    import channels_index
+    channels_file = tmp_path_factory.mktemp('channels') / 'channels.json'
+    channels_file.write_text(json.dumps({'channels_mapping': [
+        {'slack_channel_id': 'C1', 'discord_channel_id': '900', 'name': 'general'}
+    ]}))
+    channels_index.channels.file_path = str(channels_file)
+
+    config.SLACK_TOKEN = 'xoxb-test'
+    config.SIGNING_SECRET = fake_slack.signing_secret
+    config.SLACK_API_BASE_URL = fake_slack.api_url
+    config.MONGO_DB = 'mongodb://127.0.0.1:1/?serverSelectionTimeoutMS=1'
+    config.DB_COLLECTION = 'test_messages'
+    import slack_bot
+    return slack_bot
+
+@pytest.fixture(scope='session')
+def main(slack_bot, tmp_path_factory):
+    # main sets up logging into ./logs on import; keep that out of the working tree
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('main'))
+    try:
+        import main
+    finally:
+        os.chdir(cwd)
+    return main
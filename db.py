@@ -1,36 +1,189 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING
+from pymongo.errors import PyMongoError, DuplicateKeyError
+from contextlib import contextmanager
+import asyncio
+import time
 import logging
 import config
+import metrics
+from cache import TTLCache
+from waiters import message_mappings
+
+log = logging.getLogger(__name__)
 
 # MongoDB configuration
-mongo_client = MongoClient(config.MONGO_DB)  
+mongo_client = MongoClient(config.MONGO_DB)
 db = mongo_client['HACKLAB']
 messages_collection = db[config.DB_COLLECTION]
+# Messages merged into a post relayed for another message (see coalesce.py):
+# {'platform': 'slack'|'discord', 'message_id': source ID, 'target_id': ID of the post on the other side}
+aliases_collection = db[f'{config.DB_COLLECTION}_aliases']
+
+# Write-through cache of recent mappings in both directions, plus short-lived misses
+slack_to_discord_cache = TTLCache(maxsize=config.MAPPING_CACHE_SIZE)
+discord_to_slack_cache = TTLCache(maxsize=config.MAPPING_CACHE_SIZE)
+missing_cache = TTLCache(maxsize=config.MAPPING_CACHE_SIZE, ttl=config.MAPPING_NEGATIVE_TTL)
+
+def ensure_indexes():
+    # Function to create unique lookup indexes for both directions of the mapping
+    for field in ('slack_message_id', 'discord_message_id'):
+        try:
+            with record_latency('create_index'):
+                messages_collection.create_index([(field, ASCENDING)], unique=True, name=f'{field}_unique')
+            log.info('Index ensured on %s', field)
+        except PyMongoError as e:
+            # Most likely duplicate IDs from before the index existed
+            log.info('Error creating index on %s: %s', field, e)
+    try:
+        with record_latency('create_index'):
+            aliases_collection.create_index([('platform', ASCENDING), ('message_id', ASCENDING)], unique=True, name='platform_message_id_unique')
+        log.info('Index ensured on aliases')
+    except PyMongoError as e:
+        log.info('Error creating index on aliases: %s', e)
 
 def save_message_to_db(slack_message_id, discord_message_id):
-    messages_collection.insert_one({
-        "slack_message_id": slack_message_id,
-        "discord_message_id": discord_message_id
-    })
-    logger(f'Message saved to database: {slack_message_id:} : {discord_message_id}')
+    try:
+        with record_latency('insert_one'):
+            messages_collection.insert_one({
+                "slack_message_id": slack_message_id,
+                "discord_message_id": discord_message_id
+            })
+        log.info('Message saved to database: %s : %s', slack_message_id, discord_message_id)
+    except DuplicateKeyError:
+        log.info('Message already saved to database: %s : %s', slack_message_id, discord_message_id)
+
+    cache_mapping(slack_message_id, discord_message_id)
+
+    # Wake thread replies that arrived before their parent was mapped
+    message_mappings.resolve(('slack', slack_message_id), discord_message_id)
+    message_mappings.resolve(('discord', discord_message_id), slack_message_id)
 
+def save_alias(platform, message_id, target_id):
+    # Map a merged source message to the post that carries it, like save_message_to_db
+    # does for the message the post was started by
+    try:
+        with record_latency('insert_alias'):
+            aliases_collection.insert_one({
+                "platform": platform,
+                "message_id": message_id,
+                "target_id": target_id
+            })
+        log.info('Alias saved to database: %s %s : %s', platform, message_id, target_id)
+    except DuplicateKeyError:
+        log.info('Alias already saved to database: %s %s : %s', platform, message_id, target_id)
 
-def get_discord_message_id(slack_message_id):
-    result = messages_collection.find_one({"slack_message_id": slack_message_id})
+    cache_alias(platform, message_id, target_id)
+    message_mappings.resolve((platform, message_id), target_id)
+
+def find_alias(platform, message_id):
+    with record_latency('find_alias'):
+        result = aliases_collection.find_one({"platform": platform, "message_id": message_id}, {"_id": 0, "target_id": 1})
+    return result['target_id'] if result else None
+
+def find_discord_message_id(slack_message_id):
+    # Database part of get_discord_message_id_async, for callers that checked the cache already
+    with record_latency('find_discord_message_id'):
+        result = messages_collection.find_one({"slack_message_id": slack_message_id}, {"_id": 0, "discord_message_id": 1})
     if result:
-        logger("Discord message ID have been found for this Slack message ID")
+        log.info("Discord message ID have been found for this Slack message ID")
+        cache_mapping(slack_message_id, result['discord_message_id'])
         return result['discord_message_id']
-    logger("Discord message ID not found for this Slack message ID")
+    target_id = find_alias('slack', slack_message_id)
+    if target_id is not None:
+        log.info("Discord message ID have been found for this merged Slack message ID")
+        cache_alias('slack', slack_message_id, target_id)
+        return target_id
+    log.info("Discord message ID not found for this Slack message ID")
+    missing_cache.set(('slack', slack_message_id), True)
     raise KeyError("Discord message ID not found for this Slack message ID")
 
-def get_slack_message_id(discord_message_id):
-    result = messages_collection.find_one({"discord_message_id": discord_message_id})
+def find_slack_message_id(discord_message_id):
+    # Database part of get_slack_message_id_async, for callers that checked the cache already
+    with record_latency('find_slack_message_id'):
+        result = messages_collection.find_one({"discord_message_id": discord_message_id}, {"_id": 0, "slack_message_id": 1})
     if result:
-        logger("Slack message ID have been found for this Discord message ID")
+        log.info("Slack message ID have been found for this Discord message ID")
+        cache_mapping(result['slack_message_id'], discord_message_id)
         return result['slack_message_id']
-    logger("Slack message ID not found for this Discord message ID")
+    target_id = find_alias('discord', discord_message_id)
+    if target_id is not None:
+        log.info("Slack message ID have been found for this merged Discord message ID")
+        cache_alias('discord', discord_message_id, target_id)
+        return target_id
+    log.info("Slack message ID not found for this Discord message ID")
+    missing_cache.set(('discord', discord_message_id), True)
     raise KeyError("Slack message ID not found for this Discord message ID")
 
-def logger(log_text):
-    print(log_text) 
-    logging.info(log_text)
\ No newline at end of file
+#------------------------------------------
+# Async API: pymongo calls run in the default executor so neither the
+# uvicorn loop nor the Discord loop blocks on Mongo
+#------------------------------------------
+
+async def save_message_to_db_async(slack_message_id, discord_message_id):
+    await asyncio.to_thread(save_message_to_db, slack_message_id, discord_message_id)
+
+async def save_alias_async(platform, message_id, target_id):
+    await asyncio.to_thread(save_alias, platform, message_id, target_id)
+
+async def get_discord_message_id_async(slack_message_id):
+    cached = lookup_cache(slack_to_discord_cache, ('slack', slack_message_id))
+    if cached is not None:
+        return cached
+    return await asyncio.to_thread(find_discord_message_id, slack_message_id)
+
+async def get_slack_message_id_async(discord_message_id):
+    cached = lookup_cache(discord_to_slack_cache, ('discord', discord_message_id))
+    if cached is not None:
+        return cached
+    return await asyncio.to_thread(find_slack_message_id, discord_message_id)
+
+#------------------------------------------
+# Mapping cache helpers
+#------------------------------------------
+
+def cache_mapping(slack_message_id, discord_message_id):
+    slack_to_discord_cache.set(slack_message_id, discord_message_id)
+    discord_to_slack_cache.set(discord_message_id, slack_message_id)
+    missing_cache.invalidate(('slack', slack_message_id))
+    missing_cache.invalidate(('discord', discord_message_id))
+
+def cache_alias(platform, message_id, target_id):
+    # One direction only: the target maps back to the message its post was started by
+    cache = slack_to_discord_cache if platform == 'slack' else discord_to_slack_cache
+    cache.set(message_id, target_id)
+    missing_cache.invalidate((platform, message_id))
+
+MISSING_MESSAGES = {
+    'slack': "Discord message ID not found for this Slack message ID",
+    'discord': "Slack message ID not found for this Discord message ID",
+}
+
+def lookup_cache(cache, missing_key):
+    # Returns the cached ID, raises KeyError for a recently confirmed miss, None if unknown
+    platform, message_id = missing_key
+    value = cache.get(message_id)
+    if value is not None:
+        return value
+    if missing_cache.get(missing_key):
+        log.info('%s (cached)', MISSING_MESSAGES[platform])
+        raise KeyError(MISSING_MESSAGES[platform])
+    return None
+
+def get_cache_stats():
+    return {
+        'slack_to_discord': slack_to_discord_cache.stats(),
+        'discord_to_slack': discord_to_slack_cache.stats(),
+        'missing': missing_cache.stats(),
+    }
+
+#------------------------------------------
+
+@contextmanager
+def record_latency(operation):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.db_seconds.observe(elapsed, operation=operation)
+        log.debug('db.%s took %.1f ms', operation, elapsed * 1000)
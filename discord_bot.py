@@ -4,19 +4,68 @@ from discord.ext import commands
 from slack_sdk.errors import SlackApiError
 import config
 import db
-import urllib.parse
-import aiohttp
-import os
+from channels_index import channels
+from waiters import file_shares, POKED
+from attachments import download_attachments, close_attachments
+import http_sessions
+from outbound import OutboundScheduler
+from coalesce import Coalescer
+import metrics
+from last_speaker import slack_last_speakers, discord_last_speakers, SAME_SPEAKER_WINDOW
+import asyncio
 import time
-import re
 import json
 import logging
-import datetime
+
+journal_replayed = False
+
+FILE_SHARE_POLL_INITIAL_DELAY = 0.5  # seconds
+FILE_SHARE_POLL_MAX_DELAY = 4
+
+DISCORD_CDN_URL = 'https://cdn.discordapp.com/'
+
+SLACK_MAX_MESSAGE_LENGTH = 4000  # longer chat.postMessage text gets truncated by Slack
+
+class BridgeClient(Client):
+    # Discord client that owns the pooled HTTP sessions used on its event loop
+
+    metrics_runner = None
+
+    async def setup_hook(self) -> None:
+        await http_sessions.open_sessions(DISCORD_CDN_URL)
+        # The gateway has no FastAPI app, so it serves its own /metrics
+        if config.BRIDGE_MODE == 'gateway':
+            self.metrics_runner = await metrics.serve(config.INGRESS_HOST, config.GATEWAY_METRICS_PORT)
+
+    async def close(self) -> None:
+        await http_sessions.close_sessions()
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()
+        await super().close()
+
+def slack_retry_after(error):
+    # Seconds to wait if a Slack Web API error is a rate limit, else None
+    if isinstance(error, SlackApiError) and error.response.status_code == 429:
+        headers = {key.lower(): value for key, value in (error.response.headers or {}).items()}
+        return float(headers.get('retry-after', 1))
+    return None
+
+# Every post to Slack goes through here: per-channel token buckets, 429s retried from the queue
+slack_outbound = OutboundScheduler(
+    'slack',
+    rate=config.SLACK_POST_RATE,
+    burst=config.SLACK_POST_BURST,
+    max_retries=config.OUTBOUND_MAX_RETRIES,
+    retry_after=slack_retry_after,
+)
+
+# Opt-in: one Discord user's rapid consecutive text messages go out as one Slack post
+slack_coalescer = Coalescer('slack', window=config.COALESCE_WINDOW_MS / 1000, max_length=SLACK_MAX_MESSAGE_LENGTH)
 
 intents = Intents.default()
 intents.message_content = True 
 intents.members = True
-discord_client = Client(intents=intents)
+discord_client = BridgeClient(intents=intents)
 
 #------------------------------------------
 # Event handlers for Discord
@@ -24,19 +73,28 @@ discord_client = Client(intents=intents)
 
 @discord_client.event
 async def on_ready() -> None:
+    global journal_replayed
     config.DISCORD_BOT_ID = discord_client.user.id
-    logger(f'{discord_client.user} is now running!')
+    logger('%s is now running!', discord_client.user)
+
+    # on_ready fires again after reconnects; start journal processing only once
+    if not journal_replayed:
+        from slack_bot import replay_journal, consume_journal
+        journal_replayed = True
+        if config.BRIDGE_MODE == 'gateway':
+            asyncio.ensure_future(consume_journal())
+        else:
+            asyncio.ensure_future(replay_journal())
 
 @discord_client.event
 async def on_member_join(member):
     logger('New member!')
 
-    send_greet_message(member)
+    await send_greet_message(member)
 
 @discord_client.event
 async def on_message(message: Message):
     if message.author == discord_client.user:
-        update_last_message_user_id()
         set_last_message_user_id(message)
 
         logger('Message from bot')
@@ -49,30 +107,27 @@ async def on_message(message: Message):
     # logger(f'DISCORD INCOMING REQUEST: {message}') 
     
     if isinstance(message.channel, discord.TextChannel):
-        logger(f'-------DISCORD - NEW MESSAGE-------')
-        logger(f'---> {message.content}')
+        logger('-------DISCORD - NEW MESSAGE-------')
+        logger('---> %s', message.content, level=logging.DEBUG)
 
-        update_last_message_user_id()
-        result = await send_new_message_to_slack(message)
+        result = await relay_to_slack(send_new_message_to_slack, message)
         set_last_message_user_id(message)
         return result
 
     elif isinstance(message.channel, discord.Thread):
         if message.type == MessageType.default:
-            logger(f'-------DISCORD - THREAD MESSAGE-------')
-            logger(f'---> {message.content}')
+            logger('-------DISCORD - THREAD MESSAGE-------')
+            logger('---> %s', message.content, level=logging.DEBUG)
             
-            update_last_message_user_id()
-            result = await send_thread_message_to_slack(message)
+            result = await relay_to_slack(send_thread_message_to_slack, message)
             set_last_message_user_id(message)
             return result
 
         elif message.type == MessageType.reply:
-            logger(f'-------DISCORD - REPLY MESSAGE IN THREAD-------')
-            logger(f'---> {message.content}')
+            logger('-------DISCORD - REPLY MESSAGE IN THREAD-------')
+            logger('---> %s', message.content, level=logging.DEBUG)
             
-            update_last_message_user_id()
-            result = await send_thread_message_to_slack(message)
+            result = await relay_to_slack(send_thread_message_to_slack, message)
             set_last_message_user_id(message)
             return result
         else:
@@ -86,77 +141,52 @@ async def on_message(message: Message):
 # Helper functions to manage last message user ID
 #------------------------------------------
 
-def update_last_message_user_id():
-    # delete expired object by timestamp after 1 minute 
-    for key in list(config.DISCORD_CHANNEL_LAST_USER.keys()):
-        if config.DISCORD_CHANNEL_LAST_USER[key]['timestamp'] < (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=5)):
-            del config.DISCORD_CHANNEL_LAST_USER[key]
-
-            # --- printing for debugging ---
-            channel_name = key
-            logger(f'Last message user ID deleted for discord channel: {channel_name}')
-    logger(f'Updated discord last message user ID dict: \n{json.dumps(config.DISCORD_CHANNEL_LAST_USER, indent=2, default=str)}')
-
 def check_last_message_user_id(message, slack_channel_id):
     # Function to check if the last message user ID is the same as the current user ID
     discord_channel_id = str(message.channel.id)
     message_author_id = str(message.author.id)
 
-    if discord_channel_id in config.DISCORD_CHANNEL_LAST_USER:
-        user_id = config.DISCORD_CHANNEL_LAST_USER[discord_channel_id]['user_id']
-        if user_id == message_author_id:
-            logger(f'In this discord channel, the last message was sent by the same user: {user_id}')
-
-            if slack_channel_id in config.SLACK_CHANNEL_LAST_USER:
-                slack_channel_last_user_id = config.SLACK_CHANNEL_LAST_USER[slack_channel_id]['user_id']
-                logger(f'Last message user ID in slack channel: {slack_channel_last_user_id}')
-                logger(f'SLACK_BOT_ID: {config.SLACK_BOT_ID}')
-                if slack_channel_last_user_id == config.SLACK_BOT_ID:
-                    logger(f'Slack bot was the last user: {user_id}')
-                    return True
-                else:
-                    if config.DISCORD_CHANNEL_LAST_USER[discord_channel_id]['timestamp'] > (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=1)):
-                        # Check if the last message was sent less than 1 second ago
-                        logger(f'New message was sent after less than 1 second from last message')
-                        return True
-                    else:
-                        logger(f'Slack bot was not the last user: {user_id}')
-                        return False
-            else:
-                if config.DISCORD_CHANNEL_LAST_USER[discord_channel_id]['timestamp'] > (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=1)):
-                    # Check if the last message was sent less than 1 second ago
-                    logger(f'New message was sent after less than 1 second from last message')
-                    return True
-                else:
-                    logger(f'No channel {slack_channel_id} found in SLACK_CHANNEL_LAST_USER: \n{json.dumps(config.SLACK_CHANNEL_LAST_USER, indent=2, default=str)}')
-                    return False
-        else:
-            logger(f'In this discord channel, the last message was sent by a different user: {user_id}')
-            return False
-    else:
-        logger(f'No channel {discord_channel_id} found in DISCORD_CHANNEL_LAST_USER')
+    discord_speaker = discord_last_speakers.get(discord_channel_id)
+    if discord_speaker is None:
+        logger('No channel %s found in discord_last_speakers', discord_channel_id, level=logging.DEBUG)
+        return False
+
+    if discord_speaker.user_id != message_author_id:
+        logger('In this discord channel, the last message was sent by a different user: %s', discord_speaker.user_id, level=logging.DEBUG)
         return False
+    logger('In this discord channel, the last message was sent by the same user: %s', message_author_id, level=logging.DEBUG)
+
+    slack_speaker = slack_last_speakers.get(slack_channel_id)
+    if slack_speaker is not None:
+        logger('Last message user ID in slack channel: %s', slack_speaker.user_id, level=logging.DEBUG)
+        if slack_speaker.user_id == config.SLACK_BOT_ID:
+            logger('Slack bot was the last user: %s', message_author_id, level=logging.DEBUG)
+            return True
+
+    if discord_speaker.age < SAME_SPEAKER_WINDOW:
+        # Check if the last message was sent less than 1 second ago
+        logger('New message was sent after less than 1 second from last message', level=logging.DEBUG)
+        return True
+
+    logger('Slack bot was not the last user in slack channel: %s', slack_channel_id, level=logging.DEBUG)
+    return False
 
 def set_last_message_user_id(message):
     # Set the last message user ID for the current channel
-    user_id = str(message.author.id)
-    channel_id = str(message.channel.id)
+    discord_last_speakers.set(str(message.channel.id), str(message.author.id))
 
-    config.DISCORD_CHANNEL_LAST_USER[channel_id] = {'user_id': user_id, 'timestamp': datetime.datetime.now(datetime.timezone.utc)}
-    
     # --- printing for debugging ---
     channel_name = message.channel.name if hasattr(message.channel, 'name') else message.channel.parent.name
     user_name = message.author.display_name
-    logger(f'Discord Last message user ID set: {user_name} for channel: {channel_name}')
-    logger(f'Discord Last message user ID dict: \n{json.dumps(config.DISCORD_CHANNEL_LAST_USER, indent=2, default=str)}')
+    logger('Discord Last message user ID set: %s for channel: %s', user_name, channel_name, level=logging.DEBUG)
     return
 
 #------------------------------------------
 # Helper functions to send greeting message
 #------------------------------------------
 
-def send_greet_message(message):
-    from slack_bot import sync_slack_client
+async def send_greet_message(message):
+    from slack_bot import slack_client
 
     user_name = message.name
     user_id = message.id
@@ -194,30 +224,32 @@ def send_greet_message(message):
         ]
     }
 
-    response = sync_slack_client.chat_postMessage(**slack_message)
+    response = await slack_outbound.submit(slack_channel_id, slack_client.chat_postMessage, **slack_message)
     return response
 
 def get_channel_id_by_name(platform, channel_name):
-    # Function to get channel ID by name from JSON
-    try:
-        file_path = os.path.abspath('channels.json')
-        with open(file_path, 'r', encoding='utf-8') as f:
-            channels_data = json.load(f)
-        for channel in channels_data['channels_mapping']:
-            if channel['name'] == channel_name:
-                return channel[platform]
-        return None
-    except Exception as e:
-        print(f'Error loading JSON from {file_path}: {str(e)}')
-        raise e
+    # Function to get channel ID by name from the channels index
+    return channels.channel_id_by_name(platform, channel_name)
     
 #------------------------------------------
 # Helper functions to send messages to Slack
 #------------------------------------------
 
+async def relay_to_slack(send, message):
+    # Run one relay, recording its total time and outcome
+    start = time.perf_counter()
+    result = 'error'
+    try:
+        response = await send(message)
+        result = json.loads(response)['status'] if response else 'skipped'
+        return response
+    finally:
+        metrics.relay_seconds.observe(time.perf_counter() - start, direction='discord_to_slack')
+        metrics.relayed_messages.inc(direction='discord_to_slack', result=result)
+
 async def send_new_message_to_slack(message: Message):
     # Function to send a new message to Slack
-    from slack_bot import sync_slack_client
+    from slack_bot import slack_client, get_channel_name_async
     discord_message_id = message.id
 
     try:
@@ -226,97 +258,135 @@ async def send_new_message_to_slack(message: Message):
     except ValueError:
         return
     
-    if message.attachments:
-        logger('MESSAGE WITH FILES')
-
-        file_paths, files = await collect_files(message)
+    with metrics.stage_seconds.time(direction='discord_to_slack', stage='file_download'):
+        files = await collect_files(message) if message.attachments else []
 
-        response = sync_slack_client.files_upload_v2(
-            channel=channel_to_send,
-            initial_comment=text,
-            file_uploads=[{
-                'file': file['file'],
-                'filename': file['filename']
-            } for file in files]
-            )      
+    if files:
+        logger('MESSAGE WITH FILES')
+        merged_ids = [discord_message_id]
 
-        slack_message_id = wait_message_ID(sync_slack_client, response)
-        delete_files(file_paths)
+        try:
+            await slack_coalescer.flush(channel_to_send)
+            with metrics.stage_seconds.time(direction='discord_to_slack', stage='slack_upload'):
+                response = await slack_outbound.submit(channel_to_send, lambda: slack_client.files_upload_v2(
+                    channel=channel_to_send,
+                    initial_comment=text,
+                    file_uploads=[{
+                        'file': file.rewind(),
+                        'filename': file.filename
+                    } for file in files]
+                    ))
+        finally:
+            close_attachments(files)
+
+        with metrics.stage_seconds.time(direction='discord_to_slack', stage='file_share_wait'):
+            slack_message_id = await wait_message_ID(slack_client, response)
     else:
         logger('MESSAGE WITHOUT FILES')
 
-        response = sync_slack_client.chat_postMessage(
-            channel=channel_to_send,  
-            text=text
-        ) 
+        with metrics.stage_seconds.time(direction='discord_to_slack', stage='slack_post'):
+            # Unmapped channels all post to one Slack channel; only messages from the same
+            # source channel may merge, since later ones are added without the #channel header
+            response, merged_ids = await slack_coalescer.submit(
+                channel_to_send, (message.author.id, get_channel_id_and_name(message)[0]), discord_message_id, text,
+                lambda text: slack_outbound.submit(
+                    channel_to_send,
+                    slack_client.chat_postMessage,
+                    channel=channel_to_send,
+                    text=text
+                ),
+                continuation=format_body(message)
+            )
         slack_message_id = response['ts']
     
-    result = sync_slack_client.conversations_info(channel=channel_to_send)
-    channel_name = result['channel']['name']
+    channel_name = await get_channel_name_async(channel_to_send)
 
-    logger(f'New message sent to Slack: #{channel_name}!')
+    logger('New message sent to Slack: #%s!', channel_name)
 
     if slack_message_id:
-        db.save_message_to_db(slack_message_id, discord_message_id)
+        with metrics.stage_seconds.time(direction='discord_to_slack', stage='db_save'):
+            if merged_ids[0] == discord_message_id:
+                await db.save_message_to_db_async(slack_message_id, discord_message_id)
+            else:
+                # Merged into a post started by an earlier message
+                await db.save_alias_async('discord', discord_message_id, slack_message_id)
         logger("---> 'send_new_message_to_slack' func is done")
         return json.dumps({"status":"ok"})  
     else:
         logger('---> slack_message_id is empty')
         return json.dumps({"status":"false"})
 
-def wait_message_ID(sync_slack_client, response):
-    # Polling the files.info API to get the 'shares' property with ts and thread_ts
+async def wait_message_ID(slack_client, response):
+    # Wait for the message ts of the uploaded file. Slack usually pushes it with the
+    # file_share message event (see slack_bot.resolve_file_shares); files.info polling
+    # with backoff is the fallback until FILE_SHARE_TIMEOUT runs out.
     file_id = response['files'][0]['id']
 
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + config.FILE_SHARE_TIMEOUT
+    delay = FILE_SHARE_POLL_INITIAL_DELAY
+
     while True:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            logger('Timed out waiting for message ts of file: %s', file_id)
+            return None
+
         try:
-            file_info = sync_slack_client.files_info(file=file_id)
-            # print('----- file_info -----\n', file_info)
-            shares = file_info['file'].get('shares')
-            
-            if shares:
-                logger(f'----- SHARES -----\n%s: {shares}')
-
-                if 'private' in shares and shares['private']:
-                    shared_channels = list(shares['private'].keys())
-                    if shared_channels:
-                        channel = shared_channels[0]
-                        ts = shares['private'][channel][0]['ts']  # Извлечение ts для private
-                        logger(f"Parent message ts (private): {ts}")
-                        return ts
-                    
-                elif 'public' in shares and shares['public']:
-                    shared_channels = list(shares['public'].keys())
-                    if shared_channels:
-                        channel = shared_channels[0]
-                        ts = shares['public'][channel][0]['ts']  # Извлечение ts для public
-                        logger("Parent message ts (public): {ts}")
-                        return ts
-                else:
-                    logger("No shares found in public or private sections.")
-                    return None
-                
-            logger('NO SHARES YET')
-            time.sleep(1)  # Wait 1 second before polling again
-        except SlackApiError as e:
-            logger(f"""Error retrieving file info: {e.response['error']}""")
+            ts = await file_shares.wait(file_id, timeout=min(delay, remaining))
+            if ts is not POKED:
+                logger('Parent message ts (event): %s', ts)
+                return ts
+        except asyncio.TimeoutError:
+            pass
+
+        ts = await poll_file_share_ts(slack_client, file_id)
+        if ts:
+            return ts
+
+        logger('NO SHARES YET')
+        delay = min(delay * 2, FILE_SHARE_POLL_MAX_DELAY)
+
+async def poll_file_share_ts(slack_client, file_id):
+    # Single files.info lookup of the 'shares' property with ts and thread_ts
+    try:
+        file_info = await slack_client.files_info(file=file_id)
+    except SlackApiError as e:
+        metrics.api_errors.inc(api='slack_files_info', reason='error')
+        logger('Error retrieving file info: %s', e.response['error'])
+        return None
+
+    shares = file_info['file'].get('shares')
+    if not shares:
+        return None
+
+    logger('----- SHARES -----\n%s', shares, level=logging.DEBUG)
+    for visibility in ('private', 'public'):
+        if shares.get(visibility):
+            channel = next(iter(shares[visibility]))
+            ts = shares[visibility][channel][0]['ts']
+            logger('Parent message ts (%s): %s', visibility, ts)
+            file_shares.resolve(file_id, ts)
+            return ts
+
+    logger("No shares found in public or private sections.")
+    return None
 
 async def send_thread_message_to_slack(message: Message):
-    from slack_bot import sync_slack_client
+    from slack_bot import slack_client, get_channel_name_async
 
   # Получаем ID родительского сообщения
     discord_parent_message = await message.channel.parent.fetch_message(message.channel.id)
     discord_parent_message_id = discord_parent_message.id
-    channel_id = str(message.channel.id)
 
     # logger(f'Parent message ID: {discord_parent_message_id}')
-    # logger(f'Channel ID: {channel_id}')
 
     try:
-        slack_parent_message_id = db.get_slack_message_id(discord_parent_message_id)
-        logger(f'Slack parent message ID: {slack_parent_message_id}')
+        with metrics.stage_seconds.time(direction='discord_to_slack', stage='parent_lookup'):
+            slack_parent_message_id = await db.get_slack_message_id_async(discord_parent_message_id)
+        logger('Slack parent message ID: %s', slack_parent_message_id)
     except KeyError:
-        logger(f'Slack message ID not found for Discord message ID: {discord_parent_message_id}')
+        logger('Slack message ID not found for Discord message ID: %s', discord_parent_message_id)
         return
 
     if slack_parent_message_id:
@@ -326,43 +396,53 @@ async def send_thread_message_to_slack(message: Message):
         except ValueError:
             return
 
-        if message.attachments:
-            logger('MESSAGE WITH FILES')
+        with metrics.stage_seconds.time(direction='discord_to_slack', stage='file_download'):
+            files = await collect_files(message) if message.attachments else []
 
-            file_paths, files = await collect_files(message)
+        if files:
+            logger('MESSAGE WITH FILES')
 
             # Upload all files at once using files_upload_v2
-            response = sync_slack_client.files_upload_v2(
-                channels=channel_to_send,
-                initial_comment=text,
-                file_uploads=[{
-                    'file': file['file'],
-                    'filename': file['filename']
-                } for file in files], 
-                thread_ts=slack_parent_message_id
-            )
-
-            delete_files(file_paths)
+            try:
+                await slack_coalescer.flush((channel_to_send, slack_parent_message_id))
+                with metrics.stage_seconds.time(direction='discord_to_slack', stage='slack_upload'):
+                    response = await slack_outbound.submit(channel_to_send, lambda: slack_client.files_upload_v2(
+                        channels=channel_to_send,
+                        initial_comment=text,
+                        file_uploads=[{
+                            'file': file.rewind(),
+                            'filename': file.filename
+                        } for file in files],
+                        thread_ts=slack_parent_message_id
+                    ))
+            finally:
+                close_attachments(files)
 
         else:
             logger('MESSAGE WITHOUT IMAGE')
 
-            response = sync_slack_client.chat_postMessage(
-                channel=channel_to_send,  # Укажите ID канала Slack, куда отправлять
-                text=text,
-                thread_ts=slack_parent_message_id
-            ) 
+            with metrics.stage_seconds.time(direction='discord_to_slack', stage='slack_post'):
+                response, _ = await slack_coalescer.submit(
+                    (channel_to_send, slack_parent_message_id), message.author.id, message.id, text,
+                    lambda text: slack_outbound.submit(
+                        channel_to_send,
+                        slack_client.chat_postMessage,
+                        channel=channel_to_send,  # Укажите ID канала Slack, куда отправлять
+                        text=text,
+                        thread_ts=slack_parent_message_id
+                    ),
+                    continuation=format_body(message)
+                )
 
         if response.get('ok'): 
-            result = sync_slack_client.conversations_info(channel=channel_to_send)
-            channel_name = result['channel']['name']
+            channel_name = await get_channel_name_async(channel_to_send)
 
-            logger(f'Thread message sent to Slack: #{channel_name}')
+            logger('Thread message sent to Slack: #%s', channel_name)
             logger("---> 'send_thread_message_to_slack' func is done")
 
             return json.dumps({"status":"ok"})  
         else:
-            logger(f"""Ошибка при загрузке файла: {response.get('error')}""")
+            logger('Ошибка при загрузке файла: %s', response.get('error'))
             return json.dumps({"status":"false"})  
 
 def format_mentions(message):
@@ -378,17 +458,14 @@ def format_mentions(message):
         return user_message
 
 def choose_channel(message):
-    # Загрузка маппинга каналов
-    discord_channels_dict = load_channels_mapping()
-
     channel_id, channel_name = get_channel_id_and_name(message)
 
     # Проверка наличия канала в словаре и создание текста для отправки
-    if channel_id in discord_channels_dict:
-        slack_channel = discord_channels_dict[channel_id]
+    slack_channel = channels.discord_to_slack(channel_id)
+    if slack_channel is not None:
         return slack_channel 
     else:
-        logger(f'DISCORD - MESSAGE FROM OTHER CHANNEL - #{channel_name}')
+        logger('DISCORD - MESSAGE FROM OTHER CHANNEL - #%s', channel_name)
         if channel_name != None:
             channel_to_send = config.SLACK_CHANNEL_DISCORD
             return channel_to_send
@@ -396,21 +473,22 @@ def choose_channel(message):
             logger('UNKNOWN CHANNEL NAME')
             return
         
+def format_body(message):
+    # The message text without the author header
+    if message.stickers:
+        return f":dancing-penguin:"
+    return format_mentions(message)
+
 def format_text(message, channel_to_check_id=None):
-    discord_channels_dict = load_channels_mapping()
     channel_id, channel_name = get_channel_id_and_name(message)
 
-    if message.stickers:
-        user_message = f":dancing-penguin:"
-    else:
-        user_message = format_mentions(message)
-
+    user_message = format_body(message)
     user_name = message.author.display_name
 
-    logger(f'Message from user: {user_name}')
-    logger(f'Message in channel: {channel_name}, ID: {channel_id}')
+    logger('Message from user: %s', user_name)
+    logger('Message in channel: %s, ID: %s', channel_name, channel_id)
 
-    if channel_id in discord_channels_dict:
+    if channels.discord_to_slack(channel_id) is not None:
         text = user_message
         if not check_last_message_user_id(message, channel_to_check_id):
             text = f'💂*_{user_name}_*\n{text}'
@@ -419,18 +497,6 @@ def format_text(message, channel_to_check_id=None):
 
     return text
 
-def load_channels_mapping():
-    # Функция для загрузки маппинга из JSON
-    try:
-        file_path = os.path.abspath('channels.json')
-        with open(file_path, 'r', encoding='utf-8') as f:
-            channels_data = json.load(f)
-        discord_to_slack = {item['discord_channel_id']: item['slack_channel_id'] for item in channels_data['channels_mapping']}
-        return discord_to_slack
-    except Exception as e:
-        print(f'Error loading JSON from {file_path}: {str(e)}')
-        raise e
-
 def get_channel_id_and_name(message):
     # Получаем имя канала
     if hasattr(message.channel, 'parent'):
@@ -443,60 +509,14 @@ def get_channel_id_and_name(message):
     return channel_id, channel_name
 
 async def collect_files(message):
-    # Download images to disk
-    file_paths = []
-    for attachment in message.attachments:
-        if attachment.url:
-            image_path = await download_image_from_discord(attachment.url)
-            if image_path:
-                file_paths.append(image_path)
-
-    # Prepare the files to be uploaded
-    if file_paths :
-        files = []
-        for file_path in file_paths:
-            with open(file_path, 'rb') as file:
-                files.append({
-                    'file': file.read(),  # Read the file content into memory
-                    'filename': os.path.basename(image_path)
-                })
-
-    return file_paths, files
-
-async def download_image_from_discord(image_url):
-    # Sanitize the image URL to remove query parameters and other invalid characters for filenames
-    sanitized_name = urllib.parse.unquote(image_url.split("/")[-1].split("?")[0])
-    
-    # Ensure the file name is safe by removing invalid characters
-    sanitized_name = re.sub(r'[<>:"/\\|?*]', '_', sanitized_name)
-    
-    os.makedirs("temp_files", exist_ok=True)
-    image_path = f"temp_files/{sanitized_name}"
+    # Download attachments into memory buffers, no temp files on disk
+    return await download_attachments([
+        (attachment.url, attachment.filename, None)
+        for attachment in message.attachments if attachment.url
+    ])
 
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(image_url) as response:
-                if response.status == 200:
-                    with open(image_path, 'wb') as f:
-                        f.write(await response.read())
-                    logger(f"Downloaded image from Discord: {image_url}")
-                    return image_path
-                else:
-                    logger(f"Failed to download image: {image_url}")
-    except Exception as e:
-        logger(f"Error downloading image from {image_url}: {e}")
-    return None
-
-def delete_files(file_paths):
+log = logging.getLogger(__name__)
 
-    """Delete files after they have been used."""
-    for file_path in file_paths:
-        try:
-            os.remove(file_path)
-            logger(f"Deleted image: {file_path}")
-        except Exception as e:
-            logger(f"Error deleting image {file_path}: {e}")
-
-def logger(log_text):
-    print(log_text)
-    logging.info(log_text)
\ No newline at end of file
+def logger(log_text, *args, level=logging.INFO, **fields):
+    # See log_config.setup_logging
+    log.log(level, log_text, *args, extra=fields, stacklevel=2)
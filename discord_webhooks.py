@@ -0,0 +1,111 @@
+import time
+import asyncio
+import logging
+import aiohttp
+import config
+import http_sessions
+import metrics
+
+log = logging.getLogger(__name__)
+
+class RateLimitBucket:
+    # Discord rate-limit state for one webhook, taken from X-RateLimit-* headers
+
+    def __init__(self):
+        self.remaining = None
+        self.reset_at = 0.0
+        self.lock = asyncio.Lock()
+
+    def delay(self):
+        if self.remaining == 0:
+            return max(0.0, self.reset_at - time.monotonic())
+        return 0.0
+
+    def update(self, headers):
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset_after = headers.get('X-RateLimit-Reset-After')
+        if remaining is not None:
+            self.remaining = int(remaining)
+        if reset_after is not None:
+            self.reset_at = time.monotonic() + float(reset_after)
+
+async def rate_limit(response):
+    # (seconds to wait, whether it's global) for a 429. Discord sends them as JSON, but a
+    # proxy in front of it (e.g. Cloudflare) may answer with HTML, so fall back to headers.
+    try:
+        body = await response.json(content_type=None)
+    except ValueError:
+        body = None
+    if not isinstance(body, dict):
+        body = {}
+
+    retry_after = body.get('retry_after') or response.headers.get('Retry-After') or response.headers.get('X-RateLimit-Reset-After')
+    try:
+        retry_after = float(retry_after)
+    except (TypeError, ValueError):
+        retry_after = 1.0
+    return retry_after, bool(body.get('global') or response.headers.get('X-RateLimit-Global'))
+
+class WebhookSender:
+    # Async Discord webhook client: pooled connections, per-webhook buckets,
+    # timeouts and a bounded number of retries on 429, 5xx and network errors.
+
+    def __init__(self, max_retries=None, timeout=None):
+        self.max_retries = config.WEBHOOK_MAX_RETRIES if max_retries is None else max_retries
+        self.timeout = aiohttp.ClientTimeout(total=config.WEBHOOK_TIMEOUT if timeout is None else timeout)
+        self.buckets = {}
+        self.global_reset_at = 0.0
+        self.rate_limited = 0
+        self.errors = 0
+
+    async def send(self, webhook_url, payload):
+        # Returns True once Discord accepts the message, False after giving up
+        bucket = self.buckets.setdefault(webhook_url, RateLimitBucket())
+
+        async with bucket.lock:
+            for attempt in range(self.max_retries + 1):
+                delay = max(bucket.delay(), self.global_reset_at - time.monotonic())
+                if delay > 0:
+                    log.info('Webhook rate limited, waiting %.2fs', delay)
+                    await asyncio.sleep(delay)
+
+                try:
+                    session = http_sessions.get_session(webhook_url)
+                    async with session.post(webhook_url, json=payload, timeout=self.timeout) as response:
+                        bucket.update(response.headers)
+
+                        if response.status < 300:
+                            return True
+
+                        if response.status == 429:
+                            self.rate_limited += 1
+                            metrics.api_errors.inc(api='discord_webhook', reason='rate_limited')
+                            retry_after, is_global = await rate_limit(response)
+                            if is_global:
+                                self.global_reset_at = time.monotonic() + retry_after
+                            else:
+                                bucket.remaining = 0
+                                bucket.reset_at = time.monotonic() + retry_after
+                            log.info('Webhook hit 429, retry after %ss (attempt %s)', retry_after, attempt + 1)
+                            continue
+
+                        text = await response.text()
+                        if response.status < 500:
+                            # Bad payload or deleted webhook, retrying won't help
+                            self.errors += 1
+                            metrics.api_errors.inc(api='discord_webhook', reason='rejected')
+                            log.info('Webhook rejected with %s: %s', response.status, text)
+                            return False
+
+                        log.info('Webhook failed with %s: %s (attempt %s)', response.status, text, attempt + 1)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    log.info('Webhook request error: %r (attempt %s)', e, attempt + 1)
+
+                await asyncio.sleep(min(2 ** attempt, 10))
+
+        self.errors += 1
+        metrics.api_errors.inc(api='discord_webhook', reason='error')
+        log.info('Webhook gave up after %s attempts', self.max_retries + 1)
+        return False
+
+webhooks = WebhookSender()
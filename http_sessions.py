@@ -0,0 +1,45 @@
+import asyncio
+import logging
+from urllib.parse import urlsplit
+import aiohttp
+import config
+
+log = logging.getLogger(__name__)
+
+# Long-lived pooled sessions, one per (event loop, upstream host). aiohttp sessions
+# are tied to the loop that created them, and this process runs two loops:
+# uvicorn's and discord.py's.
+_sessions = {}
+
+def get_session(url):
+    # Function to get the pooled session for url's host on the running loop
+    loop = asyncio.get_running_loop()
+    key = (loop, urlsplit(url).hostname)
+
+    session = _sessions.get(key)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit_per_host=config.HTTP_POOL_SIZE),
+            timeout=aiohttp.ClientTimeout(
+                total=None,
+                sock_connect=config.HTTP_CONNECT_TIMEOUT,
+                sock_read=config.HTTP_READ_TIMEOUT
+            )
+        )
+        _sessions[key] = session
+        log.info('HTTP session opened for %s', key[1])
+    return session
+
+async def open_sessions(*urls):
+    # Create sessions at startup so the first relay doesn't pay for it
+    for url in urls:
+        get_session(url)
+
+async def close_sessions():
+    # Close every session that belongs to the running loop
+    loop = asyncio.get_running_loop()
+    for key in [key for key in _sessions if key[0] is loop]:
+        session = _sessions.pop(key)
+        if not session.closed:
+            await session.close()
+        log.info('HTTP session closed for %s', key[1])
@@ -0,0 +1,97 @@
+import os
+import time
+import orjson
+import sqlite3
+import threading
+import config
+
+COMPACT_EVERY = 500  # finished entries between deletes of done rows
+
+class Journal:
+    # Append-only SQLite (WAL) journal of accepted Slack events. An entry is written
+    # before the request is acked, marked done once it has been relayed, and
+    # replayed on the next start if the process died in between.
+    # synchronous=NORMAL in WAL mode fsyncs at checkpoints rather than on every
+    # commit, so writes are batched without losing entries on a process crash.
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._finished = 0
+        # Ingress workers and the gateway may share the file, so wait out other writers' locks
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS entries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                event_id TEXT,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL DEFAULT 'pending'
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS entries_status ON entries (status, id)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS entries_event_id ON entries (event_id)')
+        self.compact()
+        # Entries up to here were left by a previous run and are due for replay
+        self.replay_up_to = self._conn.execute('SELECT COALESCE(MAX(id), 0) FROM entries').fetchone()[0]
+
+    def append(self, kind, payload, event_id=None):
+        with self._lock:
+            cursor = self._conn.execute(
+                'INSERT INTO entries (kind, event_id, payload, created_at) VALUES (?, ?, ?, ?)',
+                (kind, event_id, orjson.dumps(payload), time.time())
+            )
+            return cursor.lastrowid
+
+    def mark_done(self, entry_id):
+        with self._lock:
+            self._conn.execute("UPDATE entries SET status = 'done' WHERE id = ?", (entry_id,))
+            self._finished += 1
+            if self._finished >= COMPACT_EVERY:
+                self._compact()
+
+    def mark_failed(self, entry_id):
+        # Given up on; kept out of pending and compaction so it can still be inspected
+        with self._lock:
+            self._conn.execute("UPDATE entries SET status = 'failed' WHERE id = ?", (entry_id,))
+
+    def mark_attempt(self, entry_id):
+        with self._lock:
+            self._conn.execute('UPDATE entries SET attempts = attempts + 1 WHERE id = ?', (entry_id,))
+
+    def pending(self, after=0, up_to=None, limit=100):
+        # Returns [(id, kind, payload, attempts, created_at)] of unfinished entries with after < id <= up_to, oldest first
+        query = "SELECT id, kind, payload, attempts, created_at FROM entries WHERE status = 'pending' AND id > ?"
+        params = [after]
+        if up_to is not None:
+            query += " AND id <= ?"
+            params.append(up_to)
+        query += " ORDER BY id LIMIT ?"
+        params.append(limit)
+
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [(entry_id, kind, orjson.loads(payload), attempts, created_at) for entry_id, kind, payload, attempts, created_at in rows]
+
+    def has_event(self, event_id):
+        with self._lock:
+            return self._conn.execute('SELECT 1 FROM entries WHERE event_id = ? LIMIT 1', (event_id,)).fetchone() is not None
+
+    def count_pending(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries WHERE status = 'pending'").fetchone()[0]
+
+    def compact(self):
+        with self._lock:
+            self._compact()
+
+    def _compact(self):
+        self._conn.execute("DELETE FROM entries WHERE status = 'done'")
+        self._finished = 0
+
+journal = Journal(config.JOURNAL_PATH)
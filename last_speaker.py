@@ -0,0 +1,53 @@
+import time
+import threading
+from collections import OrderedDict, namedtuple
+import config
+
+SAME_SPEAKER_WINDOW = 1  # seconds; a repeat post this soon is merged regardless of the other side
+
+# user_id of the last speaker and seconds since they spoke
+LastSpeaker = namedtuple('LastSpeaker', ['user_id', 'age'])
+
+class LastSpeakerTracker:
+    # Last user to post in each channel or thread, forgotten ttl seconds later.
+    # Entries are kept in the order they were last set, so expired ones are dropped
+    # lazily from the front on each set and get is a single lookup. Updated from both
+    # the uvicorn thread and the Discord loop, hence the lock.
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = OrderedDict()  # channel_id -> (user_id, monotonic time)
+        self._lock = threading.Lock()
+
+    def set(self, channel_id, user_id):
+        now = time.monotonic()
+        with self._lock:
+            self._entries[channel_id] = (user_id, now)
+            self._entries.move_to_end(channel_id)
+            self._expire(now)
+
+    def get(self, channel_id):
+        # Returns a LastSpeaker, or None if nobody spoke within ttl
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(channel_id)
+            if entry is None:
+                return None
+            user_id, spoke_at = entry
+            if now - spoke_at >= self.ttl:
+                del self._entries[channel_id]
+                return None
+        return LastSpeaker(user_id, now - spoke_at)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _expire(self, now):
+        while self._entries:
+            channel_id, (_, spoke_at) = next(iter(self._entries.items()))
+            if now - spoke_at < self.ttl:
+                break
+            del self._entries[channel_id]
+
+slack_last_speakers = LastSpeakerTracker(config.LAST_SPEAKER_TTL)
+discord_last_speakers = LastSpeakerTracker(config.LAST_SPEAKER_TTL)
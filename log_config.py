@@ -0,0 +1,135 @@
+import os
+import re
+import sys
+import queue
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import orjson
+import config
+
+# Attributes every LogRecord has; anything else on a record came in through `extra`
+# and is written out as a structured field
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+class DeferredQueueHandler(QueueHandler):
+    # The stock QueueHandler formats the message on the calling thread so the record can
+    # be pickled. The queue here never leaves the process, so the record is passed as is
+    # and the listener thread does all the formatting.
+
+    def prepare(self, record):
+        return record
+
+class TextFormatter(logging.Formatter):
+    # '<time> - <level> - <logger> - <message> key=value ...'
+
+    def __init__(self):
+        super().__init__('%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+
+    def formatMessage(self, record):
+        text = super().formatMessage(record)
+        fields = structured_fields(record)
+        if fields:
+            text += ' ' + ' '.join(f'{key}={value}' for key, value in fields.items())
+        return text
+
+class JsonFormatter(logging.Formatter):
+    # One JSON object per line
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'function': record.funcName,
+            'line': record.lineno,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        entry.update(structured_fields(record))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return orjson.dumps(entry, default=str).decode('utf-8')
+
+def structured_fields(record):
+    return {key: value for key, value in vars(record).items() if key not in RECORD_ATTRIBUTES}
+
+def parse_levels(levels):
+    # 'slack_bot=DEBUG,discord=WARNING' -> {'slack_bot': 'DEBUG', 'discord': 'WARNING'}
+    result = {}
+    for item in levels.split(','):
+        name, _, level = item.partition('=')
+        if name.strip() and level.strip():
+            result[name.strip()] = level.strip().upper()
+    return result
+
+WORKER_LOG_PATTERN = re.compile(r'^ingress-(\d+)\.log(\.\d+)?$')
+
+def remove_stale_worker_logs(log_dir):
+    # Ingress workers log to ingress-<pid>.log; remove the files (and their rotated
+    # backups) of workers that are no longer running, so restarts don't pile them up
+    try:
+        names = os.listdir(log_dir)
+    except FileNotFoundError:
+        return
+    for name in names:
+        match = WORKER_LOG_PATTERN.match(name)
+        if match and not process_alive(int(match.group(1))):
+            try:
+                os.remove(os.path.join(log_dir, name))
+            except FileNotFoundError:
+                # Another worker starting at the same time got to it first
+                pass
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def setup_logging(log_file_path):
+    # Route all logging through a queue so callers only enqueue records. A listener
+    # thread formats them and writes the rotating log file (and stdout if enabled).
+    # The file is truncated on start, as before.
+    #
+    # Modules log through `log = logging.getLogger(__name__)` with %-style arguments,
+    # so a message is only formatted, on the listener thread, if its level is enabled.
+    # slack_bot and discord_bot keep their original logger(text, ...) helper as a thin
+    # wrapper over this: it takes level= and structured fields as keywords and passes
+    # stacklevel=2 so records show the caller's function and line.
+    os.makedirs(os.path.dirname(log_file_path) or '.', exist_ok=True)
+    formatter = JsonFormatter() if config.LOG_FORMAT == 'json' else TextFormatter()
+
+    # RotatingFileHandler always appends, whatever mode it is given
+    with open(log_file_path, 'w', encoding='utf-8'):
+        pass
+    handlers = [RotatingFileHandler(
+        log_file_path,
+        maxBytes=10 * 1024 * 1024,
+        backupCount=5, # Number of backup log files
+        encoding='utf-8'
+    )]
+    if config.LOG_TO_CONSOLE:
+        handlers.append(logging.StreamHandler(sys.stdout))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(DeferredQueueHandler(log_queue))
+    root.setLevel(config.LOG_LEVEL.upper())
+
+    # Per-module overrides, e.g. LOG_LEVELS="slack_bot=DEBUG,discord=WARNING"
+    for name, level in parse_levels(config.LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+
+    return listener
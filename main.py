@@ -1,72 +1,161 @@
-from fastapi import FastAPI, Request, BackgroundTasks, Header, HTTPException
-from slack_bot import slack_events, handle_button_click, set_last_message_user_id
-from discord_bot import discord_client
 import logging
 import os
+import config
+from log_config import setup_logging, remove_stale_worker_logs
+
+# Set up logging before the bot modules log anything at import.
+# The log file is truncated on start; ingress workers are separate processes,
+# so each one gets its own file, and those of earlier workers are removed.
+if config.BRIDGE_MODE == 'ingress':
+    remove_stale_worker_logs("logs")
+    setup_logging(os.path.join("logs", f"ingress-{os.getpid()}.log"))
+else:
+    setup_logging(os.path.join("logs", "app.log"))
+logger = logging.getLogger(__name__)
+
+from fastapi import FastAPI, Request, BackgroundTasks
+from slack_bot import warm_channel_cache, resolve_file_shares, process_journal_entry, handle_bot_echo, user_profiles, channel_info, SLACK_FILES_URL, DISCORD_API_URL
 from threading import Thread
-import json
-from starlette.responses import JSONResponse
-from logging.handlers import RotatingFileHandler
+from urllib.parse import parse_qs
+import orjson
+from starlette.responses import JSONResponse, PlainTextResponse
 from slack_sdk.signature import SignatureVerifier
 from config import SIGNING_SECRET
-import config
-
-# Create the logs folder if it does not exist
-os.makedirs("logs", exist_ok=True)
-
-# Remove the current app.log file when the program starts
-log_file_path = os.path.join("logs", "app.log")
-with open(log_file_path, 'w', encoding='utf-8'):
-    pass 
-
-# Set up log rotation
-rotating_handler = RotatingFileHandler(
-    log_file_path,
-    maxBytes=10 * 1024 * 1024,
-    backupCount=5, # Number of backup log files
-    encoding='utf-8'
-)
-
-# Set up log formatting
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-rotating_handler.setFormatter(formatter)
-
-# Set up the root logger
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-logger.addHandler(rotating_handler)
+import db
+import http_sessions
+import metrics
+import outbound
+import time
+from waiters import file_shares, message_mappings
+from journal import journal
+from cache import ExpiringSet
+import re
+
+EVENT_RETRY_WINDOW = 3600  # seconds; Slack gives up retrying well within an hour
 
 app = FastAPI()
 signature_verifier = SignatureVerifier(signing_secret=SIGNING_SECRET)
 
-def format_json(data):
+@app.on_event("startup")
+async def startup():
+    await http_sessions.open_sessions(SLACK_FILES_URL, DISCORD_API_URL)
+
+@app.on_event("shutdown")
+async def shutdown():
+    await http_sessions.close_sessions()
+
+# Slack requests go through one ingress middleware: the body is read once, Slack retries
+# of events that were already accepted are acked straight from the raw bytes, the
+# signature is checked on those bytes, and only then is the body parsed, once, with
+# orjson. Handlers read the parsed payload from request.state.slack_payload.
+EVENT_ID_PATTERN = re.compile(rb'"event_id"\s*:\s*"([^"]+)"')
+accepted_events = ExpiringSet(ttl=EVENT_RETRY_WINDOW, max_entries=config.DEDUP_MAX_ENTRIES)
+
+def remember_accepted(event_data):
+    # Only once the event is journaled, so Slack's retries of it can be acked early.
+    # Until then a retry must get through, or an event that failed to journal is lost.
+    if event_data.get('event_id'):
+        accepted_events.add(event_data['event_id'])
+
+def parse_slack_body(path, body):
+    # Events arrive as JSON, interactive payloads as a form field holding JSON
+    if path == '/slack/button':
+        return orjson.loads(parse_qs(body.decode('utf-8'))['payload'][0])
+    return orjson.loads(body)
+
+def valid_signature(body, headers):
     try:
-        parsed = json.loads(data)
-        return json.dumps(parsed, indent=4, ensure_ascii=False)
-    except (json.JSONDecodeError, TypeError):
-        return data  
+        return signature_verifier.is_valid_request(body, dict(headers))
+    except ValueError:
+        # Non-numeric timestamp, or a body that isn't UTF-8
+        return False
+
+@app.middleware("http")
+async def slack_ingress(request: Request, call_next):
+    if request.method != 'POST' or not request.url.path.startswith('/slack/'):
+        return await call_next(request)
+
+    start = time.perf_counter()
+    response = await handle_slack_request(request, call_next)
+    metrics.ingress_seconds.observe(time.perf_counter() - start, path=request.url.path)
+    metrics.ingress_requests.inc(path=request.url.path, status=response.status_code)
+    return response
 
-@app.middleware("http") 
-async def log_requests(request: Request, call_next):
+async def handle_slack_request(request: Request, call_next):
     body = await request.body()
+
+    if request.url.path == '/slack/events' and 'x-slack-retry-num' in request.headers:
+        match = EVENT_ID_PATTERN.search(body)
+        event_id = match.group(1).decode('utf-8', 'replace') if match else None
+        # Other ingress workers may have taken the first delivery; the shared journal knows about those
+        if event_id and (event_id in accepted_events or (config.BRIDGE_MODE == 'ingress' and journal.has_event(event_id))):
+            metrics.duplicates.inc(source='slack_retry')
+            logger.info("Slack retry #%s (%s) acked for accepted event %s", request.headers['x-slack-retry-num'], request.headers.get('x-slack-retry-reason'), event_id, extra={'event_id': event_id})
+            return JSONResponse(content={"status": "duplicate"}, status_code=200, headers={"X-Slack-No-Retry": "1"})
+
+    if not valid_signature(body, request.headers):
+        logger.error("Invalid Slack signature: %s %s", request.method, request.url)
+        return JSONResponse(content={"detail": "Invalid request signature"}, status_code=400)
+
     try:
-        event_data = json.loads(body)
-        # Check for the presence of bot_id to avoid logging requests from the bot
-        if event_data.get('event', {}).get('bot_id') == config.SLACK_BOT_ID:
-            response = await call_next(request)
-            return response
-    except (json.JSONDecodeError, TypeError):
-        pass
-
-    formatted_body = format_json(body) if body else "No body"
-    logger.info(f"Incoming request: {request.method} {request.url} - Body: {formatted_body}")
-    
+        payload = parse_slack_body(request.url.path, body)
+    except (orjson.JSONDecodeError, KeyError, UnicodeDecodeError):
+        logger.error("Malformed Slack request body: %s %s", request.method, request.url)
+        return JSONResponse(content={"detail": "Malformed request body"}, status_code=400)
+    request.state.slack_payload = payload
+
+    # Full bodies only at DEBUG, and never for the echoes of this bot's own messages
+    if logger.isEnabledFor(logging.DEBUG) and payload.get('event', {}).get('bot_id') != config.SLACK_BOT_ID:
+        logger.debug("Incoming request: %s %s - Body: %s", request.method, request.url, body.decode('utf-8', 'replace'))
+
     response = await call_next(request)
-    
-    logger.info(f"Outgoing response: Status code {response.status_code}")
-    
+    logger.info("Slack request handled: %s", request.url.path, extra={'status': response.status_code, 'event_id': payload.get('event_id')})
     return response
 
+def dispatch(background_tasks, kind, payload, event_id=None):
+    # Journal the request before it is acked. Combined mode processes it in the background
+    # right here; in ingress mode the gateway process picks it up from the journal.
+    entry_id = journal.append(kind, payload, event_id=event_id)
+    if config.BRIDGE_MODE != 'ingress':
+        background_tasks.add_task(process_journal_entry, entry_id, kind, payload)
+
+#------------------------------------------
+# Metrics computed when /metrics is scraped
+#------------------------------------------
+
+def cache_stats():
+    stats = {'user_profiles': user_profiles.stats(), 'channel_info': channel_info.stats()}
+    stats.update(db.get_cache_stats())
+    return stats
+
+def cache_hit_ratios():
+    ratios = {}
+    for name, stats in cache_stats().items():
+        lookups = stats['hits'] + stats['misses']
+        ratios[(name,)] = stats['hits'] / lookups if lookups else 0.0
+    return ratios
+
+metrics.Gauge('bridge_outbound_queue_depth', 'Posts queued in the outbound schedulers', ['api'],
+              collect=lambda: {(scheduler.name,): scheduler.depth() for scheduler in outbound.schedulers})
+metrics.Gauge('bridge_outbound_in_flight', 'Posts being sent by the outbound schedulers', ['api'],
+              collect=lambda: {(scheduler.name,): scheduler.stats()['in_flight'] for scheduler in outbound.schedulers})
+metrics.Gauge('bridge_journal_pending', 'Journal entries not yet relayed', collect=journal.count_pending)
+metrics.Gauge('bridge_waiters_pending', 'Coroutines waiting for a file share or message mapping', ['kind'],
+              collect=lambda: {('file_share',): file_shares.pending(), ('message_mapping',): message_mappings.pending()})
+metrics.Gauge('bridge_cache_entries', 'Entries held in each cache', ['cache'],
+              collect=lambda: {(name,): stats['size'] for name, stats in cache_stats().items()})
+metrics.CallbackCounter('bridge_cache_hits_total', 'Cache hits', ['cache'],
+                        collect=lambda: {(name,): stats['hits'] for name, stats in cache_stats().items()})
+metrics.CallbackCounter('bridge_cache_misses_total', 'Cache misses', ['cache'],
+                        collect=lambda: {(name,): stats['misses'] for name, stats in cache_stats().items()})
+metrics.Gauge('bridge_cache_hit_ratio', 'Cache hits over lookups since start', ['cache'], collect=cache_hit_ratios)
+
+@app.get('/metrics')
+async def metrics_endpoint():
+    # Prometheus text format. Each process reports its own metrics; in split mode the
+    # relay stages run in the gateway, which serves them on GATEWAY_METRICS_PORT.
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type='text/plain; version=0.0.4')
+
 @app.get('/')
 async def home():
     logger.info("Home endpoint accessed")
@@ -77,11 +166,10 @@ async def button_click(
     request: Request,
     background_tasks: BackgroundTasks,
 ):
-    form_data = await request.form()  
-    payload = form_data.get('payload')  
-    payload = json.loads(payload)
-    
-    background_tasks.add_task(handle_button_click, payload)
+    payload = request.state.slack_payload
+
+    # Journal before acking so the click survives a crash or redeploy
+    dispatch(background_tasks, 'button', payload)
     logger.info("***Slack event processing started in the background")
     return JSONResponse(content={}, status_code=200)
 
@@ -89,43 +177,39 @@ async def button_click(
 async def slack_events_handler(
     request: Request,
     background_tasks: BackgroundTasks,
-    x_slack_signature: str = Header(None),
-    x_slack_request_timestamp: str = Header(None),
 ):
-    event_data = await request.json()
-    body = await request.body()
+    # Already verified and parsed by slack_ingress
+    event_data = request.state.slack_payload
     event = event_data.get("event", {})
-    user_id=event.get('user')
 
-    # Check if the request is a URL verification request
-    if not signature_verifier.is_valid_request(body.decode('utf-8'), {'X-Slack-Signature': x_slack_signature, 'X-Slack-Request-Timestamp': x_slack_request_timestamp}):
-        logger.error("Invalid Slack signature")
-        raise HTTPException(status_code=400, detail="Invalid request signature")    
-    
     # Handle Slack URL verification in a more concise way
     if event_data.get('type') == 'url_verification':
         logger.info("URL verification request received")
         return JSONResponse(content={"challenge": event_data.get('challenge')}, status_code=200)
 
+    # Uploads made by discord_bot wait for these events to learn their message ts.
+    # In ingress mode the gateway does this when it picks the event up from the journal.
+    if config.BRIDGE_MODE != 'ingress':
+        resolve_file_shares(event)
+
     # Log the incoming event data
     if 'event' in event_data:
         # Check if the event is a bot message
         if 'bot_id' in event_data['event'] and event_data['event'].get('user') == config.SLACK_BOT_ID:
-            # Ignore the request from this bot but save the last message user ID
-            
-            if event.get('thread_ts'):
-                # If the event is a thread message, use thread_ts as channel_id
-                channel_id = event.get('thread_ts')
+            # Ignore the request from this bot but save the last message user ID. Only the
+            # gateway process needs it, so it is journaled in ingress mode only.
+            if config.BRIDGE_MODE == 'ingress':
+                dispatch(background_tasks, 'bot_echo', event_data, event_id=event_data.get('event_id'))
             else:
-                channel_id = event.get('channel')
+                background_tasks.add_task(handle_bot_echo, event_data)
+            remember_accepted(event_data)
 
-            background_tasks.add_task(set_last_message_user_id, user_id, channel_id)
-
-            print("***Ignoring request from this bot")
+            logger.debug("***Ignoring request from this bot")
             return JSONResponse(content={"status": "ignored"}, status_code=200)
         else:
-            # Else, process the event
-            background_tasks.add_task(slack_events, event_data)
+            # Else, journal the event before acking and process it in the background
+            dispatch(background_tasks, 'slack_event', event_data, event_id=event_data.get('event_id'))
+            remember_accepted(event_data)
             logger.info("***Slack event processing started in the background")
             return JSONResponse(content={"status": "ok"}, status_code=200)
     else:
@@ -135,12 +219,32 @@ async def slack_events_handler(
 # Run the FastAPI server in a separate thread
 def run():
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=5000)
+    uvicorn.run(app, host=config.INGRESS_HOST, port=config.INGRESS_PORT)
 
 def keep_alive():
     t = Thread(target=run)
     t.start()
 
+def run_ingress():
+    # Several stateless HTTP worker processes; they only verify and journal Slack requests
+    import uvicorn
+    uvicorn.run("main:app", host=config.INGRESS_HOST, port=config.INGRESS_PORT, workers=config.INGRESS_WORKERS)
+
+def run_gateway():
+    # The single Discord gateway process; it consumes the journal instead of serving HTTP
+    from discord_bot import discord_client
+    db.ensure_indexes()
+    warm_channel_cache()
+    discord_client.run(os.environ['TOKEN_DISCORD'], log_handler=None)
+
 if __name__ == '__main__':
-    keep_alive()
-    discord_client.run(os.environ['TOKEN_DISCORD'])
+    if config.BRIDGE_MODE == 'ingress':
+        run_ingress()
+    elif config.BRIDGE_MODE == 'gateway':
+        run_gateway()
+    else:
+        from discord_bot import discord_client
+        db.ensure_indexes()
+        warm_channel_cache()
+        keep_alive()
+        discord_client.run(os.environ['TOKEN_DISCORD'], log_handler=None)
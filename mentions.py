@@ -0,0 +1,66 @@
+import re
+import asyncio
+import logging
+
+log = logging.getLogger(__name__)
+
+# Slack mrkdwn references: <@U123>, <@U123|name>, <#C123|general>, <#C123>,
+# <!here>, <!channel>, <!everyone>, <!subteam^S123|@team>, <!date^...|fallback>
+MENTION_PATTERN = re.compile(r'<([@#!])([^>|]+)(?:\|([^>]*))?>')
+
+# Keeps @here/@channel readable in Discord without pinging the whole server
+ZERO_WIDTH_SPACE = '\u200b'
+BROADCASTS = {'here', 'channel', 'everyone'}
+
+async def translate(text, user_profiles, channel_info):
+    # Slack message text -> Discord text. The text is tokenised once, every distinct
+    # user and unlabelled channel is looked up concurrently through its cache, and the
+    # result is built in one pass. A reference that can't be resolved is left as is.
+    if not text or '<' not in text:
+        return text
+
+    matches = list(MENTION_PATTERN.finditer(text))
+    if not matches:
+        return text
+
+    user_ids = {match[2] for match in matches if match[1] == '@'}
+    channel_ids = {match[2] for match in matches if match[1] == '#' and not match[3]}
+    users, channels = await lookup((user_profiles, user_ids), (channel_info, channel_ids))
+
+    parts = []
+    position = 0
+    for match in matches:
+        parts.append(text[position:match.start()])
+        parts.append(render(match, users, channels))
+        position = match.end()
+    parts.append(text[position:])
+    return ''.join(parts)
+
+async def lookup(*requests):
+    # (loader, keys) pairs -> one {key: value} per pair, for every key its loader could
+    # resolve. All keys of all loaders are fetched in a single gather.
+    calls = [(index, key) for index, (loader, keys) in enumerate(requests) for key in keys]
+    results = await asyncio.gather(*(requests[index][0].get_async(key) for index, key in calls), return_exceptions=True)
+
+    found = [{} for _ in requests]
+    for (index, key), result in zip(calls, results):
+        if isinstance(result, Exception):
+            log.info('Ошибка при получении информации для %s: %s', key, result)
+        else:
+            found[index][key] = result
+    return found
+
+def render(match, users, channels):
+    kind, target, label = match[1], match[2], match[3]
+    if kind == '@':
+        name = (users.get(target) or {}).get('real_name') or label
+        return f'@{name}' if name else match[0]
+
+    if kind == '#':
+        name = label or (channels.get(target) or {}).get('name')
+        return f'#{name}' if name else match[0]
+
+    if target in BROADCASTS:
+        return f'@{ZERO_WIDTH_SPACE}{target}'
+    # User groups, dates and the like: Slack's own fallback text
+    return label or match[0]
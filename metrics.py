@@ -0,0 +1,175 @@
+import time
+import math
+import threading
+from contextlib import contextmanager
+
+# Seconds; spans a cache hit (sub-millisecond) up to a slow file relay
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class Registry:
+    # Collects metrics and renders them in the Prometheus text exposition format
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, name, help, labelnames=(), registry=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # label values tuple -> value
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _labels(self, key, extra=None):
+        pairs = list(zip(self.labelnames, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [f'{self.name}{self._labels(key)} {format_value(value)}' for key, value in values.items()]
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    # Either set directly, or computed at scrape time by `collect`, a callable
+    # returning {label values tuple: value} (or a single value without labels)
+
+    type = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), registry=None, collect=None):
+        super().__init__(name, help, labelnames, registry)
+        self.collect = collect
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        if self.collect is not None:
+            values = self.collect()
+            if not isinstance(values, dict):
+                values = {(): values}
+            with self._lock:
+                self._values = {tuple(str(v) for v in key): value for key, value in values.items()}
+        return super().samples()
+
+class CallbackCounter(Gauge):
+    # A counter whose value is owned elsewhere (e.g. OutboundScheduler.rate_limited)
+    type = 'counter'
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), registry=None, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames, registry)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: ([*state[0]], state[1], state[2]) for key, state in self._values.items()}
+        lines = []
+        for key, (counts, total, count) in values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == math.inf else format_value(bound)
+                lines.append(f'{self.name}_bucket{self._labels(key, ("le", le))} {cumulative}')
+            lines.append(f'{self.name}_sum{self._labels(key)} {format_value(total)}')
+            lines.append(f'{self.name}_count{self._labels(key)} {count}')
+        return lines
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+REGISTRY = Registry()
+
+async def serve(host, port):
+    # Standalone /metrics endpoint for a process without the FastAPI app (the gateway).
+    # Returns the runner; call its cleanup() to stop serving.
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=REGISTRY.render(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+#------------------------------------------
+# Bridge metrics
+#------------------------------------------
+
+ingress_seconds = Histogram('bridge_ingress_seconds', 'Time to verify, parse and ack a Slack request', ['path'])
+ingress_requests = Counter('bridge_ingress_requests_total', 'Slack requests by path and response status', ['path', 'status'])
+stage_seconds = Histogram('bridge_stage_seconds', 'Time spent in each relay stage', ['direction', 'stage'])
+relay_seconds = Histogram('bridge_relay_seconds', 'End-to-end relay time of one message', ['direction'])
+relayed_messages = Counter('bridge_messages_total', 'Relayed messages by outcome', ['direction', 'result'])
+duplicates = Counter('bridge_duplicates_total', 'Events dropped as duplicates', ['source'])
+db_seconds = Histogram('bridge_db_seconds', 'MongoDB operation latency', ['operation'])
+coalesced_messages = Counter('bridge_coalesced_messages_total', 'Messages merged into an earlier post of the same burst', ['api'])
+api_errors = Counter('bridge_api_errors_total', 'Failed Slack and Discord API calls', ['api', 'reason'])
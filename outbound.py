@@ -0,0 +1,173 @@
+import time
+import asyncio
+import logging
+from collections import deque
+import metrics
+
+log = logging.getLogger(__name__)
+
+MAX_IDLE_BUCKETS = 1000
+
+schedulers = []  # every OutboundScheduler, for queue depth metrics
+
+class TokenBucket:
+    # Refills `rate` tokens per second up to `burst`; a 429 blocks it for retry_after
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def take(self):
+        # Returns 0 if a token was taken, otherwise the seconds until one is available
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def block(self, seconds):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    def is_idle(self):
+        now = time.monotonic()
+        return now >= self.blocked_until and self.tokens + (now - self.updated) * self.rate >= self.burst
+
+class Job:
+    def __init__(self, func, args, kwargs, future):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.attempts = 0
+
+class OutboundScheduler:
+    # Queues API posts per destination (channel or thread) and sends them through a
+    # token bucket per destination. Destinations are served round-robin, one request
+    # in flight each, so posts keep their order and a busy channel can't starve the
+    # others. Rate-limited jobs go back to the head of their queue.
+
+    def __init__(self, name, rate, burst, max_retries, retry_after):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.retry_after = retry_after  # exception -> seconds to wait, or None if not a rate limit
+        self.rate_limited = 0
+        self.errors = 0
+        self._queues = {}  # destination -> deque of jobs
+        self._buckets = {}
+        self._ready = deque()  # destinations with queued jobs and nothing in flight
+        self._in_flight = set()
+        self._loop = None
+        self._wakeup = None
+        self._worker = None
+        schedulers.append(self)
+
+    async def submit(self, destination, func, *args, **kwargs):
+        # Queue `await func(*args, **kwargs)` for destination and return its result.
+        # func is called again on retry, so it must build any one-shot arguments itself.
+        loop = asyncio.get_running_loop()
+        if self._loop is None or self._loop.is_closed():
+            self._start(loop)
+        elif self._loop is not loop:
+            # Scheduler lives on another loop; hand the job over to it
+            future = asyncio.run_coroutine_threadsafe(self.submit(destination, func, *args, **kwargs), self._loop)
+            return await asyncio.wrap_future(future)
+
+        future = loop.create_future()
+        queue = self._queues.setdefault(destination, deque())
+        queue.append(Job(func, args, kwargs, future))
+        if len(queue) == 1 and destination not in self._in_flight:
+            self._ready.append(destination)
+        self._wakeup.set()
+        return await future
+
+    def depth(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def stats(self):
+        return {
+            'queued': self.depth(),
+            'in_flight': len(self._in_flight),
+            'destinations': len(self._queues),
+            'rate_limited': self.rate_limited,
+            'errors': self.errors,
+        }
+
+    def _start(self, loop):
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._worker = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            next_wait = None
+
+            for _ in range(len(self._ready)):
+                destination = self._ready.popleft()
+                bucket = self._buckets.get(destination)
+                if bucket is None:
+                    bucket = self._buckets[destination] = TokenBucket(self.rate, self.burst)
+
+                wait = bucket.take()
+                if wait > 0:
+                    self._ready.append(destination)
+                    next_wait = wait if next_wait is None else min(next_wait, wait)
+                    continue
+
+                job = self._queues[destination].popleft()
+                self._in_flight.add(destination)
+                asyncio.ensure_future(self._execute(destination, job))
+
+            if len(self._buckets) > len(self._queues) + MAX_IDLE_BUCKETS:
+                self._prune_buckets()
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), next_wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def _prune_buckets(self):
+        for destination in list(self._buckets):
+            if destination not in self._queues and self._buckets[destination].is_idle():
+                del self._buckets[destination]
+
+    async def _execute(self, destination, job):
+        try:
+            if not job.future.cancelled():
+                result = await job.func(*job.args, **job.kwargs)
+                if not job.future.done():
+                    job.future.set_result(result)
+        except Exception as e:
+            retry_after = self.retry_after(e)
+            if retry_after is not None and job.attempts < self.max_retries:
+                job.attempts += 1
+                self.rate_limited += 1
+                metrics.api_errors.inc(api=self.name, reason='rate_limited')
+                self._buckets[destination].block(retry_after)
+                self._queues[destination].appendleft(job)
+                log.info('%s outbound rate limited for %s, retry in %ss (attempt %s)', self.name, destination, retry_after, job.attempts)
+            else:
+                self.errors += 1
+                metrics.api_errors.inc(api=self.name, reason='error')
+                if not job.future.done():
+                    job.future.set_exception(e)
+        finally:
+            self._in_flight.discard(destination)
+            if self._queues[destination]:
+                self._ready.append(destination)
+            else:
+                del self._queues[destination]
+                if self._buckets[destination].is_idle():
+                    del self._buckets[destination]
+            self._wakeup.set()
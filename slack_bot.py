@@ -4,40 +4,129 @@ from slack_sdk.signature import SignatureVerifier
 from slack_sdk.web.async_client import AsyncWebClient
 import config
 import db
+from channels_index import channels
+from cache import TTLCache, CachedLoader, ExpiringSet
+from waiters import file_shares, message_mappings
+from attachments import download_attachments, close_attachments
+from discord_webhooks import webhooks
+from outbound import OutboundScheduler
+from coalesce import Coalescer
+import mentions
+from journal import journal
+import metrics
+from last_speaker import slack_last_speakers, discord_last_speakers, SAME_SPEAKER_WINDOW
 import asyncio
 import re
-import os
-import aiohttp
 import discord
 import time
 import logging
-import json
-import requests
-import datetime
 
-slack_client = AsyncWebClient(token=config.SLACK_TOKEN)
-sync_slack_client = WebClient(token=config.SLACK_TOKEN)
+slack_client = AsyncWebClient(token=config.SLACK_TOKEN, base_url=config.SLACK_API_BASE_URL)
+sync_slack_client = WebClient(token=config.SLACK_TOKEN, base_url=config.SLACK_API_BASE_URL)
 signature_verifier = SignatureVerifier(signing_secret=config.SIGNING_SECRET)
 config.SLACK_BOT_ID = sync_slack_client.api_call("auth.test")['user_id']
-print('BOT_ID', config.SLACK_BOT_ID)
+logging.getLogger(__name__).info('BOT_ID %s', config.SLACK_BOT_ID)
+
+def discord_retry_after(error):
+    # Seconds to wait if a Discord error is a rate limit, else None.
+    # discord.py already sleeps through most 429s itself; these are the ones it gives up on.
+    if isinstance(error, discord.RateLimited):
+        return error.retry_after
+    if isinstance(error, discord.HTTPException) and error.status == 429:
+        return float(error.response.headers.get('Retry-After', 1))
+    return None
+
+# Every post to Discord goes through here: per-channel/thread token buckets, 429s retried from the queue
+discord_outbound = OutboundScheduler(
+    'discord',
+    rate=config.DISCORD_POST_RATE,
+    burst=config.DISCORD_POST_BURST,
+    max_retries=config.OUTBOUND_MAX_RETRIES,
+    retry_after=discord_retry_after,
+)
+
+# Opt-in: one Slack user's rapid consecutive text messages go out as one Discord post
+discord_coalescer = Coalescer('discord', window=config.COALESCE_WINDOW_MS / 1000, max_length=2000)
+
+async def fetch_user_info(user_id):
+    response = await slack_client.users_info(user=user_id)
+    return response['user']
+
+# Slack user profiles shared by every users_info call site, invalidated by user_change events
+user_profiles = CachedLoader(
+    TTLCache(maxsize=config.USER_CACHE_SIZE, ttl=config.USER_CACHE_TTL),
+    fetch=fetch_user_info,
+)
+
+async def fetch_channel_info(channel_id):
+    response = await slack_client.conversations_info(channel=channel_id)
+    return response['channel']
+
+# Slack conversation metadata, warmed at startup and invalidated by channel_rename/channel_archive events
+channel_info = CachedLoader(
+    TTLCache(maxsize=config.CHANNEL_CACHE_SIZE, ttl=config.CHANNEL_CACHE_TTL),
+    fetch=fetch_channel_info,
+)
+
+def warm_channel_cache():
+    # Function to preload conversation metadata for every channel the bot can see
+    cursor = None
+    count = 0
+    try:
+        while True:
+            response = sync_slack_client.conversations_list(
+                types='public_channel,private_channel',
+                exclude_archived=True,
+                limit=200,
+                cursor=cursor
+            )
+            for channel in response['channels']:
+                channel_info.put(channel['id'], channel)
+                count += 1
+            cursor = response.get('response_metadata', {}).get('next_cursor')
+            if not cursor:
+                break
+    except SlackApiError as e:
+        logger('Error warming channel cache: %s', e.response['error'])
+    logger('Channel cache warmed: %s channels', count)
 
-processed_requests = {}
-processed_files = set()
-file_timestamps = {}  
 EXPIRATION_TIME = 300   
+processed_requests = ExpiringSet(ttl=EXPIRATION_TIME, max_entries=config.DEDUP_MAX_ENTRIES)
+processed_files = ExpiringSet(ttl=EXPIRATION_TIME, max_entries=config.DEDUP_MAX_ENTRIES)
+SLACK_FILES_URL = 'https://files.slack.com/'
+DISCORD_API_URL = 'https://discord.com/api/'
 
 async def slack_events(event_data):
     # Function to handle Slack events
-    global processed_files
-
     event = event_data.get("event", {})
     event_id = event.get('client_msg_id') or event_data.get("event_id")
-    logger(f'EVENT_ID: {event_id}')
+    logger('EVENT_ID: %s', event_id, level=logging.DEBUG)
+
+    # Drop cached profile when a user changes their name or avatar
+    if event.get("type") == "user_change":
+        user_id = event.get('user', {}).get('id')
+        if user_id:
+            user_profiles.invalidate(user_id)
+            logger('User profile cache invalidated for: %s', user_id)
+        return
+
+    # Drop cached conversation metadata when a channel is renamed or archived
+    if event.get("type") in ("channel_rename", "channel_archive", "channel_unarchive"):
+        channel = event.get('channel')
+        channel_id = channel.get('id') if isinstance(channel, dict) else channel
+        if channel_id:
+            channel_info.invalidate(channel_id)
+            logger('Channel cache invalidated for: %s', channel_id)
+        return
 
     # Handle user join event
     if event.get("type") == "team_join":
-        user_data = get_user_data(event)
-        logger(f"New user joined Slack workspace: {user_data['user_name']}")
+        # team_join carries the full user object, so prime the cache with it
+        user_info = event.get('user', {})
+        if user_info.get('id'):
+            user_profiles.put(user_info['id'], user_info)
+        user_data = {'user_name': user_info.get('profile', {}).get('display_name') or user_info.get('real_name')}
+        logger('New user joined Slack workspace: %s', user_data['user_name'])
         # Notify in Discord about the new user
         try:
             data = {
@@ -45,31 +134,32 @@ async def slack_events(event_data):
                 "avatar_url": config.BOT_AVATAR_URL,
                 "content": f"{user_data['user_name']} has joined Slack workspace!"
             }
-            headers = {"Content-Type": "application/json"}
-            requests.post(config.DISCORD_WELCOME_TO_SLACK_WEBHOOK_URL, data=json.dumps(data), headers=headers)
+            if not await webhooks.send(config.DISCORD_WELCOME_TO_SLACK_WEBHOOK_URL, data):
+                logger("Error notifying Discord about new user: webhook failed")
         except Exception as e:
-            logger(f"Error notifying Discord about new user: {e}")
+            logger('Error notifying Discord about new user: %s', e)
         return
 
     # Handle user joining a channel event
     if event.get("type") == "message" and event.get("subtype") == "channel_join":
         user_id = event.get("user")
         channel_id = event.get("channel")
-        user_name = get_user_name(user_id)
-        channel_name = get_channel_name(channel_id)
-        logger(f"User {user_name} joined channel {channel_name}!")
+        user_name, channel_name = await asyncio.gather(get_user_name_async(user_id), get_channel_name_async(channel_id))
+        logger('User %s joined channel %s!', user_name, channel_name)
         return
 
-    if event_id and not check_request_existence(event_id):
+    with metrics.stage_seconds.time(direction='slack_to_discord', stage='dedup'):
+        is_new = event_id and not check_request_existence(event_id)
+    if is_new:
         logger('New request!')
 
         # Check if the request has files 
         if event.get('subtype') == 'file_share':
             if not check_file_id_existance(event):
-                logger(f"""-------NEW FILE MESSAGE FROM SLACK-------""")
-                logger(f"""---> {event.get('text')}""")
+                logger('-------NEW FILE MESSAGE FROM SLACK-------')
+                logger('---> %s', event.get('text'), level=logging.DEBUG)
 
-                await slack_message_operator_async(event)
+                await relay_to_discord(event, event_id)
                 return 
             else:
                 logger('file_share request ignored')
@@ -82,10 +172,10 @@ async def slack_events(event_data):
         
         # Check if the request is a text message 
         elif event.get('text') != "" and event.get('text') is not None:
-            logger(f"""-------NEW TEXT MESSAGE FROM SLACK-------""")
-            logger(f"""---> {event.get('text')}""")
+            logger('-------NEW TEXT MESSAGE FROM SLACK-------')
+            logger('---> %s', event.get('text'), level=logging.DEBUG)
 
-            await slack_message_operator_async(event)
+            await relay_to_discord(event, event_id)
             return
         
         # Check if the request is a message with attachments
@@ -94,63 +184,81 @@ async def slack_events(event_data):
             for attachment in attachments:
                 text = attachment.get('text', "").strip()
                 if text:
-                    logger(f"""-------NEW TEXT MESSAGE FROM SLACK (from attachments)-------""")
-                    logger(f"""---> {text}""")
+                    logger('-------NEW TEXT MESSAGE FROM SLACK (from attachments)-------')
+                    logger('---> %s', text, level=logging.DEBUG)
 
-                    await slack_message_operator_async(event)  
+                    await relay_to_discord(event, event_id)  
                     return      
         else:
             logger('UNKNOWN MESSAGE CONTENT')
             return 
     else:
-        logger(f'Request saved already: {event_id}')
+        metrics.duplicates.inc(source='slack_event')
+        logger('Request saved already: %s', event_id)
+
+async def relay_to_discord(event, event_id):
+    # Run one relay, recording its total time and outcome
+    start = time.perf_counter()
+    result = 'error'
+    try:
+        await slack_message_operator_async(event)
+        result = 'ok'
+    except Exception:
+        # Forget the event as seen, so the journal's retry isn't dropped as a duplicate
+        processed_requests.discard(event_id)
+        for file in event.get('files', []):
+            processed_files.discard(file.get('id'))
+        raise
+    finally:
+        metrics.relay_seconds.observe(time.perf_counter() - start, direction='slack_to_discord')
+        metrics.relayed_messages.inc(direction='slack_to_discord', result=result)
 
 async def slack_message_operator_async(event):
     # Function to determine the type of message and send it to Discord
     from discord_bot import discord_client
-    
-    SLACK_CHANNELS_DICT = load_channels_mapping()
 
     channel_id = event.get('channel')
-    channel_name = get_channel_name(channel_id)
+    channel_name = await get_channel_name_async(channel_id)
 
-    logger(f'channel_id: {channel_id}')
-    logger(f'channel_name: {channel_name}')
+    logger('channel_id: %s', channel_id, level=logging.DEBUG)
+    logger('channel_name: %s', channel_name, level=logging.DEBUG)
 
     # Check if the channel is in the mapping and get the corresponding Discord channel object
-    if channel_id in SLACK_CHANNELS_DICT: 
-        logger(f'SLACK - MESSAGE FROM - #{channel_name}')
-        discord_channel_id = SLACK_CHANNELS_DICT[channel_id]
+    discord_channel_id = channels.slack_to_discord(channel_id)
+    if discord_channel_id is not None:
+        logger('SLACK - MESSAGE FROM - #%s', channel_name)
         discord_channel = discord_client.get_channel(int(discord_channel_id))
     else:
         # Channel not handled
-        logger(f'SLACK - MESSAGE FROM OTHER CHANNEL - #{channel_name}')
+        logger('SLACK - MESSAGE FROM OTHER CHANNEL - #%s', channel_name)
         return  
     
     # Check if the message contains files
     if 'files' in event:  
-        logger('MESSAGE WITH IMAGE')
-        file_paths = await process_files_async(event)
+        logger('MESSAGE WITH IMAGE', level=logging.DEBUG)
+        with metrics.stage_seconds.time(direction='slack_to_discord', stage='file_download'):
+            attachments = await process_files_async(event)
     else:
-        logger('MESSAGE WITHOUT IMAGE')
-        file_paths = None
+        logger('MESSAGE WITHOUT IMAGE', level=logging.DEBUG)
+        attachments = None
 
     # Check if the message is a thread message
     if event.get('thread_ts'):
-        logger(f'SLACK - MESSAGE IN THREAD')
+        logger('SLACK - MESSAGE IN THREAD')
 
         try:
             # try to get the parent message ID from the database
-            wait_for_parent_message_id(event)
-            send_thread_message_to_discord(event, discord_channel=discord_channel, file_paths=file_paths)
+            with metrics.stage_seconds.time(direction='slack_to_discord', stage='parent_lookup'):
+                await wait_for_parent_message_id(event)
+            await send_thread_message_to_discord(event, discord_channel=discord_channel, attachments=attachments)
         except KeyError:
             # if the parent message ID is not found, send a new message to Discord
-            send_new_message_to_discord(event, discord_channel=discord_channel, slack_message_id=event.get('thread_ts'), file_paths=file_paths)
+            await send_new_message_to_discord(event, discord_channel=discord_channel, slack_message_id=event.get('thread_ts'), attachments=attachments)
 
     # Check if the message is a new text message
     elif event.get('ts'):
-        logger(f'SLACK - NEW MESSAGE IN CHANNEL')
-        send_new_message_to_discord(event, discord_channel=discord_channel, slack_message_id=event.get('ts'), file_paths=file_paths)
+        logger('SLACK - NEW MESSAGE IN CHANNEL')
+        await send_new_message_to_discord(event, discord_channel=discord_channel, slack_message_id=event.get('ts'), attachments=attachments)
     else:
         # If the message is not a thread message and not a new text message 
         logger('UNKNOWN MESSAGE FROM SLACK')
@@ -162,84 +270,143 @@ async def slack_message_operator_async(event):
 
 def check_last_message_user_id(current_user_id, slack_channel_id, discord_channel_id):
     # Function to check if the last message user ID is the same as the current user ID
-    if slack_channel_id in config.SLACK_CHANNEL_LAST_USER:
-        slack_channel_last_user_id = config.SLACK_CHANNEL_LAST_USER[slack_channel_id]['user_id']
-        if slack_channel_last_user_id == current_user_id:
-            logger(f'In this slack channel, the last message was sent by the same user: {current_user_id}')
-            
-            if str(discord_channel_id) in config.DISCORD_CHANNEL_LAST_USER: 
-                discord_channel_last_user_id = config.DISCORD_CHANNEL_LAST_USER[str(discord_channel_id)]['user_id']
-                logger(f'Last message user ID in discord channel: {discord_channel_last_user_id}')
-                logger(f'DISCORD_BOT_ID: {config.DISCORD_BOT_ID}')
-                if discord_channel_last_user_id == str(config.DISCORD_BOT_ID):
-                    logger(f'Discord bot was the last user: {discord_channel_last_user_id}')
-                    return True
-                else:
-                    if config.SLACK_CHANNEL_LAST_USER[slack_channel_id]['timestamp'] > (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=1)):
-                        # Check if the last message was sent less than 1 second ago
-                        logger(f'New message was sent after less than 1 second from last message')
-                        return True
-                    else:
-                        logger(f'Discord bot was not the last user: {discord_channel_last_user_id}')
-                        return False
-            else:
-                if config.SLACK_CHANNEL_LAST_USER[slack_channel_id]['timestamp'] > (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=1)):
-                    # Check if the last message was sent less than 1 second ago
-                    logger(f'New message was sent after less than 1 second from last message')
-                    return True
-                else:
-                    logger(f'No channel {discord_channel_id} found in discord_channel_last_user: \n{json.dumps(config.DISCORD_CHANNEL_LAST_USER, indent=2, default=str)}')
-                    return False
-        else:
-            logger(f'In this slack channel, the last message was sent by a different user: {slack_channel_last_user_id}')
-            return False
-    else:
-        logger(f'No channel found in slack_channel_last_user: {slack_channel_id}')
+    slack_speaker = slack_last_speakers.get(slack_channel_id)
+    if slack_speaker is None:
+        logger('No channel found in slack_last_speakers: %s', slack_channel_id, level=logging.DEBUG)
         return False
-       
+
+    if slack_speaker.user_id != current_user_id:
+        logger('In this slack channel, the last message was sent by a different user: %s', slack_speaker.user_id, level=logging.DEBUG)
+        return False
+    logger('In this slack channel, the last message was sent by the same user: %s', current_user_id, level=logging.DEBUG)
+
+    discord_speaker = discord_last_speakers.get(str(discord_channel_id))
+    if discord_speaker is not None:
+        logger('Last message user ID in discord channel: %s', discord_speaker.user_id, level=logging.DEBUG)
+        if discord_speaker.user_id == str(config.DISCORD_BOT_ID):
+            logger('Discord bot was the last user: %s', discord_speaker.user_id, level=logging.DEBUG)
+            return True
+
+    if slack_speaker.age < SAME_SPEAKER_WINDOW:
+        # Check if the last message was sent less than 1 second ago
+        logger('New message was sent after less than 1 second from last message', level=logging.DEBUG)
+        return True
+
+    logger('Discord bot was not the last user in discord channel: %s', discord_channel_id, level=logging.DEBUG)
+    return False
+
 def set_last_message_user_id(user_id, channel_id):
-    # Function to set the last message user ID in the config
-    config.SLACK_CHANNEL_LAST_USER[channel_id] = {'user_id': user_id, 'timestamp': datetime.datetime.now(datetime.timezone.utc)}
+    # Function to remember the last message user ID of the channel
+    slack_last_speakers.set(channel_id, user_id)
     # --- printing for debugging ---
-    user_name = get_user_name(user_id) 
+    logger('Slack last message user ID set for channel: %s by user: %s', channel_id, user_id, level=logging.DEBUG)
 
-    logger(f'Slack last message user ID set for channel: {channel_id} by user: {user_name}')
-    logger(f'Slack last message user ID dict: \n{json.dumps(config.SLACK_CHANNEL_LAST_USER, indent=2, default=str)}')
+#------------------------------------------
+# Functions to process and replay journaled events
+#------------------------------------------
 
-def update_last_message_user_id():
-    # Function to update the last message user ID in the config
-    for channel_id in list(config.SLACK_CHANNEL_LAST_USER.keys()):
-        if config.SLACK_CHANNEL_LAST_USER[channel_id]['timestamp'] < (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=5)):
-            del config.SLACK_CHANNEL_LAST_USER[channel_id]
+async def process_journal_entry(entry_id, kind, payload, attempts=0, created_at=None):
+    # Function to handle a journaled request and finish its entry once it has been relayed.
+    # A failed entry stays pending and is retried here with backoff (and on the next start),
+    # until it runs out of attempts or gets too old; then it is marked failed.
+    if created_at is None:
+        created_at = time.time()
+    if attempts >= config.JOURNAL_MAX_ATTEMPTS:
+        logger('Journal entry %s dropped after %s attempts', entry_id, attempts)
+        journal.mark_failed(entry_id)
+        return
+    if time.time() - created_at > config.JOURNAL_MAX_AGE:
+        logger('Journal entry %s dropped, older than %ss', entry_id, config.JOURNAL_MAX_AGE)
+        journal.mark_failed(entry_id)
+        return
 
-            # --- printing for debugging ---
-            logger(f'Last message user ID deleted for slack channel: {channel_id}')
-    logger(f'Updated slack last message user ID dict: \n{json.dumps(config.SLACK_CHANNEL_LAST_USER, indent=2, default=str)}')
+    journal.mark_attempt(entry_id)
+    try:
+        if kind == 'slack_event':
+            resolve_file_shares(payload.get('event', {}))
+            await slack_events(payload)
+        elif kind == 'bot_echo':
+            handle_bot_echo(payload)
+        elif kind == 'button':
+            await handle_button_click(payload)
+        else:
+            logger('Unknown journal entry kind: %s', kind)
+    except Exception as e:
+        delay = config.JOURNAL_RETRY_DELAY * 2 ** attempts
+        logger('Error processing journal entry %s: %s (attempt %s)', entry_id, e, attempts + 1)
+        if attempts + 1 < config.JOURNAL_MAX_ATTEMPTS:
+            logger('Journal entry %s will be retried in %ss', entry_id, delay)
+            asyncio.get_running_loop().call_later(delay, lambda: asyncio.ensure_future(
+                process_journal_entry(entry_id, kind, payload, attempts + 1, created_at)
+            ))
+        else:
+            logger('Journal entry %s dropped after %s attempts', entry_id, attempts + 1)
+            journal.mark_failed(entry_id)
+        return
+    journal.mark_done(entry_id)
+
+def handle_bot_echo(payload):
+    # Our own message coming back from Slack: only the gateway state needs updating
+    event = payload.get('event', {})
+    resolve_file_shares(event)
+    set_last_message_user_id(event.get('user'), event.get('thread_ts') or event.get('channel'))
+
+async def replay_journal():
+    # Function to replay entries left unfinished by the previous run
+    replayed = 0
+    cursor = 0
+    while True:
+        entries = journal.pending(after=cursor, up_to=journal.replay_up_to)
+        if not entries:
+            break
+        for entry_id, kind, payload, attempts, created_at in entries:
+            # Failed entries are not picked up again here; process_journal_entry retries them
+            cursor = entry_id
+            await process_journal_entry(entry_id, kind, payload, attempts, created_at)
+            replayed += 1
+    logger('Journal replay finished: %s entries', replayed)
+
+async def consume_journal():
+    # Function for the gateway process: run entries written by the ingress workers,
+    # including any left over from before a restart
+    semaphore = asyncio.Semaphore(config.GATEWAY_CONCURRENCY)
+    cursor = 0
+    logger('Consuming journal from ingress workers')
+
+    while True:
+        entries = journal.pending(after=cursor)
+        if not entries:
+            await asyncio.sleep(config.JOURNAL_POLL_INTERVAL)
+            continue
+
+        for entry_id, kind, payload, attempts, created_at in entries:
+            # Failed entries stay pending behind the cursor; process_journal_entry retries them
+            cursor = entry_id
+            await semaphore.acquire()
+            task = asyncio.ensure_future(process_journal_entry(entry_id, kind, payload, attempts, created_at))
+            task.add_done_callback(lambda _: semaphore.release())
 
 #------------------------------------------
-# Functions to check if the request is already processed
+# Functions to resolve uploaded files to their message ts
 #------------------------------------------
 
-def cleanup_expired_requests():
-# Function to cleanup expired requests
-    global processed_requests
+def resolve_file_shares(event):
+    # Function to hand the message ts of shared files to discord_bot.wait_message_ID
+    if event.get('type') == 'file_shared':
+        # file_shared carries no message ts, so only wake waiters to poll files.info now
+        file_shares.poke(event.get('file_id'))
+    elif event.get('type') == 'message' and event.get('files') and event.get('ts'):
+        for file in event['files']:
+            if file.get('id'):
+                file_shares.resolve(file['id'], event['ts'])
 
-    now = datetime.datetime.now()
-    expired_keys = [key for key, timestamp in processed_requests.items() if now >= timestamp + datetime.timedelta(minutes=5)]
-    for key in expired_keys:
-        del processed_requests[key]
+#------------------------------------------
+# Functions to check if the request is already processed
+#------------------------------------------
 
 def check_request_existence(request_id):
 # Function to check and add request ID to processed_requests
-    global processed_requests
-
-    cleanup_expired_requests()
-    now = datetime.datetime.now()
-    if request_id in processed_requests:
-        return True  
-    else:
-        processed_requests[request_id] = now  
-        return False 
+    return not processed_requests.add(request_id)
 
 #------------------------------------------
 
@@ -258,12 +425,12 @@ async def handle_button_click(payload):
         emoji = ":wave:"  
 
         try:
-            user_info = sync_slack_client.users_info(user=user_id)
-            user_data = user_info.get("user", {})
+            user_data = await user_profiles.get_async(user_id)
             user_name = user_data.get("real_name", "Anonymous")
             avatar_url = user_data.get("profile", {}).get("image_192", "")
 
         except SlackApiError as e:
+            metrics.api_errors.inc(api='slack_users_info', reason='error')
             return f"Ошибка Slack API: {e.response['error']}", 500
         
         try:
@@ -277,91 +444,78 @@ async def handle_button_click(payload):
                 "username": user_name,  # Имя пользователя из Slack
                 "avatar_url": avatar_url if avatar_url else "",  # Аватар из Slack
             }
-            headers = {"Content-Type": "application/json"}
 
             # Отправка сообщения через вебхук Discord
-            response = requests.post(config.DISCORD_TEST_WEBHOOK_URL, data=json.dumps(data), headers=headers)
-            
-            if response.status_code != 204:
-                return f"Ошибка отправки в Discord: {response.text}", response.status_code
+            if not await webhooks.send(config.DISCORD_NEWBIES_WEBHOOK_URL, data):
+                return f"Ошибка отправки в Discord", 500
             else:
-                logger(f'{user_name} waved to {discord_user_name}!')
+                logger('%s waved to %s!', user_name, discord_user_name)
             
         except Exception as e:
             return f"Ошибка при отправке сообщения в Discord: {e}", 500
         
         # Отправляем ephemeral сообщение
         try:
-            sync_slack_client.chat_postEphemeral(
+            await slack_client.chat_postEphemeral(
                 channel=interaction["channel"]["id"],
                 user=user_id,
                 text=f"Ти привітався\привіталась з *_{discord_user_name}_*!"
             )
         except SlackApiError as e:
-            logger(f"Ошибка при отправке ephemeral сообщения: {e.response['error']}")
+            logger('Ошибка при отправке ephemeral сообщения: %s', e.response['error'])
             return f"Ошибка Slack API: {e.response['error']}", 500
 
         # Возвращаем успешный статус
         return "", 200
         
     else:
-        print('payload is not in payload')
+        logger('payload is not in payload', level=logging.WARNING)
         return "Некорректный запрос", 400
 
 #------------------------------------------
 # Helper functions to send message to Discord
 #------------------------------------------
 
-def load_channels_mapping():
-# Function to load channel mapping from JSON file
+async def wait_for_parent_message_id(event):
+# Function to wait until the parent message is mapped in the database
+    slack_message_id = event.get('thread_ts')
+    logger('slack_message_id: %s', slack_message_id, level=logging.DEBUG)
+
     try:
-        file_path = os.path.abspath('channels.json')
-        with open(file_path, 'r', encoding='utf-8') as f:
-            channels_data = json.load(f)
-        slack_to_discord = {item['slack_channel_id']: item['discord_channel_id'] for item in channels_data['channels_mapping']}
-        return slack_to_discord
-    except Exception as e:
-        print(f'Error loading JSON from {file_path}: {str(e)}')
-        raise e
+        return await db.get_discord_message_id_async(slack_message_id)
+    except KeyError:
+        pass
 
-def wait_for_parent_message_id(event):
-# Function to wait for the parent message ID in the database
-    slack_message_id = event.get('thread_ts')
-    logger(f'slack_message_id: {slack_message_id}')
+    logger("Waiting for parent message")
+    try:
+        # db.save_message_to_db resolves this as soon as the parent is relayed
+        return await message_mappings.wait(('slack', slack_message_id), timeout=config.PARENT_MESSAGE_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger('.*wait_for_parent_message_id* Timed out waiting for: %s', slack_message_id)
+        raise KeyError("Discord message ID not found for this Slack message ID")
 
-    retries = 60
-    while retries:
-        try:
-            discord_message_id = db.get_discord_message_id(slack_message_id)
-            return discord_message_id
-        except Exception as e:
-            logger(f'.*wait_for_parent_message_id* Error: {e}')
-            retries -= 1
-            if retries == 0:
-                raise e
-            logger("Waiting for parent message")
-            time.sleep(1)  # Wait before retrying to allow time for database updates
-
-def logger(log_text):
-    print(log_text)
-    logging.info(log_text)
-
-async def send_thread_message_to_discord_async(event, discord_channel, file_paths):
+log = logging.getLogger(__name__)
+
+def logger(log_text, *args, level=logging.INFO, **fields):
+    # See log_config.setup_logging
+    log.log(level, log_text, *args, extra=fields, stacklevel=2)
+
+async def send_thread_message_to_discord_async(event, discord_channel, attachments):
     slack_message_id = event.get('thread_ts')
-    discord_message_id = db.get_discord_message_id(slack_message_id)    
-    user_data = get_user_data(event)
+    discord_message_id = await db.get_discord_message_id_async(slack_message_id)
+    with metrics.stage_seconds.time(direction='slack_to_discord', stage='user_lookup'):
+        user_data = await get_user_data(event)
     # user_id = event.get('user')
-    logger(f'Message from: {user_data["user_name"]}')
+    logger('Message from: %s', user_data["user_name"], level=logging.DEBUG)
 
     if discord_channel:
         try:
             parent_message = await discord_channel.fetch_message(discord_message_id)
         except Exception as e:
-            logger(f'Error parent message: {e}')
+            logger('Error parent message: %s', e)
             return        
 
         if parent_message:
-            update_last_message_user_id()
             if not check_last_message_user_id(current_user_id=user_data["user_id"], slack_channel_id=slack_message_id, discord_channel_id=discord_message_id):
                 text = f'**💂_{user_data["user_name"]}_**\n{user_data["user_text"]}'
             else:
@@ -375,29 +529,33 @@ async def send_thread_message_to_discord_async(event, discord_channel, file_path
                 thread_name = " ".join(parent_text.split()[:5])
                 thread_name = clean_and_format_thread_name(thread_name) if thread_name else "Discussion"
             except Exception as e:
-                logger(f'2: {e}')
+                logger('2: %s', e)
 
             # Проверяем, есть ли уже ветка для этого сообщения
             if parent_message.thread:
                 try:
                     # Если ветка уже существует, просто отправляем сообщение в существующую ветку
                     thread = parent_message.thread    
-                    result = await send_thread_message_operator(file_paths, text, thread)
+                    with metrics.stage_seconds.time(direction='slack_to_discord', stage='discord_post'):
+                        result = await send_thread_message_coalesced(attachments, text, thread, event, user_data["user_text"])
 
                     logger('Message sent in existing thread')
                 except Exception as e:
-                    logger(f'3: {e}')
+                    logger('3: %s', e)
+                    raise
             else:
                 try:
                     # Создаём новую ветку, если её нет
                     thread = await parent_message.create_thread(
                         name=f"{thread_name}",
                     )
-                    result = await send_thread_message_operator(file_paths, text, thread)
+                    with metrics.stage_seconds.time(direction='slack_to_discord', stage='discord_post'):
+                        result = await send_thread_message_coalesced(attachments, text, thread, event, user_data["user_text"])
 
                     logger('Message sent in new thread')
                 except Exception as e:
-                    logger(f'4: {e}')
+                    logger('4: %s', e)
+                    raise
             if result:
                 logger("---> 'send_thread_message_to_discord_async' func is done")
 
@@ -407,61 +565,78 @@ async def send_thread_message_to_discord_async(event, discord_channel, file_path
     else:
         logger("Discord_channel not found.")
 
-async def send_thread_message_operator(file_paths, text, thread):
+async def send_thread_message_coalesced(attachments, text, thread, event, user_text):
+    # Plain text goes through the burst coalescer; files go out as they are, after any pending burst
+    if attachments:
+        await discord_coalescer.flush(thread.id)
+        return await send_thread_message_operator(attachments, text, thread)
+
+    result, _ = await discord_coalescer.submit(
+        thread.id, event.get('user'), event.get('ts'), text,
+        lambda text: send_thread_message_operator(None, text, thread),
+        continuation=user_text
+    )
+    return result
+
+async def send_thread_message_operator(attachments, text, thread):
     max_length = 2000
-    logger(f'len text is {len(text)}!')
+    logger('len text is %s!', len(text), level=logging.DEBUG)
 
     if len(text) >= max_length:
-        logger(f'Text is longer than {max_length}!')
-        result = await send_thread_message_by_parts(file_paths, thread, text, max_length)
+        logger('Text is longer than %s!', max_length)
+        result = await send_thread_message_by_parts(attachments, thread, text, max_length)
         return result
     else:
-        logger(f'Text is less than {max_length}')
-        if file_paths:
-            logger('But the text has files')
-            result = await send_thread_message_with_files(file_paths, thread, text)
+        logger('Text is less than %s', max_length, level=logging.DEBUG)
+        if attachments:
+            logger('But the text has files', level=logging.DEBUG)
+            result = await send_thread_message_with_files(attachments, thread, text)
             return result
         else:
-            logger('And it has no files')
-            result = await thread.send(text)
+            logger('And it has no files', level=logging.DEBUG)
+            result = await discord_outbound.submit(thread.id, thread.send, text)
             return result
 
-async def send_thread_message_by_parts(file_paths, thread, text, max_length):
+async def send_thread_message_by_parts(attachments, thread, text, max_length):
     parts = split_text_by_parts(text, max_length)
-    logger(f'len texts is {len(parts)}')
+    logger('len texts is %s', len(parts), level=logging.DEBUG)
 
     for i, text in enumerate(parts):
         if i == len(parts)-1:
-            if file_paths:
-                logger(f'Text is longer than {max_length} and it has files!')
-                result = await send_thread_message_with_files(file_paths, thread, text)
+            if attachments:
+                logger('Text is longer than %s and it has files!', max_length)
+                result = await send_thread_message_with_files(attachments, thread, text)
                 return result
             else:
-                logger(f'Text is longer than {max_length} and it has no files!')
-                result = await thread.send(text)
+                logger('Text is longer than %s and it has no files!', max_length)
+                result = await discord_outbound.submit(thread.id, thread.send, text)
                 return result
         else:
-            await thread.send(text)
-            logger(f'---> Message sent:\n{text}')
+            await discord_outbound.submit(thread.id, thread.send, text)
+            logger('---> Message sent:\n%s', text, level=logging.DEBUG)
 
-async def send_thread_message_with_files(file_paths, thread, text):
+async def send_thread_message_with_files(attachments, thread, text):
     logger('Sending files in thread message')
 
-    files = [discord.File(path, filename=os.path.basename(path)) for path in file_paths]
-    result = await thread.send(text, files=files)
-    delete_files(file_paths)
+    try:
+        # Files are rebuilt on every attempt so a retried send re-reads the buffers from the start
+        result = await discord_outbound.submit(thread.id, lambda: thread.send(text, files=[
+            discord.File(attachment.rewind(), filename=attachment.filename) for attachment in attachments
+        ]))
+    finally:
+        close_attachments(attachments)
     return result
 
-async def send_new_message_to_discord_async(event, discord_channel, slack_message_id, file_paths):
+async def send_new_message_to_discord_async(event, discord_channel, slack_message_id, attachments):
     try:
-        user_data = get_user_data(event)
+        with metrics.stage_seconds.time(direction='slack_to_discord', stage='user_lookup'):
+            user_data = await get_user_data(event)
         slack_channel_id = event.get('channel')
-        logger(f'Message from {user_data["user_name"]}')
+        logger('Message from %s', user_data["user_name"], level=logging.DEBUG)
 
         if discord_channel:
             discord_channel_id = get_discord_channel_by_slack_channel_id(slack_channel_id)
                 
-            update_last_message_user_id()
             if not check_last_message_user_id(current_user_id=user_data["user_id"], slack_channel_id=slack_channel_id, discord_channel_id=discord_channel_id):
                 text = f'**💂_{user_data["user_name"]}_**\n{user_data["user_text"]}'
             else:
@@ -469,60 +644,80 @@ async def send_new_message_to_discord_async(event, discord_channel, slack_messag
 
             set_last_message_user_id(user_id=event.get('user'), channel_id=event.get('channel'))
 
-            message = await send_new_message_operator(file_paths, discord_channel, text)
+            with metrics.stage_seconds.time(direction='slack_to_discord', stage='discord_post'):
+                if attachments:
+                    await discord_coalescer.flush(discord_channel.id)
+                    message, merged_ids = await send_new_message_operator(attachments, discord_channel, text), [slack_message_id]
+                else:
+                    message, merged_ids = await discord_coalescer.submit(
+                        discord_channel.id, user_data["user_id"], slack_message_id, text,
+                        lambda text: send_new_message_operator(None, discord_channel, text),
+                        continuation=user_data["user_text"]
+                    )
             logger('New message sent to discord')
 
             message_id = message.id
-            db.save_message_to_db(slack_message_id, message_id)
+            with metrics.stage_seconds.time(direction='slack_to_discord', stage='db_save'):
+                if merged_ids[0] == slack_message_id:
+                    await db.save_message_to_db_async(slack_message_id, message_id)
+                else:
+                    # Merged into a post started by an earlier message
+                    await db.save_alias_async('slack', slack_message_id, message_id)
 
             logger("---> 'send_new_message_to_discord_async' func is done")
             return #jsonify({"status":"ok"})
         
     except Exception as e:
-        logger(f"Error: {e}")
+        logger('Error: %s', e)
+        # Let the journal entry fail, so it is retried rather than marked done
+        raise
 
-async def send_new_message_operator(file_paths, discord_channel, text):
+async def send_new_message_operator(attachments, discord_channel, text):
     max_length = 2000
-    logger(f'len text is {len(text)}')
+    logger('len text is %s', len(text), level=logging.DEBUG)
     if len(text) >= max_length:
-        logger(f'Text is longer than {max_length}!')
-        result = await send_new_message_by_parts(file_paths, discord_channel, text, max_length)
+        logger('Text is longer than %s!', max_length)
+        result = await send_new_message_by_parts(attachments, discord_channel, text, max_length)
         return result
     else:
-        logger(f'Text is less than {max_length}')
-        if file_paths:
-            logger('But the text has files')
-            result = await send_new_message_with_files(file_paths, discord_channel, text)
+        logger('Text is less than %s', max_length, level=logging.DEBUG)
+        if attachments:
+            logger('But the text has files', level=logging.DEBUG)
+            result = await send_new_message_with_files(attachments, discord_channel, text)
             return result 
         else:
-            logger('And it has no files')
-            result  = await discord_channel.send(text)
+            logger('And it has no files', level=logging.DEBUG)
+            result  = await discord_outbound.submit(discord_channel.id, discord_channel.send, text)
             return result 
 
-async def send_new_message_by_parts(file_paths, discord_channel, text, max_length):
+async def send_new_message_by_parts(attachments, discord_channel, text, max_length):
     parts = split_text_by_parts(text, max_length)
-    logger(f'len texts is {len(parts)}')
+    logger('len texts is %s', len(parts), level=logging.DEBUG)
     for i, text in enumerate(parts):
         if i == len(parts)-1:
-            if file_paths:
-                logger(f'Text is longer than {max_length} and it has files!')
-                result = await send_new_message_with_files(file_paths, discord_channel, text)
+            if attachments:
+                logger('Text is longer than %s and it has files!', max_length)
+                result = await send_new_message_with_files(attachments, discord_channel, text)
                 return result
             else:
-                logger(f'Text is longer than {max_length} and it has no files!')
-                result = await discord_channel.send(text)
+                logger('Text is longer than %s and it has no files!', max_length)
+                result = await discord_outbound.submit(discord_channel.id, discord_channel.send, text)
                 return result
         else:
-            await discord_channel.send(text)
-            logger(f'---> Message sent:\n{text}')
+            await discord_outbound.submit(discord_channel.id, discord_channel.send, text)
+            logger('---> Message sent:\n%s', text, level=logging.DEBUG)
 
-async def send_new_message_with_files(file_paths, discord_channel, text):
+async def send_new_message_with_files(attachments, discord_channel, text):
     logger('Sending files in new message')
 
-    files = [discord.File(path, filename=os.path.basename(path)) for path in file_paths]
-    result = await discord_channel.send(text, files=files)
-    delete_files(file_paths)
-    return result 
+    try:
+        # Files are rebuilt on every attempt so a retried send re-reads the buffers from the start
+        result = await discord_outbound.submit(discord_channel.id, lambda: discord_channel.send(text, files=[
+            discord.File(attachment.rewind(), filename=attachment.filename) for attachment in attachments
+        ]))
+    finally:
+        close_attachments(attachments)
+    return result
 
 async def process_files_async(event):
     # Извлекаем файлы и текст из сообщения Slack
@@ -532,61 +727,53 @@ async def process_files_async(event):
     # Извлекаем URL файлов
     for file in files:
         if file.get('url_private'):
-            file_urls.append((file['url_private'], file['mimetype']))
+            file_urls.append((file['url_private'], file['mimetype'], file.get('name')))
 
     if not file_urls:
         logger("No files found in the message.")
         return None
 
     # Скачиваем файлы
-    file_paths = await download_files(file_urls)
+    attachments = await download_files(file_urls)
 
-    if not file_paths:
+    if not attachments:
         logger("No files were successfully downloaded.")
         return None
     
-    return file_paths
+    return attachments
 
 async def download_files(file_urls):
-    os.makedirs("temp_files", exist_ok=True)
-    file_paths = []
-
-    async with aiohttp.ClientSession() as session:
-        for url, mimetype in file_urls:
-            try:
-                headers = {'Authorization': f'Bearer {config.SLACK_TOKEN}'}
-                async with session.get(url, headers=headers) as response:
-                    if response.status == 200:
-                        # Создаем временный файл с правильным расширением
-                        ext = mimetype.split('/')[-1]
-                        file_name = f"temp_files/{url.split('/')[-1].split('?')[0]}"
-                        if not file_name.endswith(ext):
-                            file_name += f".{ext}"
-
-                        with open(file_name, 'wb') as f:
-                            f.write(await response.read())
-                        file_paths.append(file_name)
-                        logger(f"Downloaded file from Slack: {url}")
-                    else:
-                        logger(f"Failed to download file: {url}, Status: {response.status}")
-            except Exception as e:
-                logger(f"Error downloading file from {url}: {e}")
-
-    return file_paths
+    # Stream Slack files into memory buffers, several at a time over the pooled session
+    headers = {'Authorization': f'Bearer {config.SLACK_TOKEN}'}
+    files = []
+
+    for url, mimetype, name in file_urls:
+        # Имя файла с правильным расширением
+        ext = mimetype.split('/')[-1]
+        file_name = name or url.split('/')[-1].split('?')[0]
+        if not file_name.endswith(ext) and '.' not in file_name:
+            file_name += f".{ext}"
+        files.append((url, file_name, headers))
+
+    attachments = await download_attachments(files)
+    logger('Downloaded %s of %s files from Slack', len(attachments), len(files))
+    return attachments
 
 #------------------------------------------
 # Convert function calls into async loop for Discord
 #------------------------------------------
   
-def send_thread_message_to_discord(event, discord_channel, file_paths):
+async def send_thread_message_to_discord(event, discord_channel, attachments):
     from discord_bot import discord_client
-    # Правильный запуск асинхронной функции с использованием event loop
-    asyncio.ensure_future(send_thread_message_to_discord_async(event, discord_channel, file_paths), loop=discord_client.loop)
+    # Run on the Discord loop and wait until it is delivered, so the journal entry is only finished after it
+    future = asyncio.run_coroutine_threadsafe(send_thread_message_to_discord_async(event, discord_channel, attachments), discord_client.loop)
+    await asyncio.wrap_future(future)
 
-def send_new_message_to_discord(event, discord_channel, slack_message_id, file_paths):
+async def send_new_message_to_discord(event, discord_channel, slack_message_id, attachments):
     from discord_bot import discord_client
-    # Правильно запускаем асинхронную функцию с использованием event loop
-    asyncio.ensure_future(send_new_message_to_discord_async(event, discord_channel, slack_message_id, file_paths), loop=discord_client.loop)
+    # Run on the Discord loop and wait until it is delivered, so the journal entry is only finished after it
+    future = asyncio.run_coroutine_threadsafe(send_new_message_to_discord_async(event, discord_channel, slack_message_id, attachments), discord_client.loop)
+    await asyncio.wrap_future(future)
 
 #------------------------------------------
 
@@ -596,30 +783,9 @@ def clean_and_format_thread_name(raw_text):
     cleaned_text = cleaned_text.lstrip('*').strip()
     return cleaned_text
 
-def delete_files(file_paths):
-    """Delete files after they have been used."""
-    for file_path in file_paths:
-        try:
-            os.remove(file_path)
-            logger(f"Deleted image: {file_path}")
-        except Exception as e:
-            logger(f"Error deleting image {file_path}: {e}")
-
-def format_mentions(user_text):
-    mentions = re.findall(r'<@(\w+)>', user_text)
-
-    if mentions:  
-        for mention in mentions:
-            try:
-                mention_info = sync_slack_client.users_info(user=mention)
-                mention_name = mention_info['user']['real_name']
-                user_text = user_text.replace(f'<@{mention}>', f'@{mention_name}')
-            except Exception as e:
-                # Логируем ошибку, если не удалось получить информацию о пользователе
-                logger(f"Ошибка при получении информации для {mention}: {e}")
-    else:
-        logger("Упоминаний не найдено.")
-    return user_text
+async def format_mentions(user_text):
+    # User mentions, channel links and @here/@channel, resolved concurrently from the caches
+    return await mentions.translate(user_text, user_profiles, channel_info)
     
 def split_text_by_parts(text, max_length):
     parts = []
@@ -645,19 +811,16 @@ def split_text_by_parts(text, max_length):
     return parts
 
 def check_file_id_existance(event):
-    global processed_files
-    check_expired_files()
     new_files = False
 
     if 'files' in event:
         for file in event['files']:
             file_id = file.get('id')
-            if file_id not in processed_files:
-                add_file_to_processed(file_id)
+            if processed_files.add(file_id):
                 new_files = True
                 logger('There is a new file!')
             else:
-                logger('File already exists!', file_id)
+                logger('File already exists! %s', file_id)
 
         if new_files:
             logger('New files!')
@@ -666,25 +829,6 @@ def check_file_id_existance(event):
             logger('No new files!')
             return True
 
-def check_expired_files():
-    """Удаляет старые записи из processed_files по разнице времени."""
-    global processed_files
-
-    current_time = time.time()
-    expired_files = [file_id for file_id, timestamp in file_timestamps.items()
-                        if current_time - timestamp > EXPIRATION_TIME]
-    
-    for file_id in expired_files:
-        processed_files.remove(file_id)
-        del file_timestamps[file_id]
-
-def add_file_to_processed(file_id):
-    """Добавляет ID файла в processed_files и сохраняет время добавления."""
-    global processed_files
-
-    processed_files.add(file_id)
-    file_timestamps[file_id] = time.time()
-
 #------------------------------------------
 # Get data functions
 #------------------------------------------
@@ -702,37 +846,32 @@ def get_text(event):
 
         return user_text
     except Exception as e:
-        logger(f'Error in get_text: {e}')
+        logger('Error in get_text: %s', e)
 
 def get_discord_channel_by_slack_channel_id(slack_channel_id):
-    SLACK_CHANNELS_DICT = load_channels_mapping()
-    if slack_channel_id in SLACK_CHANNELS_DICT: 
-        discord_channel_id = SLACK_CHANNELS_DICT[slack_channel_id]
-        return discord_channel_id
-    return None
+    return channels.slack_to_discord(slack_channel_id)
 
-def get_channel_name(channel_id):
+async def get_channel_name_async(channel_id):
     try:
-        response = sync_slack_client.conversations_info(channel=channel_id)
-        channel_name = response["channel"]["name"]
-        return channel_name
+        channel = await channel_info.get_async(channel_id)
+        return channel["name"]
     except SlackApiError as e:
-        logger(f"Error getting channel info: {e.response['error']}")
+        metrics.api_errors.inc(api='slack_conversations_info', reason='error')
+        logger('Error getting channel info: %s', e.response['error'])
         return None
 
-def get_user_data(event):
+async def get_user_data(event):
     user_id = event.get('user')
     user_text = get_text(event)
-    user_text = format_mentions(user_text)
-    user_info = sync_slack_client.users_info(user=user_id)['user']
+    user_text, user_info = await asyncio.gather(format_mentions(user_text), user_profiles.get_async(user_id))
     user_name = user_info['profile']['display_name'] or user_info['real_name']
     return {'user_name': user_name, 'user_text': user_text, 'user_id': user_id}
 
-def get_user_name(user_id):
+async def get_user_name_async(user_id):
     try:
-        user_info = sync_slack_client.users_info(user=user_id)['user']
-        user_name = user_info['profile']['display_name'] or user_info['real_name']
-        return user_name
+        user_info = await user_profiles.get_async(user_id)
+        return user_info['profile']['display_name'] or user_info['real_name']
     except SlackApiError as e:
-        logger(f"Error getting user info: {e.response['error']}")
+        metrics.api_errors.inc(api='slack_users_info', reason='error')
+        logger('Error getting user info: %s', e.response['error'])
         return None
\ No newline at end of file
@@ -0,0 +1,58 @@
+import io
+import asyncio
+import discord
+import pytest
+from slack_sdk.web.async_client import AsyncWebClient
+import config
+from attachments import Attachment
+from benchmarks.fakes import FakeSlack, Recorder
+
+CONTENT = b'attachment bytes ' * 100
+
+@pytest.fixture(params=['memory', 'spilled'])
+def attachment(request, monkeypatch):
+    # Small enough to stay in memory, or past the limit so it spills to a temp file
+    limit = len(CONTENT) * 2 if request.param == 'memory' else len(CONTENT) // 2
+    monkeypatch.setattr(config, 'ATTACHMENT_SPOOL_MAX_MEMORY', limit)
+    attachment = Attachment('file.bin')
+    attachment.write(CONTENT)
+    yield attachment
+    attachment.close()
+
+def test_rewind_returns_a_real_file_object(attachment):
+    buffer = attachment.rewind()
+    assert isinstance(buffer, io.IOBase)
+    assert buffer.read() == CONTENT
+    assert attachment.rewind().tell() == 0
+
+def test_large_attachment_spills_to_disk(monkeypatch):
+    monkeypatch.setattr(config, 'ATTACHMENT_SPOOL_MAX_MEMORY', 10)
+    attachment = Attachment('file.bin')
+    attachment.write(b'12345')
+    assert isinstance(attachment.buffer, io.BytesIO)
+    attachment.write(b'67890abc')
+    buffer = attachment.rewind()
+    assert not isinstance(buffer, io.BytesIO)
+    assert buffer.read() == b'1234567890abc' and attachment.size == 13
+    attachment.close()
+
+def test_discord_upload(attachment):
+    # Built again for every attempt, as the outbound scheduler does on retry
+    for _ in range(2):
+        file = discord.File(attachment.rewind(), filename=attachment.filename)
+        assert file.fp.read() == CONTENT
+        file.close()
+
+def test_slack_upload(attachment):
+    slack = FakeSlack('secret', {'C1': 'general'}, Recorder())
+    slack.start()
+    client = AsyncWebClient(token='xoxb-test', base_url=slack.api_url)
+
+    response = asyncio.run(client.files_upload_v2(
+        channel='C1',
+        file_uploads=[{'file': attachment.rewind(), 'filename': attachment.filename}],
+    ))
+
+    assert response['ok']
+    file_id = response['files'][0]['id']
+    assert CONTENT in slack.uploads[file_id]
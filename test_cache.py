@@ -0,0 +1,93 @@
+import asyncio
+import pytest
+import cache
+from cache import TTLCache, CachedLoader, ExpiringSet
+
+class Clock:
+    # Stands in for time.monotonic so expiry can be tested without sleeping
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, 'monotonic', clock)
+    return clock
+
+def test_ttl_cache_expires_entries(clock):
+    ttl_cache = TTLCache(maxsize=10, ttl=60)
+    ttl_cache.set('a', 1)
+    ttl_cache.set('b', 2, ttl=5)
+
+    clock.now += 10
+    assert ttl_cache.get('a') == 1
+    assert ttl_cache.get('b') is None
+
+    clock.now += 60
+    assert ttl_cache.get('a') is None
+    assert ttl_cache.stats() == {'size': 0, 'hits': 1, 'misses': 2}
+
+def test_ttl_cache_evicts_least_recently_used():
+    ttl_cache = TTLCache(maxsize=2)
+    ttl_cache.set('a', 1)
+    ttl_cache.set('b', 2)
+    ttl_cache.get('a')
+    ttl_cache.set('c', 3)
+
+    assert ttl_cache.get('b') is None
+    assert ttl_cache.get('a') == 1
+    assert ttl_cache.get('c') == 3
+    assert len(ttl_cache) == 2
+
+def test_expiring_set(clock):
+    seen = ExpiringSet(ttl=30, max_entries=2)
+    assert seen.add('a')
+    assert not seen.add('a')
+
+    seen.add('b')
+    seen.add('c')
+    assert 'a' not in seen
+
+    clock.now += 31
+    assert 'b' not in seen and 'c' not in seen
+
+    seen.add('d')
+    seen.discard('d')
+    assert seen.add('d')
+
+def test_cached_loader_shares_one_fetch_between_concurrent_misses():
+    calls = []
+
+    async def fetch_async(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return key.upper()
+
+    loader = CachedLoader(TTLCache(maxsize=10), fetch=fetch_async)
+
+    async def main():
+        return await asyncio.gather(*(loader.get_async('u1') for _ in range(5)))
+
+    assert asyncio.run(main()) == ['U1'] * 5
+    assert calls == ['u1']
+    assert asyncio.run(loader.get_async('u1')) == 'U1'
+    assert loader.stats()['inflight'] == 0
+
+def test_cached_loader_does_not_cache_errors():
+    attempts = []
+
+    async def fetch(key):
+        attempts.append(key)
+        if len(attempts) == 1:
+            raise RuntimeError('boom')
+        return 'value'
+
+    loader = CachedLoader(TTLCache(maxsize=10), fetch=fetch)
+    with pytest.raises(RuntimeError):
+        asyncio.run(loader.get_async('k'))
+    assert asyncio.run(loader.get_async('k')) == 'value'
+    assert asyncio.run(loader.get_async('k')) == 'value'
+    assert len(attempts) == 2
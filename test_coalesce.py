@@ -0,0 +1,145 @@
+import asyncio
+import pytest
+import config
+from coalesce import Coalescer
+
+def test_burst_from_one_author_goes_out_as_one_post():
+    posts = []
+
+    async def send(text):
+        posts.append(text)
+        return len(posts)
+
+    async def main():
+        coalescer = Coalescer('test', window=0.05, max_length=2000)
+        return await asyncio.gather(
+            coalescer.submit('C1', 'U1', 'm1', '**U1**\nhello', send, continuation='hello'),
+            coalescer.submit('C1', 'U1', 'm2', '**U1**\nworld', send, continuation='world'),
+        )
+
+    results = asyncio.run(main())
+    assert posts == ['**U1**\nhello\nworld']
+    assert results == [(1, ['m1', 'm2'])] * 2
+
+def test_another_author_closes_the_burst():
+    posts = []
+
+    async def send(text):
+        posts.append(text)
+        return text
+
+    async def main():
+        coalescer = Coalescer('test', window=0.05, max_length=2000)
+        return await asyncio.gather(
+            coalescer.submit('C1', 'U1', 'm1', 'a', send),
+            coalescer.submit('C1', 'U2', 'm2', 'b', send),
+            coalescer.submit('C1', 'U2', 'm3', 'c', send),
+        )
+
+    results = asyncio.run(main())
+    assert posts == ['a', 'b\nc']
+    assert results == [('a', ['m1']), ('b\nc', ['m2', 'm3']), ('b\nc', ['m2', 'm3'])]
+
+def test_send_error_reaches_every_message_of_the_burst():
+    async def send(text):
+        raise RuntimeError('discord is down')
+
+    async def main():
+        coalescer = Coalescer('test', window=0.05, max_length=2000)
+        return await asyncio.gather(
+            coalescer.submit('C1', 'U1', 'm1', 'a', send),
+            coalescer.submit('C1', 'U1', 'm2', 'b', send),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(main())
+    assert [type(result) for result in results] == [RuntimeError, RuntimeError]
+
+def test_disabled_or_long_messages_are_sent_at_once():
+    async def send(text):
+        return text
+
+    async def main():
+        disabled = Coalescer('test', window=0, max_length=10)
+        enabled = Coalescer('test', window=0.05, max_length=10)
+        return (
+            await disabled.submit('C1', 'U1', 'm1', 'short', send),
+            await enabled.submit('C1', 'U1', 'm2', 'x' * 10, send),
+        )
+
+    assert asyncio.run(main()) == (('short', ['m1']), ('x' * 10, ['m2']))
+
+def test_flush_sends_the_pending_burst_first():
+    posts = []
+
+    async def send(text):
+        posts.append(text)
+        return text
+
+    async def main():
+        coalescer = Coalescer('test', window=10, max_length=2000)
+        pending = asyncio.ensure_future(coalescer.submit('C1', 'U1', 'm1', 'text', send))
+        await asyncio.sleep(0)
+        assert coalescer.pending() == 1
+        await coalescer.flush('C1')
+        posts.append('file')
+        return await pending
+
+    assert asyncio.run(main()) == ('text', ['m1'])
+    assert posts == ['text', 'file']
+
+@pytest.mark.parametrize('window', [0, 0.05])
+def test_unmergeable_message_waits_for_the_burst(window):
+    posts = []
+
+    async def send(text):
+        posts.append(text)
+        return text
+
+    async def main():
+        coalescer = Coalescer('test', window=window, max_length=5)
+        first = asyncio.ensure_future(coalescer.submit('C1', 'U1', 'm1', 'ab', send))
+        await asyncio.sleep(0)
+        await coalescer.submit('C1', 'U1', 'm2', 'long text', send)
+        await first
+
+    asyncio.run(main())
+    assert posts == ['ab', 'long text']
+
+def test_unmapped_discord_channels_are_not_merged(slack_bot, monkeypatch):
+    # Every unmapped Discord channel posts to the same Slack channel, each under its own header
+    import db
+    import discord_bot
+    from outbound import OutboundScheduler
+    from benchmarks.fakes import FakeDiscord, FakeMember, Recorder
+
+    posts = []
+
+    async def post_message(channel, text):
+        posts.append((channel, text))
+        return {'ts': f'1.{len(posts)}'}
+
+    async def save(*args):
+        pass
+
+    monkeypatch.setattr(config, 'SLACK_CHANNEL_DISCORD', 'CDISCORD')
+    monkeypatch.setattr(slack_bot.slack_client, 'chat_postMessage', post_message)
+    monkeypatch.setattr(db, 'save_message_to_db_async', save)
+    monkeypatch.setattr(db, 'save_alias_async', save)
+    monkeypatch.setattr(discord_bot, 'slack_coalescer', Coalescer('slack', window=0.05, max_length=4000))
+    monkeypatch.setattr(discord_bot, 'slack_outbound', OutboundScheduler('slack', rate=1000, burst=1000, max_retries=0, retry_after=lambda error: None))
+
+    fake = FakeDiscord(Recorder())
+    author = FakeMember(500, 'alice')
+    first = fake.new_message(fake.add_channel(1, 'a'), author, 'first')
+    second = fake.new_message(fake.add_channel(2, 'b'), author, 'second')
+    third = fake.new_message(fake.channels[2], author, 'third')
+
+    async def main():
+        await asyncio.gather(*(discord_bot.send_new_message_to_slack(message) for message in (first, second, third)))
+
+    asyncio.run(main())
+    assert posts == [
+        ('CDISCORD', '💂*_alice_* 🔉*_#a_*\nfirst'),
+        ('CDISCORD', '💂*_alice_* 🔉*_#b_*\nsecond\nthird'),
+    ]
@@ -0,0 +1,45 @@
+import asyncio
+from aiohttp import web
+import http_sessions
+from discord_webhooks import WebhookSender
+
+async def send_through(responses):
+    # Serves `responses` in order to WebhookSender.send and returns (result, requests seen)
+    seen = []
+
+    async def handle(request):
+        seen.append(await request.json())
+        return responses[len(seen) - 1]
+
+    app = web.Application()
+    app.router.add_post('/webhook', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        sender = WebhookSender(max_retries=2, timeout=5)
+        result = await sender.send(f'http://127.0.0.1:{port}/webhook', {'content': 'hi'})
+    finally:
+        await http_sessions.close_sessions()
+        await runner.cleanup()
+    return result, seen
+
+def test_429_with_json_body_is_retried():
+    responses = [
+        web.json_response({'retry_after': 0.01, 'global': False}, status=429),
+        web.Response(status=204),
+    ]
+    result, seen = asyncio.run(send_through(responses))
+    assert result is True
+    assert len(seen) == 2
+
+def test_429_with_html_body_falls_back_to_headers():
+    responses = [
+        web.Response(status=429, text='<html>Cloudflare</html>', content_type='text/html', headers={'Retry-After': '0.01'}),
+        web.Response(status=204),
+    ]
+    result, seen = asyncio.run(send_through(responses))
+    assert result is True
+    assert len(seen) == 2
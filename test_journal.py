@@ -0,0 +1,122 @@
+import time
+import asyncio
+import sqlite3
+import pytest
+import config
+from journal import Journal
+
+def status(journal, entry_id):
+    with sqlite3.connect(journal.path) as conn:
+        return conn.execute('SELECT status FROM entries WHERE id = ?', (entry_id,)).fetchone()[0]
+
+@pytest.fixture
+def journal(tmp_path):
+    return Journal(str(tmp_path / 'journal.sqlite3'))
+
+@pytest.fixture
+def relay(slack_bot, journal, monkeypatch):
+    # Runs process_journal_entry against a fresh journal; outcomes lists what slack_events
+    # should do on each call: None to succeed, an exception to raise
+    calls = []
+    outcomes = []
+
+    async def slack_events(payload):
+        calls.append(payload)
+        outcome = outcomes.pop(0) if outcomes else None
+        if outcome is not None:
+            raise outcome
+
+    monkeypatch.setattr(slack_bot, 'journal', journal)
+    monkeypatch.setattr(slack_bot, 'slack_events', slack_events)
+    monkeypatch.setattr(config, 'JOURNAL_RETRY_DELAY', 0.01)
+    monkeypatch.setattr(config, 'JOURNAL_MAX_ATTEMPTS', 3)
+    return calls, outcomes
+
+def test_pending_entries_and_cursor(journal):
+    first = journal.append('slack_event', {'n': 1}, event_id='E1')
+    second = journal.append('slack_event', {'n': 2})
+
+    entries = journal.pending()
+    assert [entry[:4] for entry in entries] == [(first, 'slack_event', {'n': 1}, 0), (second, 'slack_event', {'n': 2}, 0)]
+    assert abs(entries[0][4] - time.time()) < 5
+    assert [entry[0] for entry in journal.pending(after=first)] == [second]
+    assert journal.has_event('E1') and not journal.has_event('E2')
+
+    journal.mark_attempt(first)
+    journal.mark_done(second)
+    assert [entry[:4] for entry in journal.pending()] == [(first, 'slack_event', {'n': 1}, 1)]
+    assert journal.count_pending() == 1
+
+def test_relayed_entry_is_marked_done(slack_bot, journal, relay):
+    calls, _ = relay
+    entry_id = journal.append('slack_event', {'event': {}})
+
+    asyncio.run(slack_bot.process_journal_entry(entry_id, 'slack_event', {'event': {}}))
+
+    assert len(calls) == 1
+    assert journal.count_pending() == 0
+
+def test_failed_entry_is_retried_then_marked_done(slack_bot, journal, relay):
+    calls, outcomes = relay
+    outcomes.append(RuntimeError('discord is down'))
+    entry_id = journal.append('slack_event', {'event': {}})
+
+    async def main():
+        await slack_bot.process_journal_entry(entry_id, 'slack_event', {'event': {}})
+        # Still pending after the failure, with the attempt counted
+        assert [entry[3] for entry in journal.pending()] == [1]
+        await asyncio.sleep(0.1)
+
+    asyncio.run(main())
+    assert len(calls) == 2
+    assert journal.count_pending() == 0
+
+def test_entry_is_dropped_after_max_attempts(slack_bot, journal, relay):
+    calls, outcomes = relay
+    outcomes.extend([RuntimeError('down')] * 5)
+    entry_id = journal.append('slack_event', {'event': {}})
+
+    async def main():
+        await slack_bot.process_journal_entry(entry_id, 'slack_event', {'event': {}})
+        await asyncio.sleep(0.2)
+
+    asyncio.run(main())
+    assert len(calls) == config.JOURNAL_MAX_ATTEMPTS
+    assert journal.count_pending() == 0
+    assert status(journal, entry_id) == 'failed'
+
+def test_entry_out_of_attempts_is_failed_without_another_attempt(slack_bot, journal, relay):
+    calls, _ = relay
+    entry_id = journal.append('slack_event', {'event': {}})
+
+    asyncio.run(slack_bot.process_journal_entry(entry_id, 'slack_event', {'event': {}}, attempts=config.JOURNAL_MAX_ATTEMPTS))
+    assert calls == []
+    assert status(journal, entry_id) == 'failed'
+
+def test_old_entry_is_dropped(slack_bot, journal, relay):
+    calls, _ = relay
+    entry_id = journal.append('slack_event', {'event': {}})
+
+    created_at = time.time() - config.JOURNAL_MAX_AGE - 1
+    asyncio.run(slack_bot.process_journal_entry(entry_id, 'slack_event', {'event': {}}, created_at=created_at))
+
+    assert calls == []
+    assert journal.count_pending() == 0
+    assert status(journal, entry_id) == 'failed'
+
+def test_replay_runs_every_entry_once(slack_bot, journal, relay):
+    calls, outcomes = relay
+    outcomes.append(RuntimeError('down'))
+    for n in range(3):
+        journal.append('slack_event', {'n': n})
+    journal.replay_up_to = 3
+
+    async def main():
+        await slack_bot.replay_journal()
+        # The failed first entry is left to its retry timer, not replayed again right away
+        assert [payload['n'] for payload in calls] == [0, 1, 2]
+        await asyncio.sleep(0.1)
+
+    asyncio.run(main())
+    assert [payload['n'] for payload in calls] == [0, 1, 2, 0]
+    assert journal.count_pending() == 0
@@ -0,0 +1,44 @@
+import os
+import atexit
+import logging
+import subprocess
+import sys
+import log_config
+
+def test_log_file_is_truncated_on_start(tmp_path):
+    log_file = tmp_path / 'logs' / 'app.log'
+    log_file.parent.mkdir()
+    log_file.write_text('previous run\n')
+
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    listener = log_config.setup_logging(str(log_file))
+    try:
+        logging.getLogger('test').warning('new run')
+    finally:
+        listener.stop()
+        atexit.unregister(listener.stop)
+        for handler in listener.handlers:
+            handler.close()
+        root.handlers[:] = handlers
+        root.setLevel(level)
+
+    text = log_file.read_text()
+    assert 'previous run' not in text
+    assert 'new run' in text
+
+def test_stale_worker_logs_are_removed(tmp_path):
+    # A pid that is certainly gone: a child that has already exited
+    child = subprocess.Popen([sys.executable, '-c', 'pass'])
+    child.wait()
+    names = [
+        f'ingress-{child.pid}.log', f'ingress-{child.pid}.log.1',
+        f'ingress-{os.getpid()}.log', 'app.log', 'ingress-notes.txt',
+    ]
+    for name in names:
+        (tmp_path / name).write_text('')
+
+    log_config.remove_stale_worker_logs(str(tmp_path))
+
+    assert sorted(os.listdir(tmp_path)) == sorted([f'ingress-{os.getpid()}.log', 'app.log', 'ingress-notes.txt'])
+    log_config.remove_stale_worker_logs(str(tmp_path / 'missing'))
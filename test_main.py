@@ -0,0 +1,124 @@
+import json
+import sqlite3
+import asyncio
+import pytest
+import metrics
+from benchmarks.fakes import sign
+
+@pytest.fixture
+def app(main):
+    return main.app
+
+@pytest.fixture
+def processed(main, monkeypatch):
+    # Payloads handed to the background relay; events are journaled but not relayed
+    payloads = []
+
+    async def process_journal_entry(entry_id, kind, payload):
+        payloads.append(payload)
+
+    monkeypatch.setattr(main, 'process_journal_entry', process_journal_entry)
+    return payloads
+
+def post(app, path, body, headers):
+    # Drives the ASGI app directly; returns (status, headers, parsed JSON body)
+    async def run():
+        requests = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        sent = []
+
+        async def receive():
+            return requests.pop(0) if requests else {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        await app({
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': 'POST', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+            'query_string': b'', 'root_path': '', 'client': ('127.0.0.1', 1), 'server': ('testserver', 80),
+            'headers': [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+        }, receive, send)
+        return sent
+
+    sent = asyncio.run(run())
+    start = next(message for message in sent if message['type'] == 'http.response.start')
+    content = b''.join(message.get('body', b'') for message in sent if message['type'] == 'http.response.body')
+    response_headers = {name.decode().lower(): value.decode() for name, value in start['headers']}
+    return start['status'], response_headers, json.loads(content)
+
+def event_body(event_id, text='hello'):
+    return json.dumps({
+        'type': 'event_callback', 'event_id': event_id,
+        'event': {'type': 'message', 'user': 'U1', 'channel': 'C1', 'text': text, 'ts': '1.0001'},
+    }).encode()
+
+def ingress_count(status):
+    return metrics.ingress_requests._values.get(('/slack/events', str(status)), 0)
+
+def test_signed_event_is_accepted(app, processed, fake_slack):
+    body = event_body('EvOK')
+    status, _, content = post(app, '/slack/events', body, sign(fake_slack.signing_secret, body))
+    assert status == 200 and content == {'status': 'ok'}
+    assert [payload['event_id'] for payload in processed] == ['EvOK']
+
+def test_bad_signature_is_rejected(app, processed):
+    body = event_body('EvBAD')
+    before = ingress_count(400)
+    status, _, _ = post(app, '/slack/events', body, sign('wrong-secret', body))
+    assert status == 400
+    assert ingress_count(400) == before + 1
+    assert processed == []
+
+@pytest.mark.parametrize('headers', [
+    {},
+    {'X-Slack-Signature': 'v0=abc'},
+    {'X-Slack-Request-Timestamp': 'not-a-number', 'X-Slack-Signature': 'v0=abc'},
+])
+def test_missing_or_broken_signature_headers_are_rejected(app, processed, headers):
+    before = ingress_count(400)
+    status, _, _ = post(app, '/slack/events', event_body('EvHDR'), headers)
+    assert status == 400
+    assert ingress_count(400) == before + 1
+
+def test_malformed_body_is_rejected(app, processed, fake_slack):
+    body = b'{"type": "event_callback", '
+    status, _, content = post(app, '/slack/events', body, sign(fake_slack.signing_secret, body))
+    assert status == 400
+    assert content == {'detail': 'Malformed request body'}
+
+def test_retry_of_accepted_event_is_acked(app, processed, fake_slack):
+    body = event_body('EvRETRY')
+    assert post(app, '/slack/events', body, sign(fake_slack.signing_secret, body))[0] == 200
+
+    # Acked from the raw bytes, before the signature check or parsing
+    headers = {'X-Slack-Retry-Num': '1', 'X-Slack-Retry-Reason': 'http_timeout'}
+    status, response_headers, content = post(app, '/slack/events', body, headers)
+    assert status == 200 and content == {'status': 'duplicate'}
+    assert response_headers['x-slack-no-retry'] == '1'
+    assert len(processed) == 1
+
+def test_retry_of_unknown_event_is_processed(app, processed, fake_slack):
+    body = event_body('EvNEW')
+    headers = dict(sign(fake_slack.signing_secret, body), **{'X-Slack-Retry-Num': '1'})
+    status, _, content = post(app, '/slack/events', body, headers)
+    assert status == 200 and content == {'status': 'ok'}
+    assert len(processed) == 1
+
+def test_event_is_only_acked_as_duplicate_once_journaled(main, app, processed, fake_slack, monkeypatch):
+    body = event_body('EvLOCKED')
+
+    def locked(*args, **kwargs):
+        raise sqlite3.OperationalError('database is locked')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(main.journal, 'append', locked)
+        with pytest.raises(sqlite3.OperationalError):
+            post(app, '/slack/events', body, sign(fake_slack.signing_secret, body))
+    assert 'EvLOCKED' not in main.accepted_events
+
+    # Slack's retry is journaled and processed instead of being acked as a duplicate
+    headers = dict(sign(fake_slack.signing_secret, body), **{'X-Slack-Retry-Num': '1'})
+    status, _, content = post(app, '/slack/events', body, headers)
+    assert status == 200 and content == {'status': 'ok'}
+    assert 'EvLOCKED' in main.accepted_events
+    assert len(processed) == 1
@@ -0,0 +1,76 @@
+import asyncio
+import mentions
+from cache import TTLCache, CachedLoader
+
+USERS = {
+    'U1': {'id': 'U1', 'real_name': 'Ada Lovelace'},
+    'U2': {'id': 'U2', 'real_name': 'Alan Turing'},
+}
+CHANNELS = {'C1': {'id': 'C1', 'name': 'general'}}
+
+def loader(data, fetched):
+    async def fetch_async(key):
+        fetched.append(key)
+        await asyncio.sleep(0)
+        if key not in data:
+            raise LookupError(key)
+        return data[key]
+    return CachedLoader(TTLCache(maxsize=100), fetch=fetch_async)
+
+def translate(text, user_profiles, channel_info):
+    return asyncio.run(mentions.translate(text, user_profiles, channel_info))
+
+def test_translates_every_kind_of_reference():
+    fetched = []
+    user_profiles, channel_info = loader(USERS, fetched), loader(CHANNELS, fetched)
+    text = 'hi <@U1> and <@U2|alan>, see <#C1> and <#C9|random> <!here> <!subteam^S1|@team> <!date^1|Jan 1>'
+
+    assert translate(text, user_profiles, channel_info) == (
+        'hi @Ada Lovelace and @Alan Turing, see #general and #random '
+        f'@{mentions.ZERO_WIDTH_SPACE}here @team Jan 1'
+    )
+    # Labelled channels need no lookup
+    assert sorted(fetched) == ['C1', 'U1', 'U2']
+
+def test_unknown_references_are_left_as_is():
+    fetched = []
+    text = '<@U404> <@U405|someone> <#C404>'
+    assert translate(text, loader(USERS, fetched), loader(CHANNELS, fetched)) == '<@U404> @someone <#C404>'
+
+def test_text_without_references_is_returned_unchanged():
+    fetched = []
+    for text in ('', None, 'a < b', 'plain text'):
+        assert translate(text, loader(USERS, fetched), loader(CHANNELS, fetched)) == text
+    assert fetched == []
+
+def test_cache_is_consulted_once_per_lookup():
+    fetched = []
+    user_profiles, channel_info = loader(USERS, fetched), loader(CHANNELS, fetched)
+
+    translate('<@U1> <@U1> <#C1>', user_profiles, channel_info)
+    translate('<@U1> <#C1>', user_profiles, channel_info)
+
+    assert sorted(fetched) == ['C1', 'U1']
+    assert user_profiles.stats()['hits'] == 1 and user_profiles.stats()['misses'] == 1
+    assert channel_info.stats()['hits'] == 1 and channel_info.stats()['misses'] == 1
+
+def test_users_and_channels_are_looked_up_together():
+    started = []
+
+    async def main():
+        gate = asyncio.Event()
+
+        def blocking_loader(data):
+            async def fetch_async(key):
+                started.append(key)
+                if len(started) == 2:
+                    gate.set()
+                # Would time out if the channel lookup only started after the user's
+                await asyncio.wait_for(gate.wait(), 1)
+                return data[key]
+            return CachedLoader(TTLCache(maxsize=10), fetch=fetch_async)
+
+        return await mentions.translate('<@U1> <#C1>', blocking_loader(USERS), blocking_loader(CHANNELS))
+
+    assert asyncio.run(main()) == '@Ada Lovelace #general'
+    assert sorted(started) == ['C1', 'U1']
@@ -0,0 +1,81 @@
+import asyncio
+import pytest
+from outbound import OutboundScheduler, TokenBucket
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__('rate limited')
+        self.retry_after = retry_after
+
+def retry_after(error):
+    return error.retry_after if isinstance(error, RateLimited) else None
+
+def scheduler(max_retries=3):
+    return OutboundScheduler('test', rate=1000, burst=1000, max_retries=max_retries, retry_after=retry_after)
+
+def test_token_bucket_waits_for_a_refill():
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    assert 0 < bucket.take() <= 0.1
+
+    bucket.block(5)
+    assert bucket.take() > 4
+
+def test_posts_to_one_destination_keep_their_order():
+    sent = []
+
+    async def post(text):
+        await asyncio.sleep(0.001 * (len(text) % 3))
+        sent.append(text)
+        return text
+
+    async def main():
+        outbound = scheduler()
+        return await asyncio.gather(*(outbound.submit('C1', post, f'message {i}') for i in range(20)))
+
+    results = asyncio.run(main())
+    expected = [f'message {i}' for i in range(20)]
+    assert results == expected
+    assert sent == expected
+
+def test_rate_limited_post_is_retried_before_later_ones():
+    sent = []
+    limited = []
+
+    async def post(text):
+        if text == 'first' and not limited:
+            limited.append(text)
+            raise RateLimited(0.01)
+        sent.append(text)
+        return text
+
+    async def main():
+        outbound = scheduler()
+        results = await asyncio.gather(*(outbound.submit('C1', post, text) for text in ('first', 'second', 'third')))
+        return results, outbound.stats()
+
+    results, stats = asyncio.run(main())
+    assert results == ['first', 'second', 'third']
+    assert sent == ['first', 'second', 'third']
+    assert stats['rate_limited'] == 1
+    assert stats['queued'] == 0
+
+def test_errors_reach_the_caller():
+    async def post():
+        raise ValueError('bad payload')
+
+    async def rate_limited():
+        raise RateLimited(0)
+
+    async def main():
+        outbound = scheduler(max_retries=2)
+        with pytest.raises(ValueError):
+            await outbound.submit('C1', post)
+        with pytest.raises(RateLimited):
+            await outbound.submit('C1', rate_limited)
+        return outbound.stats()
+
+    stats = asyncio.run(main())
+    assert stats['errors'] == 2
+    assert stats['rate_limited'] == 2
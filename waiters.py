@@ -0,0 +1,76 @@
+import asyncio
+import threading
+from cache import TTLCache
+
+_MISSING = object()
+POKED = object()  # wait() result when the key was nudged without a value
+
+class WaiterRegistry:
+    # Coroutines await a value by key; any thread may resolve it.
+    # Values resolved before anyone waits are kept briefly, so the order of
+    # resolve() and wait() does not matter.
+
+    def __init__(self, keep_results=4096, result_ttl=120):
+        self._waiters = {}  # key -> [(loop, future), ...]
+        self._results = TTLCache(maxsize=keep_results, ttl=result_ttl)
+        self._lock = threading.Lock()
+
+    def resolve(self, key, value):
+        with self._lock:
+            self._results.set(key, value)
+            waiters = self._waiters.pop(key, [])
+        _wake(waiters, value)
+
+    def poke(self, key):
+        # Wake current waiters without a value, e.g. to make them poll right away
+        with self._lock:
+            waiters = self._waiters.pop(key, [])
+        _wake(waiters, POKED)
+
+    def peek(self, key):
+        return self._results.get(key, None)
+
+    async def wait(self, key, timeout):
+        # Raises asyncio.TimeoutError if nothing resolves the key in time
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = (loop, future)
+
+        with self._lock:
+            value = self._results.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+            self._waiters.setdefault(key, []).append(waiter)
+
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(key)
+                if waiters and waiter in waiters:
+                    waiters.remove(waiter)
+                    if not waiters:
+                        del self._waiters[key]
+
+    def pending(self):
+        with self._lock:
+            return sum(len(waiters) for waiters in self._waiters.values())
+
+def _wake(waiters, value):
+    for loop, future in waiters:
+        try:
+            loop.call_soon_threadsafe(_set_result, future, value)
+        except RuntimeError:
+            # The waiter's loop is already closed
+            pass
+
+def _set_result(future, value):
+    if not future.done():
+        future.set_result(value)
+
+# Message ts of files uploaded by discord_bot, pushed by Slack file_share message events
+file_shares = WaiterRegistry()
+
+# Slack <-> Discord message mappings, resolved by db.save_message_to_db.
+# Keys are ('slack', slack_message_id) and ('discord', discord_message_id).
+message_mappings = WaiterRegistry()